@@ -1,11 +1,18 @@
-from supabase import create_client, Client
 from fastapi import Depends, HTTPException, Request
-from typing import Optional, Literal, List, Dict, Any
+from typing import TYPE_CHECKING, Optional, Literal, List, Dict, Any
 from datetime import datetime
 from pydantic import BaseModel
 import os
+import hashlib
 import logging
 from dotenv import load_dotenv
+from app.core.cache import TTLCache
+from app.core.clients import get_service_supabase
+from app.core.resilience import JOB_DEADLINE
+from app.core.scheduler import generation_scheduler
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 load_dotenv()
 
@@ -15,7 +22,8 @@ logger = logging.getLogger(__name__)
 # Type definitions
 TokenOperationType = Literal["token_balance"]
 
-__all__ = ['TokenOperationType', 'User', 'UserIdentity', 'get_current_user', 'get_supabase_client']
+__all__ = ['TokenOperationType', 'TokenReservation', 'User', 'UserIdentity', 'get_current_user', 'get_supabase_client',
+           'reserve_tokens', 'commit_reservation', 'release_reservation', 'reservation_hold']
 
 class UserIdentity(BaseModel):
     id: str
@@ -52,13 +60,29 @@ class User(BaseModel):
     is_anonymous: bool
     factors: Optional[Any]
 
-def get_supabase_client() -> Client:
-    """Create and return a Supabase client instance"""
+def get_supabase_client() -> "Client":
+    """Return the shared service-role Supabase client"""
+    return get_service_supabase()
+
+def get_user_supabase_client(access_token: str, refresh_token: str) -> "Client":
+    """Create a Supabase client acting as the user behind the given session tokens"""
+    from supabase import create_client
+
     url = os.getenv("SUPABASE_URL")
     key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
     if not url or not key:
         raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set in environment variables")
-    return create_client(url, key)
+    supabase = create_client(url, key)
+    supabase.auth.set_session(access_token, refresh_token)
+    return supabase
+
+# Verified tokens, so repeat requests with the same bearer token skip the auth server.
+# A revoked token keeps working for at most AUTH_CACHE_TTL seconds. Nothing invalidates
+# entries early, so that bound holds however many workers there are.
+_verified_users: TTLCache[User] = TTLCache(
+    ttl_seconds=float(os.getenv("AUTH_CACHE_TTL", "60")),
+    max_entries=int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+)
 
 def get_current_user(request: Request) -> User:
     """Get the current user from the request's auth header"""
@@ -67,11 +91,19 @@ def get_current_user(request: Request) -> User:
         raise HTTPException(status_code=401, detail="No authorization header")
         
     try:
+        token = auth_header.split(" ")[1]
+        token_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        user = _verified_users.get(token_key)
+        if user is not None:
+            return user
+        
         supabase = get_supabase_client()
-        user_result = supabase.auth.get_user(auth_header.split(" ")[1])
+        user_result = supabase.auth.get_user(token)
         if not user_result.user:
             raise HTTPException(status_code=401, detail="Invalid user token")
-        return User(**user_result.user.model_dump())
+        user = User(**user_result.user.model_dump())
+        _verified_users.set(token_key, user)
+        return user
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid user token: {str(e)}")
 
@@ -116,20 +148,123 @@ async def reduce_tokens(
     user_id: str, 
     operation_type: TokenOperationType,
     amount: int = 1
-) -> None:
+) -> Optional[int]:
     """
     Reduce the user's token count for the specified operation.
     Should only be called after successful completion of the operation.
+    The decrement happens atomically in the database and never goes below zero.
+    Returns the new balance, or None if the user has no token record.
     """
     supabase = get_supabase_client()
     
-    result = supabase.table("user_tokens").select("*").eq("user_id", user_id).execute()
-    if not result.data:
+    result = supabase.rpc("consume_tokens", {"p_user_id": user_id, "p_amount": amount}).execute()
+    if result.data is None:
         logger.error(f"No token record found for user {user_id} when trying to reduce tokens")
-        return
+    return result.data
+
+# A reservation outlives the longest a live job can hold it by this factor before
+# the stale sweep treats it as abandoned and refunds it
+RESERVATION_MARGIN = float(os.getenv("RESERVATION_MARGIN", "2"))
+
+def reservation_hold(queue_waits: int = 1) -> float:
+    """
+    Seconds a job may hold its token reservation.
+
+    Args:
+        queue_waits: Times the job may wait for a generation slot; a batch
+            waits once per round of BATCH_CONCURRENCY items
+
+    Returns:
+        The waits for a slot plus the job's deadline, times RESERVATION_MARGIN
+    """
+    return RESERVATION_MARGIN * (queue_waits * generation_scheduler.queue_timeout + JOB_DEADLINE)
+
+class TokenReservation(BaseModel):
+    id: str
+    user_id: str
+    amount: int
+    token_balance: int
+
+async def reserve_tokens(
+    user_id: str,
+    amount: int = 1,
+    supabase: Optional["Client"] = None,
+    hold_seconds: Optional[float] = None
+) -> TokenReservation:
+    """
+    Atomically take tokens for an operation before it starts.
+    Commit the reservation once the operation succeeds, release it if it fails.
+    The reservation is refunded by the stale sweep if it is still open after
+    hold_seconds, reservation_hold() by default.
+    Raises HTTPException (402) if the user has no allocation or not enough tokens.
+    """
+    supabase = supabase or get_supabase_client()
+    hold_seconds = reservation_hold() if hold_seconds is None else hold_seconds
+    
+    result = supabase.rpc("reserve_tokens", {
+        "p_user_id": user_id,
+        "p_amount": amount,
+        "p_hold": f"{hold_seconds:.0f} seconds"
+    }).execute()
+    row = result.data[0] if result.data else {}
+    
+    if row.get("token_balance") is None:
+        raise HTTPException(
+            status_code=402, 
+            detail={
+                "message": "No token allocation found. Please subscribe to a plan.",
+                "code": "NO_TOKENS"
+            }
+        )
+    if row.get("reservation_id") is None:
+        raise HTTPException(
+            status_code=402,
+            detail={
+                "message": "Not enough token balance remaining. Please upgrade your plan.",
+                "code": "INSUFFICIENT_TOKENS"
+            }
+        )
         
-    tokens = result.data[0]
-    current_tokens = tokens[operation_type]
+    return TokenReservation(
+        id=row["reservation_id"],
+        user_id=user_id,
+        amount=amount,
+        token_balance=row["token_balance"]
+    )
+
+async def commit_reservation(
+    reservation: TokenReservation,
+    supabase: Optional["Client"] = None,
+    amount: Optional[int] = None
+) -> Optional[int]:
+    """Mark reserved tokens as spent and return the user's balance
     
-    update_data = {operation_type: max(0, current_tokens - amount)}
-    supabase.table("user_tokens").update(update_data).eq("user_id", user_id).execute() 
\ No newline at end of file
+    With `amount`, only that many tokens are spent and the rest of the reservation is refunded.
+    """
+    supabase = supabase or get_supabase_client()
+    try:
+        result = supabase.rpc("commit_token_reservation", {
+            "p_reservation_id": reservation.id,
+            "p_amount": amount
+        }).execute()
+        return result.data
+    except Exception as e:
+        # The tokens stay deducted; the stale-reservation sweep refunds them if this never succeeds
+        logger.error(f"Failed to commit token reservation {reservation.id}: {str(e)}")
+        return reservation.token_balance
+
+async def release_reservation(reservation: TokenReservation, supabase: Optional["Client"] = None) -> Optional[int]:
+    """Refund reserved tokens after a failed operation and return the user's balance"""
+    supabase = supabase or get_supabase_client()
+    try:
+        result = supabase.rpc("release_token_reservation", {"p_reservation_id": reservation.id}).execute()
+        return result.data
+    except Exception as e:
+        logger.error(f"Failed to release token reservation {reservation.id}: {str(e)}")
+        return None
+
+async def release_stale_reservations() -> int:
+    """Refund reservations left behind by workers that died mid-operation, i.e. held past their expiry"""
+    supabase = get_supabase_client()
+    result = supabase.rpc("release_stale_token_reservations", {}).execute()
+    return result.data or 0
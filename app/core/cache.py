@@ -0,0 +1,300 @@
+from collections import OrderedDict
+from fastapi import Request, Response
+from typing import Any, Awaitable, Callable, Dict, Generic, Optional, Tuple, TypeVar
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['TTLCache', 'MemoryCacheBackend', 'RedisCacheBackend', 'ResponseCache', 'response_cache', 'single_worker',
+           'local_cache_ttl']
+
+T = TypeVar("T")
+
+
+def single_worker() -> bool:
+    """Whether this process is the only worker, so a per-process cache sees every write"""
+    return int(os.getenv("WEB_CONCURRENCY", "1")) <= 1
+
+
+def local_cache_ttl(env: str, default: float, several_workers: float = 0.0) -> float:
+    """
+    TTL for a cache kept in this process only.
+
+    Writes on one worker can't invalidate another worker's copy, so unless
+    `env` sets a TTL explicitly, several workers get `several_workers`: how
+    long a copy may safely outlive a write made elsewhere.
+
+    Args:
+        env: Environment variable overriding the TTL
+        default: TTL with a single worker
+        several_workers: TTL with several workers; 0 turns the cache off
+
+    Returns:
+        The TTL in seconds; 0 turns the cache off
+    """
+    if os.getenv(env):
+        return float(os.environ[env])
+    return default if single_worker() else several_workers
+
+
+class TTLCache(Generic[T]):
+    """Thread-safe LRU cache whose entries expire after a fixed TTL; a TTL of 0 stores nothing"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, T]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[T]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: T, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def replace(self, key: str, update: Callable[[T], T]) -> None:
+        """Apply `update` to an entry's value, keeping its expiry; no-op if the key isn't cached"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                self._entries[key] = (expires_at, update(value))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class _UserResponses:
+    def __init__(self, version: int, max_entries: int):
+        self.version = version
+        self.entries: TTLCache[dict] = TTLCache(ttl_seconds=0, max_entries=max_entries)
+
+
+class MemoryCacheBackend:
+    """
+    Per-process storage for ResponseCache.
+
+    A user's version and cached responses are kept in one record, bounded by
+    `max_users` and `max_entries_per_user`. Bumping the version replaces the
+    record, and evicting it drops both together, so a forgotten version can
+    never make an older response current again.
+
+    Args:
+        max_users: Users whose responses are kept, least recently used evicted first
+        max_entries_per_user: Responses kept per user
+        ttl_seconds: How long an unused user record is kept; at least the responses' lifetime
+    """
+
+    def __init__(self, max_users: int = 10000, max_entries_per_user: int = 64, ttl_seconds: float = 330.0):
+        self.max_entries_per_user = max_entries_per_user
+        self._users: TTLCache[_UserResponses] = TTLCache(ttl_seconds=ttl_seconds, max_entries=max_users)
+
+    @staticmethod
+    def _owner(key: str) -> Tuple[str, int]:
+        # ResponseCache keys start with "<user_id>:<version>:"
+        user_id, version, _ = key.split(":", 2)
+        return user_id, int(version)
+
+    async def get(self, key: str) -> Optional[dict]:
+        user_id, version = self._owner(key)
+        record = self._users.get(user_id)
+        if record is None or record.version != version:
+            return None
+        return record.entries.get(key)
+
+    async def set(self, key: str, entry: dict, ttl_seconds: float) -> None:
+        user_id, version = self._owner(key)
+        record = self._users.get(user_id)
+        if record is None and version == 0:
+            record = _UserResponses(0, self.max_entries_per_user)
+        if record is None or record.version != version:
+            # Computed before the user's data changed; keeping it would serve it as current
+            return
+        record.entries.set(key, entry, ttl_seconds)
+        self._users.set(user_id, record, max(ttl_seconds, self._users.ttl_seconds))
+
+    async def get_version(self, user_id: str) -> int:
+        record = self._users.get(user_id)
+        return record.version if record is not None else 0
+
+    async def bump_version(self, user_id: str) -> None:
+        record = self._users.get(user_id)
+        self._users.set(user_id, _UserResponses((record.version if record else 0) + 1, self.max_entries_per_user))
+
+
+class RedisCacheBackend:
+    """Storage shared by all workers, so invalidation on one worker is seen by every other"""
+
+    def __init__(self, url: str, prefix: str = "fotnik:responses"):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+
+    async def get(self, key: str) -> Optional[dict]:
+        raw = await self._redis.get(f"{self._prefix}:entry:{key}")
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, entry: dict, ttl_seconds: float) -> None:
+        await self._redis.set(f"{self._prefix}:entry:{key}", json.dumps(entry), ex=max(1, int(ttl_seconds)))
+
+    async def get_version(self, user_id: str) -> int:
+        raw = await self._redis.get(f"{self._prefix}:version:{user_id}")
+        return int(raw) if raw else 0
+
+    async def bump_version(self, user_id: str) -> None:
+        await self._redis.incr(f"{self._prefix}:version:{user_id}")
+
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+class ResponseCache:
+    """
+    Per-user read-through cache for JSON GET responses.
+
+    Responses are keyed by user, path and query string. Each user has a
+    version number that write handlers bump through invalidate_user, which
+    orphans every cached response for that user at once. Entries are fresh
+    for `ttl_seconds`; for a further `stale_seconds` they are still served
+    while a background task recomputes them. Every response carries an
+    ETag, and a matching If-None-Match gets an empty 304. Without a backend
+    every response is computed.
+    """
+
+    def __init__(self, backend, ttl_seconds: float = 30.0, stale_seconds: float = 300.0):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        # Held so the event loop, which only keeps weak references, can't collect a task mid-flight
+        self._revalidating: Dict[str, asyncio.Task] = {}
+
+    async def _key(self, request: Request, user_id: str) -> str:
+        version = await self.backend.get_version(str(user_id))
+        query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+        return f"{user_id}:{version}:{request.url.path}?{query}"
+
+    async def _store(self, key: str, response: Response) -> Optional[dict]:
+        # Streaming responses have no body to keep and are passed through uncached
+        if response.status_code != 200 or getattr(response, "body", None) is None:
+            return None
+        body = bytes(response.body)
+        entry = {
+            "body": body.decode("utf-8"),
+            # Weak, since the compression middleware sends the same entity as identity, gzip or brotli bytes
+            "etag": f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"',
+            "media_type": response.media_type,
+            "headers": {k: v for k, v in response.headers.items() if k.lower().startswith("x-")},
+            "stored_at": time.time()
+        }
+        await self.backend.set(key, entry, self.ttl_seconds + self.stale_seconds)
+        return entry
+
+    async def _revalidate(self, key: str, compute: Callable[[], Awaitable[Response]]) -> None:
+        try:
+            await self._store(key, await compute())
+        except Exception as e:
+            logger.warning(f"Background revalidation of {key} failed: {str(e)}")
+        finally:
+            self._revalidating.pop(key, None)
+
+    @staticmethod
+    def _serve(request: Request, entry: dict) -> Response:
+        headers = dict(entry["headers"])
+        headers["ETag"] = entry["etag"]
+        headers["Cache-Control"] = "private, no-cache"
+        if_none_match = request.headers.get("if-none-match", "")
+        # If-None-Match uses the weak comparison, so W/"x" and "x" match each other
+        if if_none_match.strip() == "*" or _opaque_tag(entry["etag"]) in [
+            _opaque_tag(tag) for tag in if_none_match.split(",")
+        ]:
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry["body"], media_type=entry["media_type"], headers=headers)
+
+    async def respond(self, request: Request, user_id: str, compute: Callable[[], Awaitable[Response]]) -> Response:
+        """
+        Serve the request from cache, computing and storing the response on a miss.
+
+        Args:
+            request: The incoming GET request
+            user_id: ID of the authenticated user the response belongs to
+            compute: Coroutine function that builds the uncached response
+
+        Returns:
+            The cached or freshly computed response, or a 304
+        """
+        if self.backend is None:
+            return await compute()
+        key = await self._key(request, user_id)
+        entry = await self.backend.get(key)
+
+        if entry is not None:
+            age = time.time() - entry["stored_at"]
+            if age < self.ttl_seconds:
+                return self._serve(request, entry)
+            if age < self.ttl_seconds + self.stale_seconds:
+                if key not in self._revalidating:
+                    self._revalidating[key] = asyncio.create_task(self._revalidate(key, compute))
+                return self._serve(request, entry)
+
+        response = await compute()
+        entry = await self._store(key, response)
+        return self._serve(request, entry) if entry else response
+
+    async def invalidate_user(self, user_id: str) -> None:
+        """Drop every cached response belonging to the user"""
+        if self.backend is None:
+            return
+        try:
+            await self.backend.bump_version(str(user_id))
+        except Exception as e:
+            logger.error(f"Failed to invalidate cached responses for user {user_id}: {str(e)}")
+
+
+def _create_backend():
+    """Redis when RESPONSE_CACHE_URL is set; memory with a single worker; otherwise None, i.e. no caching"""
+    url = os.getenv("RESPONSE_CACHE_URL")
+    if url:
+        try:
+            return RedisCacheBackend(url)
+        except ImportError:
+            logger.warning("RESPONSE_CACHE_URL is set but redis is not installed")
+    if not single_worker():
+        # Another worker's cached copy would outlive this worker's invalidation; warned about at startup
+        return None
+    return MemoryCacheBackend(
+        max_users=int(os.getenv("RESPONSE_CACHE_SIZE", "10000")),
+        ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "30")) + float(os.getenv("RESPONSE_CACHE_STALE_TTL", "300"))
+    )
+
+
+response_cache = ResponseCache(
+    _create_backend(),
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "30")),
+    stale_seconds=float(os.getenv("RESPONSE_CACHE_STALE_TTL", "300"))
+)
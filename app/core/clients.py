@@ -0,0 +1,104 @@
+"""
+Shared, lazily constructed clients for external services.
+
+SDKs are imported on first use rather than when the app is imported, so
+the server can start answering health checks before boto3, replicate,
+openai, aiohttp and supabase have been loaded. Each client is built once
+per process and reused by every request.
+"""
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+import os
+import threading
+
+if TYPE_CHECKING:
+    import aiohttp
+    from openai import OpenAI
+    from supabase import Client
+
+__all__ = ['get_s3_client', 'get_bucket_name', 'get_service_supabase', 'get_openai_client',
+           'get_replicate', 'get_http_session', 'close_clients', 'warm_clients']
+
+_lock = threading.Lock()
+# replicate and openai both import pydantic; importing them from two threads at once can
+# leave replicate with pydantic v2 where it expects the v1 shim
+_import_lock = threading.Lock()
+_http_session: Optional["aiohttp.ClientSession"] = None
+
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    """S3 client shared by the product routes and the image pipeline"""
+    import boto3
+    from botocore.config import Config
+
+    # boto3's default session is not safe to build clients from concurrently
+    with _lock:
+        return boto3.client(
+            's3',
+            aws_access_key_id=os.getenv('aws_access_key_id'),
+            aws_secret_access_key=os.getenv('aws_secret_access_key'),
+            # Fail a stuck connection quickly; app.core.resilience retries on top of these
+            config=Config(
+                connect_timeout=float(os.getenv("S3_CONNECT_TIMEOUT", "5")),
+                read_timeout=float(os.getenv("S3_READ_TIMEOUT", "30")),
+                retries={"mode": "standard", "max_attempts": 2}
+            )
+        )
+
+
+def get_bucket_name() -> Optional[str]:
+    return os.getenv('bucket_name')
+
+
+@lru_cache(maxsize=None)
+def get_service_supabase() -> "Client":
+    """Service-role Supabase client; never call auth.set_session on it"""
+    from supabase import create_client
+
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    if not url or not key:
+        raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set in environment variables")
+    return create_client(url, key)
+
+
+@lru_cache(maxsize=None)
+def get_openai_client() -> "OpenAI":
+    with _import_lock:
+        from openai import OpenAI
+
+    return OpenAI()
+
+
+def get_replicate():
+    """The replicate module, imported on first use"""
+    with _import_lock:
+        import replicate
+
+    return replicate
+
+
+async def get_http_session() -> "aiohttp.ClientSession":
+    """aiohttp session reused for every download, created on the running event loop"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        import aiohttp
+
+        _http_session = aiohttp.ClientSession()
+    return _http_session
+
+
+async def close_clients() -> None:
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+def warm_clients() -> None:
+    """Build every client up front, for workers that prefer a slower start to a slower first request"""
+    get_s3_client()
+    get_service_supabase()
+    get_openai_client()
+    get_replicate()
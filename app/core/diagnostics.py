@@ -0,0 +1,240 @@
+"""
+Event-loop stall detection and an on-demand sampling profiler.
+
+Both watch the event loop thread from a separate thread, so they see
+exactly what a blocking sync call is doing while it holds the loop.
+"""
+from collections import Counter
+from types import FrameType
+from typing import Dict, List, Optional
+import asyncio
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['LoopLagMonitor', 'StackSampler', 'RequestProfiler', 'ProfilerMiddleware', 'loop_monitor', 'request_profiler']
+
+PROFILE_HEADER = "x-profile-token"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_ID_PATTERN = re.compile(r"^[\w-]+$")
+
+
+class LoopLagMonitor:
+    """
+    Logs the stack of any callback that blocks the event loop for too long.
+
+    A coroutine on the loop records a heartbeat every `interval` seconds and
+    observes how late each wake-up was. A watchdog thread checks the
+    heartbeat; once it is more than `threshold` seconds overdue, the loop
+    thread's current stack is logged, once per stall.
+    """
+
+    def __init__(self, threshold: float = 0.5, interval: float = 0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    async def _beat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            EVENT_LOOP_LAG_SECONDS.observe(max(0.0, now - expected))
+            self._heartbeat = now
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            overdue = time.monotonic() - heartbeat - self.interval
+            if overdue < self.threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            EVENT_LOOP_STALLS.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<loop thread stack unavailable>\n"
+            logger.warning(f"Event loop blocked for {overdue:.2f}s, loop thread is at:\n{stack}")
+
+    def start(self) -> None:
+        """Start monitoring the running loop; call from the loop thread"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-monitor", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class StackSampler:
+    """Samples one thread's stack at a fixed interval into folded-stack counts"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack: List[str] = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> str:
+        """Stop sampling and return the profile in folded format, one 'frame;frame;frame count' per line"""
+        self._stop.set()
+        self._thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class RequestProfiler:
+    """
+    Decides which requests to profile and keeps their profiles on disk.
+
+    A request is profiled when it carries X-Profile-Token matching
+    PROFILE_TOKEN, or at random with probability PROFILE_SAMPLE_RATE. One
+    request per worker is profiled at a time. The sampler watches the
+    event loop thread, so concurrent requests on the same loop show up in
+    the profile too, and work handed to worker threads does not.
+    """
+
+    def __init__(self, token: Optional[str], sample_rate: float, directory: str, keep: int = 200):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.keep = keep
+        self._busy = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token) or self.sample_rate > 0
+
+    def wants(self, scope: Scope) -> bool:
+        if self.token:
+            for name, value in scope.get("headers", []):
+                if name == PROFILE_HEADER.encode() and self.authorized(value.decode("latin-1")):
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def authorized(self, token: Optional[str]) -> bool:
+        return bool(self.token) and hmac.compare_digest(token or "", self.token)
+
+    def start(self) -> Optional[StackSampler]:
+        if not self._busy.acquire(blocking=False):
+            return None
+        return StackSampler(threading.get_ident()).start()
+
+    def finish(self, sampler: StackSampler, profile_id: str) -> None:
+        try:
+            folded = sampler.stop()
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path(profile_id), "w") as f:
+                f.write(folded)
+            self._prune()
+        except Exception as e:
+            logger.error(f"Failed to save profile {profile_id}: {str(e)}")
+        finally:
+            self._busy.release()
+
+    def path(self, profile_id: str) -> str:
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            raise ValueError("Invalid profile ID")
+        return os.path.join(self.directory, f"{profile_id}.folded")
+
+    def list_profiles(self) -> List[Dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".folded")]
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        return [
+            {"id": entry.name[:-len(".folded")], "created_at": entry.stat().st_mtime, "size": entry.stat().st_size}
+            for entry in entries
+        ]
+
+    def _prune(self) -> None:
+        for entry in self.list_profiles()[self.keep:]:
+            os.remove(self.path(entry["id"]))
+
+
+class ProfilerMiddleware:
+    """Profiles selected HTTP requests and returns the profile's ID in X-Profile-Id"""
+
+    def __init__(self, app: ASGIApp, profiler: "RequestProfiler" = None):
+        self.app = app
+        self.profiler = profiler or request_profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.profiler.enabled or not self.profiler.wants(scope):
+            await self.app(scope, receive, send)
+            return
+
+        sampler = self.profiler.start()
+        if sampler is None:
+            await self.app(scope, receive, send)
+            return
+
+        path = re.sub(r"[^\w-]+", "_", scope["path"].strip("/"))[:60] or "root"
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}_{scope['method']}_{path}_{uuid.uuid4().hex[:8]}"
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(PROFILE_ID_HEADER.lower().encode(), profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.profiler.finish(sampler, profile_id)
+
+
+loop_monitor = LoopLagMonitor(
+    threshold=float(os.getenv("LOOP_LAG_THRESHOLD", "0.5")),
+    interval=float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+)
+
+request_profiler = RequestProfiler(
+    token=os.getenv("PROFILE_TOKEN"),
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+    directory=os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "fotnik-profiles")),
+    keep=int(os.getenv("PROFILE_KEEP", "200"))
+)
@@ -0,0 +1,91 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+import asyncio
+import logging
+import os
+
+from app.core.metrics import GENERATION_JOBS_ACTIVE
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['ServerDrainingError', 'JobTracker', 'generation_jobs', 'DRAIN_TIMEOUT']
+
+# Seconds a shutting-down worker waits for in-flight generations before exiting
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "120"))
+
+
+class ServerDrainingError(Exception):
+    """Raised when a job is submitted to a worker that is shutting down"""
+
+    code = "SERVER_DRAINING"
+
+    def __init__(self):
+        super().__init__("Server is restarting, please retry in a few seconds")
+
+
+class JobTracker:
+    """
+    Counts in-flight jobs so a worker can finish them before it exits.
+
+    Jobs run inside `track()`. Once `stop_accepting` has been called, new
+    jobs are refused with ServerDrainingError while running ones continue,
+    and `drain` waits for them up to a deadline.
+    """
+
+    def __init__(self, name: str, gauge=None):
+        self.name = name
+        self.gauge = gauge
+        self.accepting = True
+        self._active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @asynccontextmanager
+    async def track(self) -> AsyncIterator[None]:
+        if not self.accepting:
+            raise ServerDrainingError()
+        self._active += 1
+        self._idle.clear()
+        if self.gauge is not None:
+            self.gauge.inc()
+        try:
+            yield
+        finally:
+            self._active -= 1
+            if self.gauge is not None:
+                self.gauge.dec()
+            if self._active == 0:
+                self._idle.set()
+
+    def stop_accepting(self) -> None:
+        if self.accepting:
+            logger.info(f"No longer accepting {self.name} jobs, {self._active} in flight")
+        self.accepting = False
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT) -> bool:
+        """
+        Refuse new jobs and wait for running ones to finish.
+
+        Args:
+            timeout: Seconds to wait before giving up on the remaining jobs
+
+        Returns:
+            True if every job finished before the deadline
+        """
+        self.stop_accepting()
+        if self._active == 0:
+            return True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            logger.info(f"All {self.name} jobs drained")
+            return True
+        except asyncio.TimeoutError:
+            logger.error(f"Drain deadline of {timeout}s exceeded with {self._active} {self.name} jobs still running")
+            return False
+
+
+generation_jobs = JobTracker("generation", gauge=GENERATION_JOBS_ACTIVE)
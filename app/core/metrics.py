@@ -0,0 +1,203 @@
+"""
+Prometheus instruments for the API and the image generation pipeline.
+
+With several workers, serve.py points PROMETHEUS_MULTIPROC_DIR at a
+shared directory so /metrics aggregates every worker rather than
+reporting whichever one answered the scrape.
+"""
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+)
+from prometheus_client import multiprocess
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+__all__ = ['StageTimer', 'track_external', 'MetricsMiddleware', 'render_metrics', 'CONTENT_TYPE_LATEST',
+           'GENERATION_STAGE_SECONDS', 'HTTP_REQUEST_SECONDS', 'EXTERNAL_CALL_SECONDS', 'EXTERNAL_CALL_ERRORS',
+           'WEBSOCKET_CONNECTIONS', 'GENERATION_JOBS_ACTIVE', 'REPLICATE_PREDICTIONS_PENDING', 'COALESCED_CALLS',
+           'EXTERNAL_CALL_RETRIES', 'CIRCUIT_STATE', 'HEDGED_REQUESTS', 'GENERATION_QUEUE_DEPTH', 'GENERATION_QUEUE_WAIT_SECONDS', 'DEPENDENCY_SLOTS_IN_USE',
+           'EVENT_LOOP_LAG_SECONDS', 'EVENT_LOOP_STALLS']
+
+# Generation stages range from milliseconds (decode) to a minute (inpaint)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120)
+
+GENERATION_STAGE_SECONDS = Histogram(
+    "fotnik_generation_stage_seconds",
+    "Time spent in each stage of an image generation job",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "fotnik_http_request_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"]
+)
+EXTERNAL_CALL_SECONDS = Histogram(
+    "fotnik_external_call_seconds",
+    "Latency of calls to external services",
+    ["dependency", "operation"],
+    buckets=STAGE_BUCKETS
+)
+EXTERNAL_CALL_ERRORS = Counter(
+    "fotnik_external_call_errors_total",
+    "Failed calls to external services",
+    ["dependency", "operation"]
+)
+EXTERNAL_CALL_RETRIES = Counter(
+    "fotnik_external_call_retries_total",
+    "Calls to external services retried after a failure or timeout",
+    ["dependency", "operation"]
+)
+CIRCUIT_STATE = Gauge(
+    "fotnik_circuit_state",
+    "Circuit breaker state per dependency: 0 closed, 1 half-open, 2 open",
+    ["dependency"],
+    multiprocess_mode="livemax"
+)
+HEDGED_REQUESTS = Counter(
+    "fotnik_hedged_requests_total",
+    "Backup requests sent because the first one was slow",
+    ["operation"]
+)
+WEBSOCKET_CONNECTIONS = Gauge(
+    "fotnik_websocket_connections",
+    "Open websocket connections",
+    multiprocess_mode="livesum"
+)
+GENERATION_JOBS_ACTIVE = Gauge(
+    "fotnik_generation_jobs_active",
+    "Generation and source photo jobs currently running",
+    multiprocess_mode="livesum"
+)
+REPLICATE_PREDICTIONS_PENDING = Gauge(
+    "fotnik_replicate_predictions_pending",
+    "Replicate predictions created and not yet finished",
+    multiprocess_mode="livesum"
+)
+GENERATION_QUEUE_DEPTH = Gauge(
+    "fotnik_generation_queue_depth",
+    "Generation jobs waiting for a scheduler slot",
+    multiprocess_mode="livesum"
+)
+GENERATION_QUEUE_WAIT_SECONDS = Histogram(
+    "fotnik_generation_queue_wait_seconds",
+    "Time generation jobs spent queued before starting",
+    buckets=STAGE_BUCKETS
+)
+DEPENDENCY_SLOTS_IN_USE = Gauge(
+    "fotnik_dependency_slots_in_use",
+    "Concurrent calls holding a slot under the per-dependency cap",
+    ["dependency"],
+    multiprocess_mode="livesum"
+)
+COALESCED_CALLS = Counter(
+    "fotnik_coalesced_calls_total",
+    "Calls that joined an identical call already in flight instead of repeating it",
+    ["operation"]
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "fotnik_event_loop_lag_seconds",
+    "How late the event loop ran a scheduled heartbeat",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+EVENT_LOOP_STALLS = Counter(
+    "fotnik_event_loop_stalls_total",
+    "Times a callback blocked the event loop for longer than LOOP_LAG_THRESHOLD"
+)
+
+
+@contextmanager
+def track_external(dependency: str, operation: str) -> Iterator[None]:
+    """Time a call to an external service and count it as an error if it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        EXTERNAL_CALL_ERRORS.labels(dependency, operation).inc()
+        raise
+    finally:
+        EXTERNAL_CALL_SECONDS.labels(dependency, operation).observe(time.perf_counter() - start)
+
+
+class StageTimer:
+    """
+    Times the stages of one generation job.
+
+    Each stage is observed in GENERATION_STAGE_SECONDS and accumulated in
+    `timings`, which is sent to the client with every processing_status
+    event. A stage that names a dependency is also recorded as an external
+    call.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str, dependency: Optional[str] = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            if dependency:
+                with track_external(dependency, name):
+                    yield
+            else:
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            GENERATION_STAGE_SECONDS.labels(name).observe(elapsed)
+            self.timings[name] = round(self.timings.get(name, 0.0) + elapsed, 3)
+
+    def summary(self) -> dict:
+        return {"stages": dict(self.timings), "elapsed": round(time.perf_counter() - self.started_at, 3)}
+
+
+def _route_template(scope: Scope) -> str:
+    # Starlette leaves the matched endpoint and path params in the scope; putting
+    # the param names back keeps one series per route instead of one per ID
+    if "endpoint" not in scope:
+        return "unmatched"
+    path = scope["path"]
+    for name, value in scope.get("path_params", {}).items():
+        path = path.replace(f"/{value}", f"/{{{name}}}", 1)
+    return path
+
+
+class MetricsMiddleware:
+    """Records HTTP_REQUEST_SECONDS for every HTTP request"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(scope["method"], _route_template(scope), str(status)).observe(
+                time.perf_counter() - start
+            )
+
+
+def render_metrics() -> bytes:
+    """Every metric in Prometheus text format, aggregated across workers when running multiprocess"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
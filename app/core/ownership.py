@@ -0,0 +1,70 @@
+from fastapi import HTTPException
+from typing import TYPE_CHECKING, FrozenSet
+import logging
+import os
+
+from app.core.cache import TTLCache, local_cache_ttl
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['ProductOwnershipCache', 'product_ownership', 'require_product_owner']
+
+
+class ProductOwnershipCache:
+    """
+    Bounded TTL cache of each user's set of product IDs.
+
+    Answers "does user U own product P" without a user_products round trip
+    once U's product set is loaded. create_product/delete_product write
+    through to the cache. A product missing from a cached set triggers one
+    reload before access is denied. The cache lives in one process, so a
+    product deleted through another worker passes the check here until the
+    entry expires; with several workers the TTL is therefore short, and the
+    handlers' own queries find no row for a deleted product anyway.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0, max_users: int = 10000):
+        self._entries: TTLCache[FrozenSet[str]] = TTLCache(ttl_seconds=ttl_seconds, max_entries=max_users)
+
+    def _load(self, supabase: "Client", user_id: str) -> FrozenSet[str]:
+        result = supabase.table("user_products")\
+            .select("product_id")\
+            .eq("user_id", user_id)\
+            .execute()
+        product_ids = frozenset(str(row["product_id"]) for row in result.data)
+        self._entries.set(user_id, product_ids)
+        return product_ids
+
+    def owns(self, supabase: "Client", user_id: str, product_id: str) -> bool:
+        """Check whether the user owns the product, loading their product set on a miss"""
+        user_id, product_id = str(user_id), str(product_id)
+        product_ids = self._entries.get(user_id)
+        if product_ids is not None and product_id in product_ids:
+            return True
+        return product_id in self._load(supabase, user_id)
+
+    def add_product(self, user_id: str, product_id: str) -> None:
+        """Write a newly created product through to a cached product set"""
+        self._entries.replace(str(user_id), lambda product_ids: product_ids | {str(product_id)})
+
+    def remove_product(self, user_id: str, product_id: str) -> None:
+        """Drop a deleted product from a cached product set"""
+        self._entries.replace(str(user_id), lambda product_ids: product_ids - {str(product_id)})
+
+    def invalidate(self, user_id: str) -> None:
+        self._entries.delete(str(user_id))
+
+
+product_ownership = ProductOwnershipCache(
+    ttl_seconds=local_cache_ttl("PRODUCT_OWNERSHIP_CACHE_TTL", 60.0, several_workers=10.0),
+    max_users=int(os.getenv("PRODUCT_OWNERSHIP_CACHE_SIZE", "10000"))
+)
+
+
+def require_product_owner(supabase: "Client", user_id: str, product_id: str) -> None:
+    """Raise a 404 unless the user owns the product"""
+    if not product_ownership.owns(supabase, user_id, product_id):
+        raise HTTPException(status_code=404, detail="Product not found or access denied")
@@ -0,0 +1,231 @@
+"""
+Timeouts, retries, circuit breakers and hedging for calls to Replicate,
+S3 and image downloads.
+
+A job creates one Deadline and every call it makes gets a timeout of
+at most the time the job has left, so no single call can hang a job.
+Idempotent calls are retried with full-jitter exponential backoff while
+the deadline allows. Each dependency has a circuit breaker that opens
+after consecutive failures and fails calls immediately until a trial
+call succeeds, so an outage costs one timeout per breaker instead of
+one per job.
+"""
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+import asyncio
+import logging
+import os
+import random
+import time
+
+from app.core.metrics import CIRCUIT_STATE, EXTERNAL_CALL_RETRIES, HEDGED_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['Deadline', 'DeadlineExceededError', 'CircuitOpenError', 'CircuitBreaker', 'get_breaker',
+           'call_with_retries', 'hedged', 'JOB_DEADLINE']
+
+T = TypeVar("T")
+
+# Seconds a generation or source photo job may take once it has started
+JOB_DEADLINE = float(os.getenv("JOB_DEADLINE", "600"))
+
+
+class DeadlineExceededError(Exception):
+    """The job ran out of time before a call could be made or retried"""
+
+
+class CircuitOpenError(Exception):
+    """A dependency's breaker is open and the call was not attempted"""
+
+    def __init__(self, dependency: str, retry_in: float):
+        self.dependency = dependency
+        super().__init__(f"{dependency} is temporarily unavailable, retry in {retry_in:.0f}s")
+
+
+class Deadline:
+    """Absolute point in time a job must finish by"""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """Timeout for the next call: the time left, capped at `cap`
+
+        Raises:
+            DeadlineExceededError: If no time is left
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceededError("Job deadline exceeded")
+        return remaining if cap is None else min(cap, remaining)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    Closed: calls go through. After `failure_threshold` consecutive
+    failures it opens and refuses calls for `reset_timeout` seconds, then
+    lets a single trial call through (half-open); its outcome closes or
+    reopens the breaker.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    def allow(self) -> None:
+        """Raise CircuitOpenError unless a call may be made now"""
+        if self.state == self.OPEN:
+            waited = time.monotonic() - self._opened_at
+            if waited < self.reset_timeout:
+                raise CircuitOpenError(self.name, self.reset_timeout - waited)
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._trial_running:
+                raise CircuitOpenError(self.name, self.reset_timeout)
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._trial_running = False
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit for {self.name} closed")
+            self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._trial_running = False
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.error(f"Circuit for {self.name} opened after {self._failures} consecutive failures")
+            self._opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def abandon(self) -> None:
+        """The call was cancelled before it had an outcome; let another trial through"""
+        self._trial_running = False
+
+    def _set_state(self, state: int) -> None:
+        self.state = state
+        CIRCUIT_STATE.labels(self.name).set(state)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(dependency: str) -> CircuitBreaker:
+    """The worker's breaker for a dependency, configured by CIRCUIT_FAILURE_THRESHOLD and CIRCUIT_RESET_TIMEOUT"""
+    if dependency not in _breakers:
+        _breakers[dependency] = CircuitBreaker(
+            dependency,
+            failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+        )
+    return _breakers[dependency]
+
+
+async def call_with_retries(
+    fn: Callable[[float], Awaitable[T]],
+    *,
+    dependency: str,
+    operation: str,
+    deadline: Deadline,
+    attempt_timeout: Optional[float] = None,
+    attempts: int = 3,
+    base_delay: float = 0.5,
+    max_delay: float = 8.0,
+    trips_breaker: Callable[[Exception], bool] = lambda e: True
+) -> T:
+    """
+    Call an idempotent operation with per-attempt timeouts, retries and the dependency's breaker.
+
+    Args:
+        fn: Coroutine function taking the attempt's timeout in seconds; it must enforce it
+        dependency: Breaker and metrics label, e.g. "replicate"
+        operation: Metrics label, e.g. "remove_bg"
+        deadline: The job's deadline; attempts never run past it
+        attempt_timeout: Upper bound for a single attempt
+        attempts: Maximum number of attempts
+        base_delay: Backoff before the first retry; doubles per retry, with full jitter
+        max_delay: Upper bound for the backoff
+        trips_breaker: Whether an error says the dependency is unhealthy (rather than e.g. a bad input)
+
+    Returns:
+        The first successful result
+
+    Raises:
+        CircuitOpenError: If the breaker is open
+        DeadlineExceededError: If the deadline passed before an attempt could start
+        Exception: The last attempt's error
+    """
+    breaker = get_breaker(dependency)
+    for attempt in range(1, attempts + 1):
+        breaker.allow()
+        timeout = deadline.timeout(attempt_timeout)
+        try:
+            result = await asyncio.wait_for(fn(timeout), timeout=timeout + 1.0)
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except Exception as e:
+            if trips_breaker(e):
+                breaker.record_failure()
+            else:
+                # The dependency answered, so a pending trial call counts as a success
+                breaker.record_success()
+            backoff = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            if attempt == attempts or deadline.remaining() <= backoff:
+                raise
+            EXTERNAL_CALL_RETRIES.labels(dependency, operation).inc()
+            logger.warning(f"{operation} attempt {attempt} failed ({type(e).__name__}: {str(e)}), retrying")
+            await asyncio.sleep(backoff)
+        else:
+            breaker.record_success()
+            return result
+    raise DeadlineExceededError(f"{operation} was not attempted")
+
+
+async def hedged(fn: Callable[[], Awaitable[T]], delay: float, operation: str) -> T:
+    """
+    Run `fn`, and if it hasn't finished after `delay` seconds run it again concurrently.
+
+    Whichever finishes successfully first wins and the other is cancelled. Only
+    use for idempotent reads such as downloads.
+
+    Args:
+        fn: Coroutine function to run
+        delay: Seconds to wait before the backup request; 0 disables hedging
+        operation: Metrics label
+    """
+    if delay <= 0:
+        return await fn()
+    first = asyncio.ensure_future(fn())
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    HEDGED_REQUESTS.labels(operation).inc()
+    pending = {first, asyncio.ensure_future(fn())}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,99 @@
+from fastapi import Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+from typing import Any, Iterable, Iterator, Optional, Sequence
+import json
+import logging
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['FastJSONResponse', 'CompressionMiddleware', 'dumps', 'ndjson_response', 'wants_ndjson']
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Rows serialised per chunk written to an NDJSON stream
+NDJSON_CHUNK_ROWS = 256
+
+
+def dumps(content: Any) -> bytes:
+    """Serialise plain JSON data with orjson when installed, the standard library otherwise"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse for content that is already plain JSON data, such as DB rows.
+
+    Skips response-model validation when returned from a route, and renders
+    with orjson when it is installed.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def wants_ndjson(request: Request) -> bool:
+    """Whether the client asked for a newline-delimited JSON stream"""
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "") \
+        or request.query_params.get("format") == "ndjson"
+
+
+def ndjson_response(rows: Iterable[dict], headers: Optional[dict] = None) -> StreamingResponse:
+    """
+    Stream rows as newline-delimited JSON.
+
+    `rows` may be a lazy iterator doing blocking DB calls; Starlette iterates
+    sync iterators in its threadpool, so the event loop is not held up.
+    """
+    def chunks() -> Iterator[bytes]:
+        buffer = []
+        for row in rows:
+            buffer.append(dumps(row))
+            if len(buffer) >= NDJSON_CHUNK_ROWS:
+                yield b"\n".join(buffer) + b"\n"
+                buffer = []
+        if buffer:
+            yield b"\n".join(buffer) + b"\n"
+
+    return StreamingResponse(chunks(), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+
+class CompressionMiddleware:
+    """
+    Compress responses over `minimum_size` bytes, negotiated from Accept-Encoding.
+
+    Uses brotli (with gzip fallback) when brotli-asgi is installed, gzip
+    otherwise. Paths matching one of the `excluded_paths` regular
+    expressions, such as those serving images, are passed through untouched.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, excluded_paths: Sequence[str] = ()):
+        self.app = app
+        self.excluded_paths = [re.compile(pattern) for pattern in excluded_paths]
+        if BrotliMiddleware is not None:
+            self.compressed_app = BrotliMiddleware(app, quality=4, minimum_size=minimum_size, gzip_fallback=True)
+        else:
+            self.compressed_app = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=6)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and not self._is_excluded(scope["path"]):
+            await self.compressed_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    def _is_excluded(self, path: str) -> bool:
+        return any(pattern.search(path) for pattern in self.excluded_paths)
@@ -0,0 +1,305 @@
+"""
+Admission control for the generation pipeline.
+
+FairScheduler hands out a fixed number of generation slots per worker.
+Each user may hold at most `per_user_limit` of them; further jobs wait in
+the user's queue. Between users, slots go out in weighted fair order:
+every job gets a virtual finish time that advances by 1 / weight, so a
+user on a plan with weight 4 is served four times as often as a free
+user when both have work queued, and nobody can starve anyone else by
+submitting in bulk.
+
+DependencyLimiter caps concurrent calls to each external service across
+all jobs on the worker, so bursts queue here instead of in Replicate's
+or OpenAI's rate limiters.
+
+Both live in the worker process. GENERATION_CONCURRENCY and the per-user
+limits apply to each worker separately; DEPENDENCY_CONCURRENCY is a
+deployment-wide cap that is split evenly over the WEB_CONCURRENCY workers.
+"""
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+import asyncio
+import itertools
+import logging
+import math
+import os
+import time
+
+from fastapi import HTTPException
+
+from app.core.cache import TTLCache
+from app.core.metrics import DEPENDENCY_SLOTS_IN_USE, GENERATION_QUEUE_DEPTH, GENERATION_QUEUE_WAIT_SECONDS
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['Ticket', 'FairScheduler', 'DependencyLimiter', 'user_plan', 'plan_weight', 'plan_max_variants',
+           'generation_scheduler', 'dependency_limits']
+
+# Seconds between queue position updates pushed to a waiting client
+POSITION_UPDATE_INTERVAL = 1.0
+
+
+def _parse_mapping(value: str, cast=float) -> Dict[str, float]:
+    """Parse "a=1,b=2" environment settings"""
+    mapping = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, number = item.split("=", 1)
+            mapping[name.strip()] = cast(number)
+    return mapping
+
+
+def _worker_share(total: int) -> int:
+    """Part of a deployment-wide limit given to each of the WEB_CONCURRENCY workers, at least 1"""
+    if total <= 0:
+        return total
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    return max(1, math.ceil(total / workers))
+
+
+@dataclass(eq=False)
+class Ticket:
+    """A job's place in the scheduler; pass it back to `release`"""
+    user_id: str
+    start_tag: float
+    finish_tag: float
+    sequence: int
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    granted: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class FairScheduler:
+    """
+    Weighted fair queuing of generation jobs with per-user in-flight limits.
+
+    Args:
+        capacity: Jobs allowed to run at once on this worker
+        per_user_limit: Jobs one user may have running at once
+        max_queued_per_user: Jobs one user may have waiting; more are refused with a 429
+        queue_timeout: Seconds a job may wait before it is refused with a 503
+    """
+
+    def __init__(self, capacity: int, per_user_limit: int, max_queued_per_user: int, queue_timeout: float):
+        self.capacity = capacity
+        self.per_user_limit = per_user_limit
+        self.max_queued_per_user = max_queued_per_user
+        self.queue_timeout = queue_timeout
+        self._queues: Dict[str, Deque[Ticket]] = {}
+        self._running: Dict[str, int] = {}
+        self._last_finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._active = 0
+        self._sequence = itertools.count()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _enqueue(self, user_id: str, weight: float) -> Ticket:
+        queue = self._queues.setdefault(user_id, deque())
+        if len(queue) >= self.max_queued_per_user:
+            if not queue:
+                del self._queues[user_id]
+            raise HTTPException(
+                status_code=429,
+                detail={
+                    "message": "Too many generations waiting, please wait for some to finish.",
+                    "code": "TOO_MANY_QUEUED"
+                }
+            )
+        # A user returning after being idle starts at the current virtual time, not with banked credit
+        start = max(self._virtual_time, self._last_finish.get(user_id, 0.0))
+        ticket = Ticket(
+            user_id=user_id,
+            start_tag=start,
+            finish_tag=start + 1.0 / max(weight, 0.01),
+            sequence=next(self._sequence)
+        )
+        self._last_finish[user_id] = ticket.finish_tag
+        queue.append(ticket)
+        GENERATION_QUEUE_DEPTH.inc()
+        return ticket
+
+    def _remove(self, ticket: Ticket) -> None:
+        queue = self._queues.get(ticket.user_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            GENERATION_QUEUE_DEPTH.dec()
+            if not queue:
+                del self._queues[ticket.user_id]
+
+    def _eligible(self):
+        return [
+            queue[0] for user_id, queue in self._queues.items()
+            if self._running.get(user_id, 0) < self.per_user_limit
+        ]
+
+    def _dispatch(self) -> None:
+        while self._active < self.capacity:
+            heads = self._eligible()
+            if not heads:
+                return
+            ticket = min(heads, key=lambda t: (t.finish_tag, t.sequence))
+            self._remove(ticket)
+            self._virtual_time = max(self._virtual_time, ticket.start_tag)
+            self._active += 1
+            self._running[ticket.user_id] = self._running.get(ticket.user_id, 0) + 1
+            GENERATION_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - ticket.enqueued_at)
+            ticket.granted.set_result(True)
+
+    def position(self, ticket: Ticket) -> int:
+        """1-based place of a waiting ticket among every queued job, in service order"""
+        if ticket.granted.done():
+            return 0
+        waiting = [t for queue in self._queues.values() for t in queue]
+        return 1 + sum(1 for t in waiting if (t.finish_tag, t.sequence) < (ticket.finish_tag, ticket.sequence))
+
+    async def acquire(
+        self,
+        user_id: str,
+        weight: float = 1.0,
+        on_position: Optional[Callable[[int], Awaitable[None]]] = None
+    ) -> Ticket:
+        """
+        Wait for a generation slot.
+
+        Args:
+            user_id: Owner of the job
+            weight: Share of capacity relative to other users, see plan_weight
+            on_position: Called with the job's queue position whenever it changes while waiting
+
+        Returns:
+            Ticket to pass to `release` once the job is done
+
+        Raises:
+            HTTPException: 429 if the user already has too many jobs queued, 503 on queue timeout
+        """
+        ticket = self._enqueue(user_id, weight)
+        self._dispatch()
+        deadline = time.perf_counter() + self.queue_timeout
+        last_position = None
+        try:
+            while not ticket.granted.done():
+                position = self.position(ticket)
+                if on_position is not None and position != last_position:
+                    last_position = position
+                    await on_position(position)
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise HTTPException(
+                        status_code=503,
+                        detail={
+                            "message": "Generation is very busy right now, please try again in a few minutes.",
+                            "code": "QUEUE_TIMEOUT"
+                        }
+                    )
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(ticket.granted), timeout=min(POSITION_UPDATE_INTERVAL, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if ticket.granted.done():
+                self.release(ticket)
+            else:
+                ticket.granted.cancel()
+                self._remove(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """Give a granted slot back and start the next job"""
+        self._active -= 1
+        running = self._running.get(ticket.user_id, 1) - 1
+        if running > 0:
+            self._running[ticket.user_id] = running
+        else:
+            self._running.pop(ticket.user_id, None)
+            if ticket.user_id not in self._queues and self._last_finish.get(ticket.user_id, 0.0) <= self._virtual_time:
+                self._last_finish.pop(ticket.user_id, None)
+        self._dispatch()
+
+
+class DependencyLimiter:
+    """
+    Per-dependency concurrency caps shared by every job on the worker.
+
+    Args:
+        limits: Maximum concurrent calls by dependency name; unlisted dependencies are unlimited
+    """
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = limits
+        self._semaphores = {name: asyncio.Semaphore(limit) for name, limit in limits.items() if limit > 0}
+
+    @asynccontextmanager
+    async def slot(self, dependency: str) -> AsyncIterator[None]:
+        semaphore = self._semaphores.get(dependency)
+        if semaphore is None:
+            yield
+            return
+        async with semaphore:
+            DEPENDENCY_SLOTS_IN_USE.labels(dependency).inc()
+            try:
+                yield
+            finally:
+                DEPENDENCY_SLOTS_IN_USE.labels(dependency).dec()
+
+
+PLAN_WEIGHTS = _parse_mapping(os.getenv("PLAN_WEIGHTS", "free=1,starter=2,pro=4"))
+# Most variants one generation may ask for, by plan
+PLAN_MAX_VARIANTS = _parse_mapping(os.getenv("PLAN_MAX_VARIANTS", "free=4,starter=4,pro=8"), cast=int)
+_plans: TTLCache[str] = TTLCache(ttl_seconds=300, max_entries=10000)
+
+
+def user_plan(user_id: str, supabase: "Client") -> str:
+    """The user's plan from user_tokens, "free" when unset"""
+    plan = _plans.get(user_id)
+    if plan is not None:
+        return plan
+    try:
+        result = supabase.table("user_tokens").select("plan").eq("user_id", user_id).execute()
+        plan = (result.data[0].get("plan") if result.data else None) or "free"
+    except Exception as e:
+        # Before the user_plans migration there is no plan column; treat everyone alike
+        logger.warning(f"Could not read plan for user {user_id}: {str(e)}")
+        plan = "free"
+    _plans.set(user_id, plan)
+    return plan
+
+
+def plan_weight(user_id: str, supabase: "Client") -> float:
+    """Scheduler weight for the user's plan; plans missing from PLAN_WEIGHTS get 1"""
+    return PLAN_WEIGHTS.get(user_plan(user_id, supabase), 1.0)
+
+
+def plan_max_variants(user_id: str, supabase: "Client") -> int:
+    """Most variants the user's plan allows per generation; plans missing from PLAN_MAX_VARIANTS get the free limit"""
+    plan = user_plan(user_id, supabase)
+    return PLAN_MAX_VARIANTS.get(plan, PLAN_MAX_VARIANTS.get("free", 4))
+
+
+# Limits of this worker; a user with jobs on several workers is counted on each separately
+generation_scheduler = FairScheduler(
+    capacity=int(os.getenv("GENERATION_CONCURRENCY", "16")),
+    per_user_limit=int(os.getenv("GENERATION_PER_USER_LIMIT", "2")),
+    max_queued_per_user=int(os.getenv("GENERATION_MAX_QUEUED_PER_USER", "10")),
+    queue_timeout=float(os.getenv("GENERATION_QUEUE_TIMEOUT", "300")),
+)
+
+# DEPENDENCY_CONCURRENCY is for the whole deployment; this worker gets its share
+dependency_limits = DependencyLimiter({
+    name: _worker_share(limit)
+    for name, limit in _parse_mapping(os.getenv("DEPENDENCY_CONCURRENCY", "replicate=32,openai=16"), cast=int).items()
+})
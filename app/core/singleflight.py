@@ -0,0 +1,65 @@
+from typing import Awaitable, Callable, Dict, TypeVar
+import asyncio
+import hashlib
+import logging
+
+from app.core.metrics import COALESCED_CALLS
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['SingleFlight', 'flight_key', 'pipeline_flights']
+
+T = TypeVar("T")
+
+
+def flight_key(operation: str, *parts) -> str:
+    """Content hash of an operation and its arguments; None parts are kept distinct from empty strings"""
+    digest = hashlib.sha256(operation.encode())
+    for part in parts:
+        digest.update(b"\x00" if part is None else b"\x01" + str(part).encode())
+    return f"{operation}:{digest.hexdigest()}"
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls.
+
+    The first caller for a key starts the work in its own task; callers
+    that arrive with the same key while it runs wait on that task and get
+    the same result (or exception). Nothing is kept once it finishes, so
+    this only removes duplicate in-flight work and never serves stale
+    results. A caller that is cancelled doesn't cancel the shared work.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `fn` unless a call with the same key is already running.
+
+        Args:
+            key: Identity of the call, usually from flight_key
+            fn: Coroutine function doing the work
+
+        Returns:
+            The result of the single shared execution
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            operation = key.split(":", 1)[0]
+            COALESCED_CALLS.labels(operation).inc()
+            logger.info(f"Joined in-flight {operation} call in {self.name}")
+        return await asyncio.shield(task)
+
+
+pipeline_flights = SingleFlight("image pipeline")
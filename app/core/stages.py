@@ -0,0 +1,107 @@
+"""
+Dependency graphs of pipeline stages.
+
+A job declares its stages and what each one needs, and StageGraph starts
+every stage as soon as its inputs are ready, so stages without a data
+dependency between them overlap instead of queueing behind each other.
+Each stage is timed by the job's StageTimer. The first stage to fail
+cancels everything still running and its error is raised from `run`.
+"""
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+import asyncio
+import logging
+
+from app.core.metrics import StageTimer
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['StageGraph']
+
+
+@dataclass
+class _Stage:
+    fn: Callable[..., Awaitable[Any]]
+    after: Sequence[str]
+    dependency: Optional[str]
+    label: str
+
+
+class StageGraph:
+    """
+    Runs async stages in dependency order, concurrently where possible.
+
+    Stages are added after the stages they depend on, which keeps the graph
+    acyclic. A stage's function is called with the results of its `after`
+    stages, in order.
+
+    Args:
+        timer: Times every stage, under the stage's label
+    """
+
+    def __init__(self, timer: StageTimer):
+        self.timer = timer
+        self._stages: Dict[str, _Stage] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def add(
+        self,
+        name: str,
+        fn: Callable[..., Awaitable[Any]],
+        after: Sequence[str] = (),
+        dependency: Optional[str] = None,
+        label: Optional[str] = None
+    ) -> None:
+        """
+        Declare a stage.
+
+        Args:
+            name: Unique name other stages refer to
+            fn: Coroutine function taking the results of `after`
+            after: Stages whose results this stage needs
+            dependency: External service the stage calls, for the timer's metrics
+            label: Timer stage name if not `name`; stages may share one, e.g. two uploads as "s3_upload"
+        """
+        if name in self._stages:
+            raise ValueError(f"Stage {name} is already defined")
+        unknown = [dep for dep in after if dep not in self._stages]
+        if unknown:
+            raise ValueError(f"Stage {name} depends on undefined stages: {', '.join(unknown)}")
+        self._stages[name] = _Stage(fn=fn, after=tuple(after), dependency=dependency, label=label or name)
+
+    async def _execute(self, name: str) -> Any:
+        stage = self._stages[name]
+        inputs = [await asyncio.shield(self._tasks[dep]) for dep in stage.after]
+        with self.timer.stage(stage.label, dependency=stage.dependency):
+            return await stage.fn(*inputs)
+
+    async def result(self, name: str) -> Any:
+        """Wait for a stage of a running graph, e.g. from work a stage spawned"""
+        return await asyncio.shield(self._tasks[name])
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Run every stage.
+
+        Returns:
+            Each stage's result by name
+
+        Raises:
+            Exception: The error of the first stage that failed
+        """
+        for name in self._stages:
+            self._tasks[name] = asyncio.create_task(self._execute(name), name=f"stage:{name}")
+        try:
+            pending = set(self._tasks.values())
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+                failed = next((task for task in done if not task.cancelled() and task.exception()), None)
+                if failed is not None:
+                    logger.warning(f"Stage {failed.get_name().split(':', 1)[1]} failed: {str(failed.exception())}")
+                    raise failed.exception()
+        finally:
+            for task in self._tasks.values():
+                task.cancel()
+            # Let cancelled stages finish unwinding, and mark their errors as retrieved
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        return {name: task.result() for name, task in self._tasks.items()}
@@ -0,0 +1,237 @@
+"""
+Background removal backends.
+
+`remove_bg` hands the normalised upload to the backend selected by
+BG_REMOVAL_BACKEND:
+
+  replicate  lucataco/remove-bg on Replicate (the default)
+  local      a U²-Net family ONNX segmentation model (BG_REMOVAL_MODEL)
+             run by onnxruntime in a pool of worker processes
+
+Both take the image as a URL or data: URI and return the PNG cutout the
+same way, so the rest of the pipeline doesn't care where it was made. The
+local backend saves the upload, queueing and GPU billing of a remote
+prediction for what is a small model; its workers load the model once and
+stay warm. Compare the two with benchmarks/bench_remove_bg.py.
+"""
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import asyncio
+import base64
+import io
+import logging
+import multiprocessing
+import os
+
+from app.core.clients import get_http_session
+from app.core.resilience import Deadline, call_with_retries
+from app.image_processing.predictions import is_replicate_outage, prediction_manager
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['BackgroundRemover', 'ReplicateBackgroundRemover', 'LocalBackgroundRemover', 'create_background_remover',
+           'background_remover', 'REMOVE_BG_TIMEOUT']
+
+# Upper bound for a single attempt; every attempt is also bounded by the job's deadline
+REMOVE_BG_TIMEOUT = float(os.getenv("REMOVE_BG_TIMEOUT", "120"))
+
+REMOVE_BG_MODEL = "lucataco/remove-bg:95fcc2a26d3899cd6c2691c900465aaeff466285a65c14638cc5f36f34befaf1"
+
+# Input side, per-channel mean and standard deviation the model families were trained with
+MODEL_FAMILIES = {
+    "u2net": (320, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+    "isnet": (1024, (0.5, 0.5, 0.5), (1.0, 1.0, 1.0)),
+    "birefnet": (1024, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+}
+
+
+class BackgroundRemover(ABC):
+    """
+    Interface of a background removal backend.
+
+    `dependency` labels the external service the backend calls in stage
+    metrics, or is None when it runs in-process.
+    """
+
+    name: str = ""
+    dependency: Optional[str] = None
+
+    @abstractmethod
+    async def remove(self, image: str, deadline: Deadline) -> str:
+        """
+        Cut the subject out of an image.
+
+        Args:
+            image: URL or data: URI of the image
+            deadline: The job's deadline
+
+        Returns:
+            URL or data: URI of a PNG with a transparent background
+        """
+
+    async def start(self) -> None:
+        """Load whatever the backend needs ahead of the first request"""
+
+    async def close(self) -> None:
+        """Release the backend's resources at shutdown"""
+
+
+class ReplicateBackgroundRemover(BackgroundRemover):
+    """lucataco/remove-bg predictions, retried within the job's deadline"""
+
+    name = "replicate"
+    dependency = "replicate"
+
+    def __init__(self, model: str = REMOVE_BG_MODEL, attempt_timeout: float = REMOVE_BG_TIMEOUT):
+        self.model = model
+        self.attempt_timeout = attempt_timeout
+
+    async def remove(self, image: str, deadline: Deadline) -> str:
+        return await call_with_retries(
+            lambda timeout: prediction_manager.run(self.model, input={"image": image}, timeout=timeout),
+            dependency="replicate",
+            operation="remove_bg",
+            deadline=deadline,
+            attempt_timeout=self.attempt_timeout,
+            trips_breaker=is_replicate_outage
+        )
+
+
+# Set in each worker process by _load_model
+_session = None
+_family = None
+
+
+def _load_model(model_path: str, family: str, threads: int) -> None:
+    global _session, _family
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    _session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+    _family = family
+
+
+def _segment(data: bytes) -> bytes:
+    """Run the model on an encoded image in a worker process and return the cutout as PNG"""
+    import numpy as np
+    from PIL import Image
+
+    size, mean, std = MODEL_FAMILIES[_family]
+    with Image.open(io.BytesIO(data)) as source:
+        image = source.convert("RGB")
+
+    pixels = np.asarray(image.resize((size, size), Image.Resampling.BILINEAR), dtype=np.float32) / 255.0
+    pixels = (pixels - np.array(mean, dtype=np.float32)) / np.array(std, dtype=np.float32)
+    tensor = pixels.transpose(2, 0, 1)[np.newaxis]
+
+    # The first output is the fused saliency map, shaped (1, 1, size, size)
+    prediction = _session.run(None, {_session.get_inputs()[0].name: tensor})[0][0, 0]
+    low, high = float(prediction.min()), float(prediction.max())
+    prediction = (prediction - low) / max(high - low, 1e-6)
+    mask = Image.fromarray((prediction * 255).astype(np.uint8), "L").resize(image.size, Image.Resampling.BILINEAR)
+
+    image.putalpha(mask)
+    output = io.BytesIO()
+    # The default zlib level takes longer than the inference itself and only saves about a fifth of the size
+    image.save(output, "PNG", compress_level=1)
+    return output.getvalue()
+
+
+def _warm_up() -> None:
+    from PIL import Image
+
+    blank = io.BytesIO()
+    Image.new("RGB", (64, 64)).save(blank, "PNG")
+    _segment(blank.getvalue())
+
+
+class LocalBackgroundRemover(BackgroundRemover):
+    """
+    Segmentation on this machine's CPU with onnxruntime.
+
+    Inference runs in worker processes so it neither blocks the event
+    loop nor competes for the GIL; each worker loads the model once.
+
+    Args:
+        model_path: ONNX file of a U²-Net, IS-Net or BiRefNet model
+        family: Key of MODEL_FAMILIES matching the model's preprocessing
+        workers: Worker processes, i.e. images segmented at once
+        threads: onnxruntime threads per worker
+    """
+
+    name = "local"
+    dependency = None
+
+    def __init__(self, model_path: str, family: str = "u2net", workers: int = 2, threads: int = 1):
+        if family not in MODEL_FAMILIES:
+            raise ValueError(f"Unknown model family {family!r}, expected one of {', '.join(MODEL_FAMILIES)}")
+        self.model_path = model_path
+        self.family = family
+        self.workers = workers
+        self.threads = threads
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            if not self.model_path or not os.path.exists(self.model_path):
+                raise RuntimeError(f"Background removal model not found at {self.model_path!r}, set BG_REMOVAL_MODEL")
+            # Spawned rather than forked, since the server process runs threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_load_model,
+                initargs=(self.model_path, self.family, self.threads)
+            )
+        return self._pool
+
+    async def start(self) -> None:
+        # One warm-up per worker, so every process is spawned and has the model loaded
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        await asyncio.gather(*(loop.run_in_executor(pool, _warm_up) for _ in range(self.workers)))
+        logger.info(f"Local background removal ready with {self.workers} workers")
+
+    async def remove(self, image: str, deadline: Deadline) -> str:
+        data = await _read_image(image, deadline)
+        cutout = await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(self._get_pool(), _segment, data),
+            deadline.timeout(REMOVE_BG_TIMEOUT)
+        )
+        return f"data:image/png;base64,{base64.b64encode(cutout).decode('utf-8')}"
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+async def _read_image(image: str, deadline: Deadline) -> bytes:
+    if image.startswith("data:"):
+        return base64.b64decode(image.split(",", 1)[1])
+
+    import aiohttp
+
+    session = await get_http_session()
+    async with session.get(image, timeout=aiohttp.ClientTimeout(total=deadline.timeout(REMOVE_BG_TIMEOUT))) as response:
+        response.raise_for_status()
+        return await response.read()
+
+
+def create_background_remover(backend: str) -> BackgroundRemover:
+    """The backend named by BG_REMOVAL_BACKEND, configured from the environment"""
+    if backend == "replicate":
+        return ReplicateBackgroundRemover()
+    if backend == "local":
+        return LocalBackgroundRemover(
+            model_path=os.getenv("BG_REMOVAL_MODEL", ""),
+            family=os.getenv("BG_REMOVAL_MODEL_FAMILY", "u2net"),
+            workers=int(os.getenv("BG_REMOVAL_WORKERS", "2")),
+            threads=int(os.getenv("BG_REMOVAL_THREADS", "1")),
+        )
+    raise ValueError(f"Unknown background removal backend {backend!r}, expected replicate or local")
+
+
+background_remover = create_background_remover(os.getenv("BG_REMOVAL_BACKEND", "replicate"))
@@ -0,0 +1,337 @@
+"""
+Batch generation: several backgrounds for several source photos in one job.
+
+Submitting photos × backgrounds single generations repeats the product
+lookup, the background removal and the prompt for every combination. A
+batch works from a shared plan instead:
+
+  1. the product is fetched and a token reserved per combination, once
+  2. each source photo's stored cut-out (edited_photo_url) is fetched once,
+     so no background is removed again
+  3. one prompt is generated per background description and reused for
+     every photo, since the prompt describes the scene, not the shot
+  4. the inpaint runs fan out, at most BATCH_CONCURRENCY at a time, each
+     through the fair scheduler like a single generation
+
+Each combination's images are streamed to the client as soon as they are
+stored, and its token is committed or refunded on its own, so one failed
+inpaint doesn't cost or block the rest of the batch. A combination that
+fails after storing some of its images is charged for those only.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from contextlib import aclosing
+from typing import List, Optional
+import asyncio
+import logging
+import math
+import os
+import uuid
+
+from fastapi import HTTPException
+
+from app.core.auth import (
+    TokenReservation, commit_reservation, get_supabase_client, get_user_supabase_client, release_reservation,
+    reservation_hold, reserve_tokens
+)
+from app.core.cache import response_cache
+from app.core.clients import get_s3_client
+from app.core.metrics import StageTimer
+from app.core.ownership import require_product_owner
+from app.core.resilience import JOB_DEADLINE, Deadline, call_with_retries
+from app.core.scheduler import dependency_limits, generation_scheduler, plan_weight
+from app.image_processing.preprocess import normalize_image
+from app.image_processing.product_image_generator import (
+    BUCKET_NAME, IMAGES_DIR, TRANSFER_TIMEOUT, download_file, inpaint_variants, resolve_variant_count, upload_image,
+    variant_tokens
+)
+from app.llm_service.providers.openai_client import generate_ad_photo_prompt
+from app.stats.counters import increment_usage
+from app.websockets.connection_manager import manager
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['generate_ad_photo_batch', 'BATCH_MAX_ITEMS', 'BATCH_CONCURRENCY']
+
+# Photos × backgrounds allowed in one batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "30"))
+# Inpaint runs of one batch in flight at once; defaults to what the scheduler lets one user run
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", os.getenv("GENERATION_PER_USER_LIMIT", "2")))
+
+
+@dataclass
+class _SourcePhoto:
+    id: str
+    url: str
+    path: str
+    data_uri: str
+
+
+@dataclass
+class _Item:
+    photo: _SourcePhoto
+    background_description: Optional[str]
+    reservation: Optional[TokenReservation] = None
+    status: str = "pending"
+    image_urls: List[str] = field(default_factory=list)
+    message: Optional[str] = None
+
+    def result(self) -> dict:
+        return {
+            "source_photo_id": self.photo.id,
+            "background_description": self.background_description,
+            "status": self.status,
+            "image_urls": self.image_urls,
+            "message": self.message,
+        }
+
+
+def _error_detail(error: Exception) -> dict:
+    if isinstance(error, HTTPException):
+        return error.detail if isinstance(error.detail, dict) else {"message": str(error.detail)}
+    return {"message": str(error)}
+
+
+def _validate(source_photo_ids: List[str], background_descriptions: List[Optional[str]]) -> None:
+    if not source_photo_ids or not background_descriptions:
+        raise ValueError("At least one source photo and one background description are required")
+    items = len(source_photo_ids) * len(background_descriptions)
+    if items > BATCH_MAX_ITEMS:
+        raise ValueError(f"A batch may have at most {BATCH_MAX_ITEMS} photo and background combinations, got {items}")
+
+
+async def _fetch_source_photo(photo: dict, deadline: Deadline) -> _SourcePhoto:
+    """Download a source photo's cut-out from S3 and prepare it for the models"""
+    url = photo["edited_photo_url"]
+    key = url.replace(f"https://{BUCKET_NAME}.s3.amazonaws.com/", "")
+
+    async def get(timeout: float) -> bytes:
+        def read() -> bytes:
+            return get_s3_client().get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
+        return await asyncio.wait_for(asyncio.to_thread(read), timeout)
+
+    data = await call_with_retries(
+        get, dependency="s3", operation="get_object", deadline=deadline, attempt_timeout=TRANSFER_TIMEOUT
+    )
+    # Cut-outs stored before uploads were normalised can be full camera resolution
+    prepared = await asyncio.to_thread(normalize_image, data)
+    path = f"{IMAGES_DIR}/removed_bg/{uuid.uuid4()}{'.png' if prepared.content_type == 'image/png' else '.jpg'}"
+    with open(path, "wb") as f:
+        f.write(prepared.data)
+    return _SourcePhoto(id=photo["id"], url=url, path=path, data_uri=prepared.data_uri())
+
+
+async def generate_ad_photo_batch(
+    product_id: str,
+    source_photo_ids: List[str],
+    background_descriptions: List[Optional[str]],
+    access_token: str,
+    refresh_token: str,
+    variant_count: Optional[int] = None
+) -> dict:
+    """Generate every combination of existing source photos and background descriptions.
+
+    Args:
+        product_id: ID of the product
+        source_photo_ids: IDs of the product's source_photos to use
+        background_descriptions: Background descriptions; None or "" lets the prompt model choose
+        access_token: Bearer access token for authentication
+        refresh_token: Bearer refresh token for authentication
+        variant_count: Images per combination, up to the plan's limit; DEFAULT_VARIANT_COUNT if not given
+
+    Returns:
+        dict: Batch status ("success", "partial" or "error") and a result per combination
+
+    Raises:
+        ValueError: If the batch is empty or larger than BATCH_MAX_ITEMS
+    """
+    source_photo_ids = list(dict.fromkeys(str(photo_id) for photo_id in source_photo_ids))
+    background_descriptions = list(dict.fromkeys(background_descriptions))
+    _validate(source_photo_ids, background_descriptions)
+
+    batch_id = str(uuid.uuid4())
+    timer = StageTimer()
+    deadline = Deadline(JOB_DEADLINE)
+    items: List[_Item] = []
+    photos: List[_SourcePhoto] = []
+    user_id = None
+
+    async def status(status: str, message: str, **extra) -> None:
+        await manager.broadcast({
+            "type": "processing_status",
+            "status": status,
+            "message": message,
+            "batch_id": batch_id,
+            "product_id": product_id,
+            "timings": timer.summary(),
+            **extra
+        })
+
+    try:
+        await status("started", f"Starting batch of {len(source_photo_ids) * len(background_descriptions)} generations",
+                     total=len(source_photo_ids) * len(background_descriptions))
+
+        supabase = get_user_supabase_client(access_token, refresh_token)
+        user_id = supabase.auth.get_user().user.id
+        service_supabase = get_supabase_client()
+
+        with timer.stage("fetch_product", dependency="supabase"):
+            await asyncio.to_thread(require_product_owner, supabase, user_id, product_id)
+            product_result, photos_result = await asyncio.gather(
+                asyncio.to_thread(
+                    supabase.table("product_descriptions")
+                    .select("product_description, target_customers")
+                    .eq("id", product_id)
+                    .execute
+                ),
+                asyncio.to_thread(
+                    supabase.table("source_photos")
+                    .select("id, edited_photo_url")
+                    .eq("product_id", product_id)
+                    .in_("id", source_photo_ids)
+                    .execute
+                )
+            )
+            product = product_result.data[0]
+            photo_rows = photos_result.data
+        missing = set(source_photo_ids) - {str(row["id"]) for row in photo_rows}
+        if missing:
+            raise ValueError(f"Source photos not found for this product: {', '.join(sorted(missing))}")
+
+        with timer.stage("download", dependency="s3"):
+            photos = await asyncio.gather(*(_fetch_source_photo(row, deadline) for row in photo_rows))
+        items = [_Item(photo, description) for description in background_descriptions for photo in photos]
+        variant_count = resolve_variant_count(variant_count, user_id, service_supabase)
+
+        # Every combination's token up front, so the batch is refused whole rather than stopping half way.
+        # Items run BATCH_CONCURRENCY at a time, each waiting for its own generation slot, so the
+        # reservations are held for one queue wait per round.
+        hold_seconds = reservation_hold(queue_waits=math.ceil(len(items) / BATCH_CONCURRENCY))
+        with timer.stage("reserve_tokens", dependency="supabase"):
+            for item in items:
+                item.reservation = await reserve_tokens(
+                    user_id, amount=variant_tokens(variant_count), supabase=service_supabase, hold_seconds=hold_seconds
+                )
+
+        await status("generating_prompt", f"Generating {len(background_descriptions)} AI prompts")
+
+        async def make_prompt(description: Optional[str]):
+            async with dependency_limits.slot("openai"):
+                return await asyncio.to_thread(
+                    generate_ad_photo_prompt, photos[0].data_uri, product["product_description"],
+                    product["target_customers"], description
+                )
+
+        with timer.stage("prompt", dependency="openai"):
+            prompts = dict(zip(
+                background_descriptions,
+                await asyncio.gather(*(make_prompt(description) for description in background_descriptions))
+            ))
+
+        weight = plan_weight(user_id, service_supabase)
+        limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+        completed = 0
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+        async def run_item(index: int, item: _Item) -> None:
+            nonlocal completed
+            prompt = prompts[item.background_description]
+            ticket = None
+            try:
+                async with limit:
+                    with timer.stage("queue"):
+                        ticket = await generation_scheduler.acquire(user_id, weight)
+                    with timer.stage("inpaint", dependency="replicate"):
+                        variants = inpaint_variants(
+                            prompt.positive_prompt, prompt.negative_prompt, item.photo.data_uri, variant_count, deadline
+                        )
+                        async with aclosing(variants):
+                            outputs = [url async for url in variants]
+                    generation_scheduler.release(ticket)
+                    ticket = None
+
+                for idx, image_url in enumerate(outputs):
+                    local_path = f"{IMAGES_DIR}/generated/{image_url.split('/')[-1]}"
+                    with timer.stage("download", dependency="http"):
+                        await download_file(image_url, local_path, deadline)
+                    with timer.stage("s3_upload", dependency="s3"):
+                        s3_url = await upload_image(
+                            local_path, f"products/{product_id}/generated_{timestamp}_{index}_{idx}", deadline
+                        )
+                    with timer.stage("db_insert", dependency="supabase"):
+                        await asyncio.to_thread(
+                            supabase.table("product_photos").insert({
+                                "product_id": product_id,
+                                "image_url": s3_url,
+                                "source_image_url": item.photo.url,
+                                "no_bg_image_url": item.photo.url,
+                                "background_description": item.background_description,
+                                "positive_prompt": prompt.positive_prompt,
+                                "negative_prompt": prompt.negative_prompt
+                            }).execute
+                        )
+                        await asyncio.to_thread(increment_usage, service_supabase, user_id, generated_images=1)
+                    item.image_urls.append(s3_url)
+                    if os.getenv('ENVIRONMENT') == 'production':
+                        os.remove(local_path)
+
+                with timer.stage("commit_tokens", dependency="supabase"):
+                    await commit_reservation(item.reservation, supabase=service_supabase)
+                item.status = "success"
+            except Exception as e:
+                logger.error(f"Batch {batch_id} item {index} failed: {str(e)}")
+                # Images stored before the failure stay in the gallery, so they are paid for
+                if item.image_urls:
+                    await commit_reservation(
+                        item.reservation, supabase=service_supabase, amount=variant_tokens(len(item.image_urls))
+                    )
+                else:
+                    await release_reservation(item.reservation, supabase=service_supabase)
+                item.status = "error"
+                item.message = _error_detail(e)["message"]
+            finally:
+                item.reservation = None
+                if ticket is not None:
+                    generation_scheduler.release(ticket)
+
+            completed += 1
+            await status("batch_item_complete", f"Finished {completed} of {len(items)}",
+                         item=item.result(), completed=completed, total=len(items))
+
+        await status("generating_images", f"Generating images for {len(items)} combinations...")
+        await asyncio.gather(*(run_item(index, item) for index, item in enumerate(items)))
+
+        succeeded = sum(1 for item in items if item.status == "success")
+        response = {
+            "status": "success" if succeeded == len(items) else "partial" if succeeded else "error",
+            "batch_id": batch_id,
+            "product_id": product_id,
+            "items": [item.result() for item in items],
+            "timings": timer.summary()
+        }
+        await status("batch_complete", f"Batch finished, {succeeded} of {len(items)} succeeded",
+                     data=response)
+        return response
+
+    except Exception as e:
+        # Nothing was generated for combinations that never started
+        for item in items:
+            if item.reservation is not None:
+                await release_reservation(item.reservation)
+        detail = _error_detail(e)
+        logger.error(f"Error in generate_ad_photo_batch: {detail['message']}")
+        await status("error", f"Error processing batch: {detail['message']}", code=detail.get("code"))
+        return {
+            "status": "error",
+            "batch_id": batch_id,
+            "message": detail["message"],
+            "code": detail.get("code"),
+            "product_id": product_id
+        }
+
+    finally:
+        if user_id is not None:
+            await response_cache.invalidate_user(user_id)
+        if os.getenv('ENVIRONMENT') == 'production':
+            for photo in photos:
+                os.remove(photo.path)
@@ -0,0 +1,227 @@
+"""
+Asynchronous Replicate predictions.
+
+`replicate.run` blocks until the model finishes and never exposes the
+prediction ID. PredictionManager creates predictions without waiting and
+keeps a future per outstanding prediction. The future is resolved by
+Replicate's completion webhook when REPLICATE_WEBHOOK_URL and
+REPLICATE_WEBHOOK_SECRET are set, and by polling with exponential backoff
+otherwise (or when the webhook is lost or lands on another worker), so
+one process can have hundreds of predictions in flight.
+"""
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+import asyncio
+import logging
+import os
+import random
+
+from app.core.clients import get_replicate
+from app.core.metrics import REPLICATE_PREDICTIONS_PENDING, track_external
+from app.core.scheduler import dependency_limits
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['PredictionError', 'PredictionManager', 'is_replicate_outage', 'prediction_manager']
+
+TERMINAL_STATUSES = {"succeeded", "failed", "canceled"}
+
+
+class PredictionError(Exception):
+    """A prediction that failed, was canceled or timed out"""
+
+    def __init__(self, prediction_id: str, status: str, error: Optional[str] = None):
+        self.prediction_id = prediction_id
+        self.status = status
+        self.error = error
+        super().__init__(f"Prediction {prediction_id} {status}: {error or 'no error details'}")
+
+
+def is_replicate_outage(error: Exception) -> bool:
+    """Whether a failed prediction call should count against Replicate's circuit breaker"""
+    # A prediction the model itself failed is worth a retry, but says nothing about Replicate's health
+    return not (isinstance(error, PredictionError) and error.status == "failed")
+
+
+def _snapshot(prediction) -> Dict[str, Any]:
+    return {
+        "id": prediction.id,
+        "status": prediction.status,
+        "output": prediction.output,
+        "error": prediction.error,
+    }
+
+
+class PredictionManager:
+    """
+    Tracks outstanding Replicate predictions by ID.
+
+    Args:
+        webhook_url: Public URL of /webhooks/replicate; webhooks are only requested when a secret is set too
+        webhook_secret: Replicate webhook signing secret ("whsec_...")
+        poll_initial: Seconds before the first status poll
+        poll_max: Upper bound for the poll interval as it doubles
+        timeout: Seconds after which a prediction is canceled and reported as timed out
+        max_concurrency: Replicate API calls (create/get/cancel) allowed in flight at once
+    """
+
+    def __init__(
+        self,
+        webhook_url: Optional[str] = None,
+        webhook_secret: Optional[str] = None,
+        poll_initial: float = 0.5,
+        poll_max: float = 10.0,
+        timeout: float = 600.0,
+        max_concurrency: int = 32
+    ):
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.timeout = timeout
+        self._api_calls = asyncio.Semaphore(max_concurrency)
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    @property
+    def webhooks_enabled(self) -> bool:
+        return bool(self.webhook_url and self.webhook_secret)
+
+    @property
+    def outstanding(self) -> int:
+        return len(self._pending)
+
+    @asynccontextmanager
+    async def _api_call(self, operation: str) -> AsyncIterator[None]:
+        async with self._api_calls:
+            with track_external("replicate", operation):
+                yield
+
+    async def run(self, ref: str, input: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """Create a prediction and wait for its output, like `replicate.run` but without blocking the loop
+
+        Args:
+            ref: "owner/name:version" or "owner/name" for official models
+            input: Model input
+            timeout: Seconds before the prediction is canceled, instead of the manager's default
+
+        Returns:
+            The prediction's output (a URL or list of URLs for image models)
+
+        Raises:
+            PredictionError: If the prediction fails, is canceled or times out
+        """
+        # Held for the whole prediction, so DEPENDENCY_CONCURRENCY bounds outstanding predictions
+        async with dependency_limits.slot("replicate"):
+            prediction = await self.create(ref, input)
+            return await self.wait(prediction, timeout)
+
+    async def create(self, ref: str, input: Dict[str, Any]) -> Dict[str, Any]:
+        """Start a prediction and register it as outstanding"""
+        replicate = get_replicate()
+        params = {}
+        if self.webhooks_enabled:
+            params = {"webhook": self.webhook_url, "webhook_events_filter": ["completed"]}
+
+        async with self._api_call("create_prediction"):
+            if ":" in ref:
+                prediction = await replicate.predictions.async_create(
+                    version=ref.split(":", 1)[1], input=input, **params
+                )
+            else:
+                prediction = await replicate.predictions.async_create(model=ref, input=input, **params)
+
+        snapshot = _snapshot(prediction)
+        self._pending[snapshot["id"]] = asyncio.get_running_loop().create_future()
+        REPLICATE_PREDICTIONS_PENDING.inc()
+        logger.info(f"Created prediction {snapshot['id']} for {ref}")
+        return snapshot
+
+    async def wait(self, prediction: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """Wait for a prediction returned by `create` to finish
+
+        If the waiting task is cancelled, the prediction is cancelled on Replicate as well.
+
+        Returns:
+            The prediction's output
+
+        Raises:
+            PredictionError: If the prediction fails, is canceled or times out
+        """
+        prediction_id = prediction["id"]
+        loop = asyncio.get_running_loop()
+        future = self._pending.get(prediction_id) or loop.create_future()
+        timeout = timeout or self.timeout
+        deadline = loop.time() + timeout
+        delay = self.poll_initial
+        try:
+            while prediction["status"] not in TERMINAL_STATUSES:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    await self._cancel(prediction_id)
+                    raise PredictionError(prediction_id, "timed out", f"no result after {timeout:.0f}s")
+                # Jitter keeps hundreds of waiters from polling in lockstep
+                try:
+                    prediction = await asyncio.wait_for(
+                        asyncio.shield(future), timeout=min(delay * random.uniform(0.8, 1.2), remaining)
+                    )
+                    break
+                except asyncio.TimeoutError:
+                    pass
+                prediction = await self._poll(prediction)
+                delay = min(delay * 2, self.poll_max)
+        except asyncio.CancelledError:
+            # The caller gave up (a sibling stage failed, a retry timed out, the client left);
+            # stop the prediction too instead of letting it run and bill to completion
+            if prediction["status"] not in TERMINAL_STATUSES and not future.done():
+                await asyncio.shield(self._cancel(prediction_id))
+            raise
+        finally:
+            if self._pending.pop(prediction_id, None) is not None:
+                REPLICATE_PREDICTIONS_PENDING.dec()
+
+        if prediction["status"] != "succeeded":
+            raise PredictionError(prediction_id, prediction["status"], prediction.get("error"))
+        return prediction["output"]
+
+    async def _poll(self, prediction: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            async with self._api_call("get_prediction"):
+                return _snapshot(await get_replicate().predictions.async_get(prediction["id"]))
+        except Exception as e:
+            # A failed poll is retried on the next, longer interval
+            logger.warning(f"Polling prediction {prediction['id']} failed: {str(e)}")
+            return prediction
+
+    async def _cancel(self, prediction_id: str) -> None:
+        try:
+            async with self._api_call("cancel_prediction"):
+                await get_replicate().predictions.async_cancel(prediction_id)
+        except Exception as e:
+            logger.warning(f"Canceling prediction {prediction_id} failed: {str(e)}")
+
+    def resolve(self, payload: Dict[str, Any]) -> bool:
+        """Complete an outstanding prediction from a verified webhook payload
+
+        Returns:
+            False if this process isn't waiting on the prediction or it hasn't finished
+        """
+        future = self._pending.get(payload.get("id"))
+        if future is None or future.done() or payload.get("status") not in TERMINAL_STATUSES:
+            return False
+        future.set_result({
+            "id": payload["id"],
+            "status": payload["status"],
+            "output": payload.get("output"),
+            "error": payload.get("error"),
+        })
+        return True
+
+
+prediction_manager = PredictionManager(
+    webhook_url=os.getenv("REPLICATE_WEBHOOK_URL"),
+    webhook_secret=os.getenv("REPLICATE_WEBHOOK_SECRET"),
+    poll_initial=float(os.getenv("REPLICATE_POLL_INITIAL", "0.5")),
+    poll_max=float(os.getenv("REPLICATE_POLL_MAX", "10")),
+    timeout=float(os.getenv("REPLICATE_PREDICTION_TIMEOUT", "600")),
+    max_concurrency=int(os.getenv("REPLICATE_MAX_CONCURRENCY", "32")),
+)
@@ -0,0 +1,85 @@
+"""
+Input image normalisation before model calls.
+
+Phone uploads are often 12 MP JPEGs with an EXIF rotation flag, a wide
+gamut colour profile and location metadata. The models work at about a
+megapixel, so the upload is decoded once (JPEGs directly at a reduced
+scale), rotated upright, converted to sRGB, stripped of metadata, resized
+to MODEL_IMAGE_MAX_SIDE and re-encoded. The original bytes are kept
+untouched for archival.
+"""
+from dataclasses import dataclass
+import base64
+import io
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['PreparedImage', 'normalize_image', 'MODEL_IMAGE_MAX_SIDE']
+
+# Longest side sent to remove-bg, ad-inpaint and the vision model
+MODEL_IMAGE_MAX_SIDE = int(os.getenv("MODEL_IMAGE_MAX_SIDE", "1024"))
+JPEG_QUALITY = int(os.getenv("MODEL_IMAGE_JPEG_QUALITY", "90"))
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    content_type: str
+    width: int
+    height: int
+
+    def data_uri(self) -> str:
+        return f"data:{self.content_type};base64,{base64.b64encode(self.data).decode('utf-8')}"
+
+
+def normalize_image(data: bytes, max_side: int = MODEL_IMAGE_MAX_SIDE) -> PreparedImage:
+    """
+    Decode, orient, convert and shrink an uploaded image for the models. CPU bound; run it in a thread.
+
+    Args:
+        data: The uploaded file
+        max_side: Longest side of the result; smaller images are not enlarged
+
+    Returns:
+        JPEG, or PNG when the upload has transparency
+
+    Raises:
+        ValueError: If the data is not an image Pillow can read
+    """
+    from PIL import Image, ImageCms, ImageOps, UnidentifiedImageError
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        # JPEGs decode straight to the nearest 1/2, 1/4 or 1/8 scale above max_side
+        image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError(f"Uploaded file is not a supported image: {str(e)}")
+
+    icc_profile = image.info.get("icc_profile")
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    if icc_profile:
+        # Without the profile a Display P3 photo would look washed out, so convert its pixels to sRGB
+        try:
+            source = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+            image = ImageCms.profileToProfile(image, source, ImageCms.createProfile("sRGB"), outputMode=image.mode)
+        except (ImageCms.PyCMSError, OSError) as e:
+            logger.warning(f"Ignoring unreadable colour profile: {str(e)}")
+
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+    # Saved without exif or icc_profile, so no metadata survives
+    output = io.BytesIO()
+    if has_alpha:
+        image.save(output, "PNG")
+        content_type = "image/png"
+    else:
+        image.save(output, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        content_type = "image/jpeg"
+
+    return PreparedImage(data=output.getvalue(), content_type=content_type, width=image.width, height=image.height)
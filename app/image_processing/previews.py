@@ -0,0 +1,149 @@
+"""
+Instant previews composited locally while the inpaint model runs.
+
+As soon as the background is removed, the cut-out is pasted onto a few
+background plates with NumPy alpha compositing and sent to the client, so
+the user sees their product in a scene within a second instead of after
+the full ad-inpaint prediction. Plates are loaded from PREVIEW_PLATES_DIR
+(any images, centre-cropped to a square) or, when that is empty, drawn as
+simple studio backdrops. Either way they are decoded once per process and
+kept as float arrays.
+"""
+from typing import List, Optional
+import io
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['render_previews', 'product_scale', 'PREVIEW_COUNT', 'PREVIEW_SIZE']
+
+PREVIEW_COUNT = int(os.getenv("PREVIEW_COUNT", "3"))
+PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE", "512"))
+PREVIEW_JPEG_QUALITY = int(os.getenv("PREVIEW_JPEG_QUALITY", "80"))
+PLATES_DIR = os.getenv(
+    "PREVIEW_PLATES_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "plates")
+)
+
+# Top and bottom colours of the built-in backdrops
+BUILTIN_PLATES = [
+    ((246, 246, 244), (214, 212, 208)),  # white studio sweep
+    ((238, 226, 208), (196, 170, 140)),  # warm sand
+    ((214, 224, 234), (150, 166, 184)),  # cool grey-blue
+    ((70, 74, 82), (30, 32, 36)),        # dark slate
+    ((248, 226, 228), (214, 176, 182)),  # blush
+]
+
+# Where the product stands: horizontal centre, and its base as a fraction of plate height
+FLOOR_LINE = 0.86
+
+_plates = {}
+
+
+def product_scale(product_size: str) -> Optional[float]:
+    """Product width as a fraction of the image width from ad-inpaint's product_size, e.g. "0.5 * width"
+
+    Returns:
+        None for "Original", which keeps the cut-out's own size
+    """
+    match = re.match(r"\s*([0-9.]+)\s*\*\s*width", product_size or "")
+    return float(match.group(1)) if match else None
+
+
+def _load_plates(size: int):
+    """Plates as (size, size, 3) float32 arrays, cached per size"""
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    if size in _plates:
+        return _plates[size]
+
+    plates = []
+    if os.path.isdir(PLATES_DIR):
+        for name in sorted(os.listdir(PLATES_DIR)):
+            try:
+                with Image.open(os.path.join(PLATES_DIR, name)) as image:
+                    plate = ImageOps.fit(image.convert("RGB"), (size, size), Image.Resampling.LANCZOS)
+                plates.append(np.asarray(plate, dtype=np.float32))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping preview plate {name}: {str(e)}")
+
+    if not plates:
+        # Vertical gradient with a slightly darker floor below the product's base
+        rows = np.linspace(0.0, 1.0, size, dtype=np.float32)[:, None, None]
+        floor = (rows > FLOOR_LINE - 0.04).astype(np.float32) * 0.06
+        for top, bottom in BUILTIN_PLATES:
+            top, bottom = np.array(top, dtype=np.float32), np.array(bottom, dtype=np.float32)
+            gradient = top + (bottom - top) * rows
+            plates.append(np.broadcast_to(gradient * (1.0 - floor), (size, size, 3)).copy())
+
+    _plates[size] = plates
+    return plates
+
+
+def render_previews(
+    cutout: bytes,
+    product_size: str,
+    count: int = PREVIEW_COUNT,
+    size: int = PREVIEW_SIZE,
+    offset: int = 0
+) -> List[bytes]:
+    """
+    Composite a background-removed product onto preview plates. CPU bound; run it in a thread.
+
+    Args:
+        cutout: PNG with a transparent background, as returned by remove_bg
+        product_size: ad-inpaint's product_size, so the preview frames the product like the final images
+        count: Number of previews, each on a different plate
+        size: Side of the square previews
+        offset: First plate to use, so repeated generations show different scenes
+
+    Returns:
+        JPEG previews
+    """
+    import numpy as np
+    from PIL import Image, ImageFilter
+
+    plates = _load_plates(size)
+    with Image.open(io.BytesIO(cutout)) as source:
+        product = source.convert("RGBA")
+    canvas = max(product.size)
+    bbox = product.getchannel("A").getbbox()
+    if bbox is None:
+        return []
+    product = product.crop(bbox)
+
+    # Fit the product to the requested width, and always inside the plate above the floor line
+    scale = product_scale(product_size)
+    width = scale * size if scale else product.width * size / canvas
+    factor = min(width / product.width, FLOOR_LINE * 0.95 * size / product.height)
+    product = product.resize(
+        (max(1, round(product.width * factor)), max(1, round(product.height * factor))), Image.Resampling.LANCZOS
+    )
+
+    left = (size - product.width) // 2
+    top = max(0, round(FLOOR_LINE * size) - product.height)
+    layer = Image.new("RGBA", (size, size))
+    layer.paste(product, (left, top))
+
+    # Premultiplied foreground and its alpha, plus a soft contact shadow from the blurred, squashed mask
+    pixels = np.asarray(layer, dtype=np.float32)
+    alpha = pixels[..., 3:4] / 255.0
+    foreground = pixels[..., :3] * alpha
+    shadow_mask = layer.getchannel("A").resize((size, max(1, size // 8))).filter(ImageFilter.GaussianBlur(size / 64))
+    shadow = np.zeros((size, size, 1), dtype=np.float32)
+    shadow_top = min(size - shadow_mask.height, round(FLOOR_LINE * size) - shadow_mask.height // 2)
+    shadow[shadow_top:shadow_top + shadow_mask.height, :, 0] = np.asarray(shadow_mask, dtype=np.float32) / 255.0 * 0.35
+
+    previews = []
+    for index in range(min(count, len(plates))):
+        plate = plates[(offset + index) % len(plates)]
+        composite = foreground + plate * (1.0 - shadow) * (1.0 - alpha)
+        output = io.BytesIO()
+        Image.fromarray(np.clip(composite, 0, 255).astype(np.uint8), "RGB").save(
+            output, "JPEG", quality=PREVIEW_JPEG_QUALITY
+        )
+        previews.append(output.getvalue())
+    return previews
@@ -1,143 +1,394 @@
 import asyncio
-import replicate
-from typing import List
-import aiohttp
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional
 import os
 import base64
+import random
 import uuid
 from datetime import datetime
-import boto3
-from app.core.auth import get_supabase_client
+from fastapi import HTTPException
+from app.core.auth import (
+    TokenReservation, get_supabase_client, get_user_supabase_client, reserve_tokens, commit_reservation,
+    release_reservation
+)
+from app.core.cache import response_cache
+from app.core.clients import get_http_session, get_s3_client
+from app.core.draining import ServerDrainingError, generation_jobs
+from app.core.metrics import StageTimer
+from app.core.ownership import require_product_owner
+from app.core.scheduler import dependency_limits, generation_scheduler, plan_max_variants, plan_weight
+from app.core.singleflight import flight_key, pipeline_flights
+from app.core.stages import StageGraph
+from app.core.resilience import JOB_DEADLINE, Deadline, call_with_retries, hedged
+from app.image_processing.background_removal import background_remover
+from app.image_processing.predictions import is_replicate_outage, prediction_manager
+from app.image_processing.preprocess import normalize_image
+from app.image_processing.previews import render_previews
+from app.image_processing.variants import encode_variants, extension_for, sniff_content_type, variant_key
 import logging
 from app.llm_service.providers.openai_client import generate_ad_photo_prompt
 from app.websockets.connection_manager import manager
+from app.stats.counters import increment_usage
 
 logger = logging.getLogger(__name__)
 
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('aws_access_key_id'),
-    aws_secret_access_key=os.getenv('aws_secret_access_key')
-)
 BUCKET_NAME = os.getenv('bucket_name')
 
-async def generate_ad_photo(image: str, product_id: str, access_token: str, refresh_token: str, background_description: str = None):
+# Upper bounds for a single attempt; every attempt is also bounded by the job's deadline (JOB_DEADLINE)
+INPAINT_TIMEOUT = float(os.getenv("INPAINT_TIMEOUT", "300"))
+TRANSFER_TIMEOUT = float(os.getenv("TRANSFER_TIMEOUT", "60"))
+# A download still running after this many seconds gets a backup request; 0 disables hedging
+DOWNLOAD_HEDGE_DELAY = float(os.getenv("DOWNLOAD_HEDGE_DELAY", "2"))
+# How large ad-inpaint draws the product; the local previews use the same framing
+PRODUCT_SIZE = "0.5 * width"
+
+# ad-inpaint makes at most this many images per prediction; larger requests run several predictions
+INPAINT_MAX_IMAGES = 4
+DEFAULT_VARIANT_COUNT = int(os.getenv("DEFAULT_VARIANT_COUNT", "4"))
+# A generation costs one token per started block of this many variants. Every variant is kept;
+# the product mask ad-inpaint returns first is neither stored nor charged.
+VARIANTS_PER_TOKEN = int(os.getenv("VARIANTS_PER_TOKEN", "4"))
+
+# Local working copies of images; resolved from this file so the process cwd doesn't matter
+IMAGES_DIR = os.path.join(
+    os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data")),
+    "images"
+)
+
+async def download_file(url: str, path: str, deadline: Deadline) -> None:
+    """Download a model output to a local path, retrying failures and hedging slow responses
+    
+    Args:
+        url: URL of the file, or a data: URI such as a local background removal's output
+        path: Local path to write it to
+        deadline: The job's deadline
+    """
+    if url.startswith("data:"):
+        with open(path, "wb") as f:
+            f.write(base64.b64decode(url.split(",", 1)[1]))
+        return
+    
+    import aiohttp
+    
+    session = await get_http_session()
+    
+    async def fetch(timeout: float) -> bytes:
+        async def attempt() -> bytes:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                response.raise_for_status()
+                return await response.read()
+        return await hedged(attempt, DOWNLOAD_HEDGE_DELAY, "download")
+    
+    content = await call_with_retries(
+        fetch, dependency="http", operation="download", deadline=deadline, attempt_timeout=TRANSFER_TIMEOUT
+    )
+    with open(path, "wb") as f:
+        f.write(content)
+
+async def upload_file(path: str, key: str, deadline: Deadline, content_type: Optional[str] = None) -> str:
+    """Upload a local file to S3 from a worker thread, retrying failures
+    
+    Args:
+        path: Local path of the file
+        key: S3 object key
+        deadline: The job's deadline
+        content_type: Content-Type to store with the object
+    
+    Returns:
+        Public URL of the uploaded object
+    """
+    extra_args = {"ContentType": content_type} if content_type else None
+    
+    async def put(timeout: float) -> None:
+        await asyncio.wait_for(
+            asyncio.to_thread(get_s3_client().upload_file, path, BUCKET_NAME, key, ExtraArgs=extra_args), timeout
+        )
+    
+    await call_with_retries(
+        put, dependency="s3", operation="upload_file", deadline=deadline, attempt_timeout=TRANSFER_TIMEOUT
+    )
+    return f"https://{BUCKET_NAME}.s3.amazonaws.com/{key}"
+
+# Variant uploads still running; referenced so they aren't garbage collected mid-flight
+_variant_tasks = set()
+
+async def upload_image(path: str, key_stem: str, deadline: Deadline, variants: bool = True) -> str:
+    """Upload an image under the extension and Content-Type of its actual format
+    
+    With `variants`, WebP and AVIF copies are encoded and uploaded in the
+    background afterwards, so the job doesn't wait for the encoder. Until
+    they exist the image proxy serves the master.
+    
+    Args:
+        path: Local path of the image
+        key_stem: S3 key without extension, e.g. products/1/no_bg_20240101_120000
+        deadline: The job's deadline
+        variants: Whether this is a delivery image that gets modern format variants
+    
+    Returns:
+        Public URL of the uploaded master
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    content_type = sniff_content_type(data)
+    key = key_stem + extension_for(content_type)
+    url = await upload_file(path, key, deadline, content_type)
+    
+    if variants and content_type.startswith("image/"):
+        task = asyncio.create_task(_upload_variants(data, key))
+        _variant_tasks.add(task)
+        task.add_done_callback(_variant_tasks.discard)
+    return url
+
+async def _upload_variants(data: bytes, key: str) -> None:
+    try:
+        # Tracked like a job, so a draining worker finishes the variants before it exits
+        async with generation_jobs.track():
+            encoded = await asyncio.to_thread(encode_variants, data)
+            deadline = Deadline(JOB_DEADLINE)
+            for content_type, variant in encoded:
+                async def put(timeout: float, content_type: str = content_type, variant: bytes = variant) -> None:
+                    await asyncio.wait_for(
+                        asyncio.to_thread(
+                            get_s3_client().put_object,
+                            Bucket=BUCKET_NAME, Key=variant_key(key, content_type), Body=variant, ContentType=content_type
+                        ),
+                        timeout
+                    )
+                
+                await call_with_retries(
+                    put, dependency="s3", operation="put_variant", deadline=deadline, attempt_timeout=TRANSFER_TIMEOUT
+                )
+            logger.info(f"Uploaded {len(encoded)} variants of {key}")
+    except ServerDrainingError:
+        logger.info(f"Skipping variants of {key}, worker is shutting down")
+    except Exception as e:
+        # The proxy falls back to the master, so a missing variant only costs bandwidth
+        logger.warning(f"Could not create variants of {key}: {type(e).__name__}: {str(e)}")
+
+def variant_tokens(count: int) -> int:
+    """Tokens charged for a generation of `count` variants"""
+    return -(-count // VARIANTS_PER_TOKEN)
+
+def resolve_variant_count(requested: Optional[int], user_id: str, supabase) -> int:
+    """The number of variants to generate, DEFAULT_VARIANT_COUNT unless requested
+    
+    Raises:
+        HTTPException: 400 if the count isn't a positive integer, 403 if it exceeds the user's plan
+    """
+    if requested is None:
+        return min(DEFAULT_VARIANT_COUNT, plan_max_variants(user_id, supabase))
+    if isinstance(requested, bool) or not isinstance(requested, int) or requested < 1:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Number of variants must be a positive whole number.", "code": "INVALID_VARIANT_COUNT"}
+        )
+    limit = plan_max_variants(user_id, supabase)
+    if requested > limit:
+        raise HTTPException(
+            status_code=403,
+            detail={
+                "message": f"Your plan allows up to {limit} variants per generation. Please upgrade for more.",
+                "code": "VARIANT_LIMIT"
+            }
+        )
+    return requested
+
+async def inpaint_variants(
+    prompt: str,
+    negative_prompt: str,
+    image: str,
+    count: int,
+    deadline: Deadline
+) -> AsyncIterator[str]:
+    """Generate `count` variants, yielding each output URL as soon as its prediction finishes
+    
+    The count is split into predictions of at most INPAINT_MAX_IMAGES that run
+    concurrently. Predictions still running when the caller stops iterating are cancelled.
+    
+    Args:
+        prompt: The prompt describing the desired output
+        negative_prompt: Prompt specifying what to avoid in generation
+        image: URL or data: URI of the background-removed product
+        count: Number of variants
+        deadline: The job's deadline
+    """
+    sizes = [min(INPAINT_MAX_IMAGES, count - start) for start in range(0, count, INPAINT_MAX_IMAGES)]
+    runs = [
+        asyncio.ensure_future(generate_ad_photos(prompt, size, image, PRODUCT_SIZE, negative_prompt, deadline=deadline))
+        for size in sizes
+    ]
+    try:
+        for run in asyncio.as_completed(runs):
+            # The first output of each prediction is the product mask
+            for url in list(await run)[1:]:
+                yield url
+    finally:
+        for run in runs:
+            run.cancel()
+
+async def generate_ad_photo(image: str, product_id: str, access_token: str, refresh_token: str, background_description: str = None, variant_count: Optional[int] = None):
     """Process image with the given background description.
     
+    A request identical to one still running (a double-click or a retry) joins
+    it and gets the same response instead of reserving tokens and generating again.
+    
     Args:
         image: Base64 encoded image or image URL
         product_id: ID of the product
         access_token: Bearer access token for authentication
         refresh_token: Bearer refresh token for authentication
         background_description: Optional description of the desired background
+        variant_count: Number of images to generate, up to the plan's limit; DEFAULT_VARIANT_COUNT if not given
     
     Returns:
         dict: Response containing the processed image details and URLs
     """
+    # Keyed by the access token, not the user ID, so only the same session can join
+    key = flight_key("generate_ad_photo", access_token, product_id, background_description, variant_count, image)
+    return await pipeline_flights.do(
+        key, lambda: _generate_ad_photo(image, product_id, access_token, refresh_token, background_description, variant_count)
+    )
+
+async def _generate_ad_photo(image: str, product_id: str, access_token: str, refresh_token: str, background_description: str = None, variant_count: Optional[int] = None):
+    reservation = None
+    ticket = None
+    preview_task = None
+    store_tasks = []
+    local_paths = []
+    timer = StageTimer()
     try:
         # Send initial status
         await manager.broadcast({
             "type": "processing_status",
             "status": "started",
             "message": "Starting image generation",
-            "product_id": product_id
+            "product_id": product_id,
+            "timings": timer.summary()
         })
 
         # Get authenticated user from token
-        supabase = get_supabase_client()
-        supabase.auth.set_session(access_token, refresh_token)
+        supabase = get_user_supabase_client(access_token, refresh_token)
         user = supabase.auth.get_user()
         user_id = user.user.id
         
-        # retrieve the product description and target audience from the product_descriptions table
-        await manager.broadcast({
-            "type": "processing_status",
-            "status": "fetching_product",
-            "message": "Fetching product details",
-            "product_id": product_id
-        })
+        # Refuse someone else's product before reserving tokens or spending GPU time on it
+        with timer.stage("authorize", dependency="supabase"):
+            await asyncio.to_thread(require_product_owner, supabase, user_id, product_id)
         
-        product_result = supabase.table("product_descriptions").select("product_description, target_customers").eq("id", product_id).execute()
-        product_description = product_result.data[0]["product_description"]
-        target_audience = product_result.data[0]["target_customers"]
+        # Ledger and counter functions are service-role only, so they don't go through the user session
+        service_supabase = get_supabase_client()
         
-        # store the image to the local filesystem
-        # generate a unique filename
-        filename = f"{uuid.uuid4()}.jpg"
-        image_path = f"data/images/source/{filename}"
-        with open(image_path, "wb") as f:
-            f.write(base64.b64decode(image))
-            
-        await manager.broadcast({
-            "type": "processing_status",
-            "status": "removing_background",
-            "message": "Removing background...",
-            "product_id": product_id
-        })
+        # Take the generation's token before spending any GPU time on it
+        variant_count = resolve_variant_count(variant_count, user_id, service_supabase)
+        with timer.stage("reserve_tokens", dependency="supabase"):
+            reservation = await reserve_tokens(user_id, amount=variant_tokens(variant_count), supabase=service_supabase)
         
-        img_path_removed_bg_url = await remove_bg(image_path, is_url=False)
- 
-        removed_bg_path = f"data/images/removed_bg/{filename}"
-        
-        # save the image from the url to the local filesystem
-        async with aiohttp.ClientSession() as session:
-            async with session.get(img_path_removed_bg_url) as response:
-                content = await response.read()
-                with open(removed_bg_path, "wb") as f:
-                    f.write(content)
-                    
-        # Upload source image with removed background to S3
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        source_s3_key = f"products/{product_id}/source_{timestamp}.jpg"
-        s3_client.upload_file(removed_bg_path, BUCKET_NAME, source_s3_key)
-        source_s3_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{source_s3_key}"
+        # Wait for a fair share of generation capacity, telling the client its place in line
+        async def report_position(position: int) -> None:
+            await manager.broadcast({
+                "type": "processing_status",
+                "status": "queued",
+                "message": f"Waiting for a free slot, position {position} in queue",
+                "queue_position": position,
+                "product_id": product_id,
+                "timings": timer.summary()
+            })
         
-        # Upload the image with removed background to S3
+        with timer.stage("queue"):
+            ticket = await generation_scheduler.acquire(
+                user_id, plan_weight(user_id, service_supabase), on_position=report_position
+            )
+        # Every Replicate, S3 and download call below is bounded by what's left of this
+        deadline = Deadline(JOB_DEADLINE)
+        
+        filename = f"{uuid.uuid4()}.jpg"
+        image_path = f"{IMAGES_DIR}/source/{filename}"
+        removed_bg_path = f"{IMAGES_DIR}/removed_bg/{filename}"
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        no_bg_s3_key = f"products/{product_id}/no_bg_{timestamp}.jpg"
-        s3_client.upload_file(removed_bg_path, BUCKET_NAME, no_bg_s3_key)
-        no_bg_s3_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{no_bg_s3_key}"
         
-        await manager.broadcast({
-            "type": "processing_status",
-            "status": "generating_prompt",
-            "message": "Generating AI prompt",
-            "product_id": product_id
-        })
+        # Stages start as soon as their inputs are ready: the product lookup, background
+        # removal and prompt overlap, and inpainting doesn't wait for the cut-out's uploads
+        graph = StageGraph(timer)
         
-        prompt = generate_ad_photo_prompt(img_path_removed_bg_url, product_description, target_audience, background_description)
+        async def fetch_product():
+            await manager.broadcast({
+                "type": "processing_status",
+                "status": "fetching_product",
+                "message": "Fetching product details",
+                "product_id": product_id,
+                "timings": timer.summary()
+            })
+            result = await asyncio.to_thread(
+                supabase.table("product_descriptions").select("product_description, target_customers").eq("id", product_id).execute
+            )
+            return result.data[0]
         
-        await manager.broadcast({
-            "type": "processing_status",
-            "status": "prompt_generated",
-            "message": "Prompt generated successfully, generating images...",
-            "product_id": product_id
-        })
+        async def decode():
+            # Keep the upload on the local filesystem
+            original = base64.b64decode(image)
+            with open(image_path, "wb") as f:
+                f.write(original)
+            return original
         
-        generated_paths = await generate_ad_photos(prompt.positive_prompt, 4, img_path_removed_bg_url, "0.5 * width", prompt.negative_prompt, "data/images/generated")
-        generated_images = [item.url for item in generated_paths][1:]
+        async def normalize(original):
+            # The models get an upright, metadata-free copy at their working resolution
+            return await asyncio.to_thread(normalize_image, original)
         
-        # Upload images to S3 and get their URLs
-        s3_urls = []
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        async def remove_background(prepared):
+            await manager.broadcast({
+                "type": "processing_status",
+                "status": "removing_background",
+                "message": "Removing background...",
+                "product_id": product_id,
+                "timings": timer.summary()
+            })
+            return await remove_bg(prepared.data_uri(), is_url=True, deadline=deadline)
+        
+        async def download_cutout(cutout_url):
+            nonlocal preview_task
+            await download_file(cutout_url, removed_bg_path, deadline)
+            # Show the product on stock backdrops right away, unless the real images are already coming
+            if not store_tasks:
+                preview_task = asyncio.create_task(_send_previews(removed_bg_path, product_id, timer))
+        
+        async def make_prompt(product, prepared):
+            await manager.broadcast({
+                "type": "processing_status",
+                "status": "generating_prompt",
+                "message": "Generating AI prompt",
+                "product_id": product_id,
+                "timings": timer.summary()
+            })
+            # Works from the normalised upload, so it runs alongside background removal
+            async with dependency_limits.slot("openai"):
+                prompt = await asyncio.to_thread(
+                    generate_ad_photo_prompt, prepared.data_uri(), product["product_description"],
+                    product["target_customers"], background_description
+                )
+            await manager.broadcast({
+                "type": "processing_status",
+                "status": "prompt_generated",
+                "message": "Prompt generated successfully, generating images...",
+                "product_id": product_id,
+                "timings": timer.summary()
+            })
+            return prompt
         
-        for idx, image_url in enumerate(generated_images):
-            # Download image
-            async with aiohttp.ClientSession() as session:
-                async with session.get(image_url) as response:
-                    content = await response.read()
-                    local_path = f"data/images/generated/{image_url.split('/')[-1]}"
-                    with open(local_path, "wb") as f:
-                        f.write(content)
-                    
-                    # Upload to S3
-                    s3_key = f"products/{product_id}/generated_{timestamp}_{idx}.jpg"
-                    s3_client.upload_file(local_path, BUCKET_NAME, s3_key)
-                    s3_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{s3_key}"
-                    s3_urls.append(s3_url)
-                    
-                    # Store image information in product_photos table
+        async def store_variant(idx: int, image_url: str, prompt) -> str:
+            local_path = f"{IMAGES_DIR}/generated/{image_url.split('/')[-1]}"
+            local_paths.append(local_path)
+            with timer.stage("download", dependency="http"):
+                await download_file(image_url, local_path, deadline)
+            
+            with timer.stage("s3_upload", dependency="s3"):
+                s3_url = await upload_image(local_path, f"products/{product_id}/generated_{timestamp}_{idx}", deadline)
+            
+            # Store image information in product_photos table, once the cut-out's own uploads are done
+            source_s3_url = await graph.result("upload_source")
+            no_bg_s3_url = await graph.result("upload_no_bg")
+            with timer.stage("db_insert", dependency="supabase"):
+                await asyncio.to_thread(
                     supabase.table("product_photos").insert({
                         "product_id": product_id,
                         "image_url": s3_url,
@@ -146,7 +397,59 @@ async def generate_ad_photo(image: str, product_id: str, access_token: str, refr
                         "background_description": background_description,
                         "positive_prompt": prompt.positive_prompt,
                         "negative_prompt": prompt.negative_prompt
-                    }).execute()
+                    }).execute
+                )
+                await asyncio.to_thread(increment_usage, service_supabase, user_id, generated_images=1)
+            
+            await manager.broadcast({
+                "type": "processing_status",
+                "status": "variant_ready",
+                "message": f"Image {idx + 1} of {variant_count} is ready",
+                "image_url": s3_url,
+                "variant_index": idx,
+                "variant_count": variant_count,
+                "product_id": product_id,
+                "timings": timer.summary()
+            })
+            return s3_url
+        
+        async def inpaint(prompt, cutout_url):
+            # Each variant is stored and announced while the others are still being generated or uploaded
+            variants = inpaint_variants(prompt.positive_prompt, prompt.negative_prompt, cutout_url, variant_count, deadline)
+            async with aclosing(variants):
+                async for image_url in variants:
+                    if preview_task is not None:
+                        preview_task.cancel()
+                    store_tasks.append(asyncio.create_task(store_variant(len(store_tasks), image_url, prompt)))
+        
+        async def store_variants(_):
+            return list(await asyncio.gather(*store_tasks))
+        
+        graph.add("fetch_product", fetch_product, dependency="supabase")
+        graph.add("decode", decode)
+        graph.add("normalize", normalize, after=["decode"])
+        graph.add("remove_bg", remove_background, after=["normalize"], dependency=background_remover.dependency)
+        graph.add("download", download_cutout, after=["remove_bg"], dependency="http")
+        graph.add(
+            "upload_source", lambda _: upload_image(removed_bg_path, f"products/{product_id}/source_{timestamp}", deadline),
+            after=["download"], dependency="s3", label="s3_upload"
+        )
+        graph.add(
+            "upload_no_bg", lambda _: upload_image(removed_bg_path, f"products/{product_id}/no_bg_{timestamp}", deadline),
+            after=["download"], dependency="s3", label="s3_upload"
+        )
+        graph.add("prompt", make_prompt, after=["fetch_product", "normalize"], dependency="openai")
+        graph.add("inpaint", inpaint, after=["prompt", "remove_bg"], dependency="replicate")
+        graph.add("store", store_variants, after=["inpaint"], label="store_variants")
+        
+        results = await graph.run()
+        source_s3_url = results["upload_source"]
+        s3_urls = results["store"]
+        
+        with timer.stage("commit_tokens", dependency="supabase"):
+            token_balance = await commit_reservation(reservation, supabase=service_supabase)
+        reservation = None
+        await response_cache.invalidate_user(user_id)
         
         # Store image URLs in response
         response = {
@@ -154,13 +457,15 @@ async def generate_ad_photo(image: str, product_id: str, access_token: str, refr
             "message": "Images generated and uploaded successfully",
             "source_image_url": source_s3_url,
             "image_urls": s3_urls,
-            "product_id": product_id
+            "product_id": product_id,
+            "token_balance": token_balance,
+            "timings": timer.summary()
         }
         
         # Clean up local files if in production
         if os.getenv('ENVIRONMENT') == 'production':
-            for file in os.listdir('data/images/generated'):
-                os.remove(os.path.join('data/images/generated', file))
+            for local_path in local_paths:
+                os.remove(local_path)
             os.remove(image_path)
             os.remove(removed_bg_path)
 
@@ -168,12 +473,36 @@ async def generate_ad_photo(image: str, product_id: str, access_token: str, refr
             "type": "processing_status", 
             "message": "Process completed successfully",
             "data": response,
-            "product_id": product_id
+            "product_id": product_id,
+            "timings": response["timings"]
         })
         
         return response
         
+    except HTTPException as e:
+        # Usually the token reservation or a scheduler slot was refused, before anything was generated
+        if reservation is not None:
+            await _settle_failed_job(reservation, store_tasks)
+        detail = e.detail if isinstance(e.detail, dict) else {"message": str(e.detail)}
+        await manager.broadcast({
+            "type": "processing_status",
+            "status": "error",
+            "message": detail["message"],
+            "code": detail.get("code"),
+            "product_id": product_id,
+            "timings": timer.summary()
+        })
+        return {
+            "status": "error",
+            "message": detail["message"],
+            "code": detail.get("code"),
+            "product_id": product_id
+        }
+        
     except Exception as e:
+        if reservation is not None:
+            await _settle_failed_job(reservation, store_tasks)
+            
         error_response = {
             "status": "error",
             "message": str(e),
@@ -184,11 +513,55 @@ async def generate_ad_photo(image: str, product_id: str, access_token: str, refr
             "type": "processing_status",
             "status": "error",
             "message": f"Error processing image: {str(e)}",
-            "product_id": product_id
+            "product_id": product_id,
+            "timings": timer.summary()
         })
         
         logger.error(f"General error in generate_ad_photo: {str(e)}")
         return error_response
+    
+    finally:
+        if preview_task is not None:
+            preview_task.cancel()
+        for task in store_tasks:
+            task.cancel()
+        if ticket is not None:
+            generation_scheduler.release(ticket)
+
+async def _settle_failed_job(reservation: TokenReservation, store_tasks: List[asyncio.Task]) -> None:
+    """Settle a failed generation's reservation once the variants already being stored are done
+    
+    Storing continues after the graph fails, so waiting for it keeps rows from being
+    inserted and counted after the tokens are refunded. Stored variants are paid for.
+    """
+    results = await asyncio.gather(*store_tasks, return_exceptions=True)
+    stored = sum(1 for result in results if isinstance(result, str))
+    if stored:
+        await commit_reservation(reservation, amount=variant_tokens(stored))
+    else:
+        await release_reservation(reservation)
+    await response_cache.invalidate_user(reservation.user_id)
+
+async def _send_previews(cutout_path: str, product_id: str, timer: StageTimer) -> None:
+    """Composite the cut-out onto preview plates and push them to the client as data: URIs"""
+    try:
+        with open(cutout_path, "rb") as f:
+            cutout = f.read()
+        with timer.stage("preview"):
+            previews = await asyncio.to_thread(render_previews, cutout, PRODUCT_SIZE, offset=random.randrange(1000))
+        if not previews:
+            return
+        await manager.broadcast({
+            "type": "processing_status",
+            "status": "preview_ready",
+            "message": "Here's a quick preview while your images are generated...",
+            "previews": [f"data:image/jpeg;base64,{base64.b64encode(preview).decode('utf-8')}" for preview in previews],
+            "product_id": product_id,
+            "timings": timer.summary()
+        })
+    except Exception as e:
+        # Previews are a courtesy; the generation carries on without them
+        logger.warning(f"Could not render previews for product {product_id}: {str(e)}")
 
 async def generate_ad_photos(
     prompt: str,
@@ -196,7 +569,8 @@ async def generate_ad_photos(
     image_path: str,
     product_size: str,
     negative_prompt: str,
-    output_dir: str = "data/images/generated"
+    output_dir: str = f"{IMAGES_DIR}/generated",
+    deadline: Optional[Deadline] = None
 ) -> List[str]:
     """
     Generate ad photos using Replicate's ad-inpaint model.
@@ -208,9 +582,10 @@ async def generate_ad_photos(
         product_size: Size specification for the product
         negative_prompt: Prompt specifying what to avoid in generation
         output_dir: Directory to save generated images
+        deadline: The job's deadline; failed or timed out predictions are retried within it
     
     Returns:
-        List of paths to the generated images
+        List of generated image URLs; the first is the product mask
     """
     input_params = {
         "prompt": prompt,
@@ -221,50 +596,58 @@ async def generate_ad_photos(
     }
     
     # Run the model
-    output = replicate.run(
-        "logerzhu/ad-inpaint:b1c17d148455c1fda435ababe9ab1e03bc0d917cc3cf4251916f22c45c83c7df",
-        input=input_params
+    output = await call_with_retries(
+        lambda timeout: prediction_manager.run(
+            "logerzhu/ad-inpaint:b1c17d148455c1fda435ababe9ab1e03bc0d917cc3cf4251916f22c45c83c7df",
+            input=input_params,
+            timeout=timeout
+        ),
+        dependency="replicate",
+        operation="inpaint",
+        deadline=deadline or Deadline(JOB_DEADLINE),
+        attempt_timeout=INPAINT_TIMEOUT,
+        trips_breaker=is_replicate_outage
     )
     
     return output
 
 async def remove_bg(
     image_input: str,
-    is_url: bool = True
+    is_url: bool = True,
+    deadline: Optional[Deadline] = None
 ) -> str:
     """
-    Remove background from an image using Replicate's remove-bg model.
+    Remove background from an image with the backend selected by BG_REMOVAL_BACKEND.
     
     Args:
-        image_input: URL or local path to the input image
-        output_path: Path where the output image will be saved
+        image_input: URL (a data: URI from normalize_image in the pipeline) or local path to the input image
         is_url: Boolean indicating if the image_input is a URL (True) or local path (False)
+        deadline: The job's deadline; failed or timed out attempts are retried within it
     
     Returns:
-        Path to the processed image with background removed
+        URL or data: URI of the image with background removed
     """
         
     if is_url:
-        input_params = {"image": image_input}
+        image = image_input
     else:
         # Read local file and encode to base64
         with open(image_input, "rb") as f:
             image_data = f.read()
             base64_image = base64.b64encode(image_data).decode('utf-8')
-            input_params = {"image": f"data:image/jpeg;base64,{base64_image}"}
+            image = f"data:image/jpeg;base64,{base64_image}"
     
-    
-    # Run the model
-    output = replicate.run(
-        "lucataco/remove-bg:95fcc2a26d3899cd6c2691c900465aaeff466285a65c14638cc5f36f34befaf1",
-        input=input_params
+    # The output only depends on the image, so concurrent calls for the same image share one removal
+    return await pipeline_flights.do(
+        flight_key("remove_bg", background_remover.name, image),
+        lambda: background_remover.remove(image, deadline or Deadline(JOB_DEADLINE))
     )
-    
-    return output.url
 
 async def add_source_photo(image: str, access_token: str, refresh_token: str, product_id: str) -> dict:
     """Add a source photo with background removed version to S3 and database.
     
+    An identical upload that is still being processed is joined rather than repeated.
+    
     Args:
         image: Base64 encoded image
         access_token: Bearer access token for authentication
@@ -274,49 +657,66 @@ async def add_source_photo(image: str, access_token: str, refresh_token: str, pr
     Returns:
         dict: Response containing the original and edited photo URLs
     """
+    key = flight_key("add_source_photo", access_token, product_id, image)
+    return await pipeline_flights.do(
+        key, lambda: _add_source_photo(image, access_token, refresh_token, product_id)
+    )
+
+async def _add_source_photo(image: str, access_token: str, refresh_token: str, product_id: str) -> dict:
+    timer = StageTimer()
+    deadline = Deadline(JOB_DEADLINE)
     try:
+        # Get authenticated user from token, and refuse someone else's product before uploading anything
+        supabase = get_user_supabase_client(access_token, refresh_token)
+        user = supabase.auth.get_user()
+        user_id = user.user.id
+        with timer.stage("authorize", dependency="supabase"):
+            await asyncio.to_thread(require_product_owner, supabase, user_id, product_id)
+        
         # Generate unique filename
         filename = f"{uuid.uuid4()}.jpg"
-        image_path = f"data/images/source/{filename}"
+        image_path = f"{IMAGES_DIR}/source/{filename}"
         
         # Save original image locally
-        with open(image_path, "wb") as f:
-            f.write(base64.b64decode(image))
+        with timer.stage("decode"):
+            original = base64.b64decode(image)
+            with open(image_path, "wb") as f:
+                f.write(original)
+        
+        with timer.stage("normalize"):
+            prepared = await asyncio.to_thread(normalize_image, original)
             
-        # Upload original image to S3
+        # Upload the untouched original to S3 for archival
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        original_s3_key = f"products/{product_id}/original_{timestamp}.jpg"
-        s3_client.upload_file(image_path, BUCKET_NAME, original_s3_key)
-        original_s3_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{original_s3_key}"
+        with timer.stage("s3_upload", dependency="s3"):
+            original_s3_url = await upload_image(
+                image_path, f"products/{product_id}/original_{timestamp}", deadline, variants=False
+            )
         
         # Remove background
-        img_path_removed_bg_url = await remove_bg(image_path, is_url=False)
+        with timer.stage("remove_bg", dependency=background_remover.dependency):
+            img_path_removed_bg_url = await remove_bg(prepared.data_uri(), is_url=True, deadline=deadline)
         
         # Save removed background image locally
-        removed_bg_path = f"data/images/removed_bg/{filename}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(img_path_removed_bg_url) as response:
-                content = await response.read()
-                with open(removed_bg_path, "wb") as f:
-                    f.write(content)
+        removed_bg_path = f"{IMAGES_DIR}/removed_bg/{filename}"
+        with timer.stage("download", dependency="http"):
+            await download_file(img_path_removed_bg_url, removed_bg_path, deadline)
         
         # Upload removed background image to S3
-        edited_s3_key = f"products/{product_id}/edited_{timestamp}.jpg"
-        s3_client.upload_file(removed_bg_path, BUCKET_NAME, edited_s3_key)
-        edited_s3_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{edited_s3_key}"
-        
-        # Get authenticated user from token
-        supabase = get_supabase_client()
-        supabase.auth.set_session(access_token, refresh_token)
-        user = supabase.auth.get_user()
-        user_id = user.user.id
+        with timer.stage("s3_upload", dependency="s3"):
+            edited_s3_url = await upload_image(removed_bg_path, f"products/{product_id}/edited_{timestamp}", deadline)
         
         # Then insert the source photo
-        result = supabase.table("source_photos").insert({
-            "product_id": product_id,
-            "original_photo_url": original_s3_url,
-            "edited_photo_url": edited_s3_url
-        }).execute()
+        with timer.stage("db_insert", dependency="supabase"):
+            result = await asyncio.to_thread(
+                supabase.table("source_photos").insert({
+                    "product_id": product_id,
+                    "original_photo_url": original_s3_url,
+                    "edited_photo_url": edited_s3_url
+                }).execute
+            )
+        await asyncio.to_thread(increment_usage, get_supabase_client(), user_id, source_photos=1)
+        await response_cache.invalidate_user(user_id)
         
         # Clean up local files if in production
         if os.getenv('ENVIRONMENT') == 'production':
@@ -327,14 +727,16 @@ async def add_source_photo(image: str, access_token: str, refresh_token: str, pr
             "status": "success",
             "original_photo_url": original_s3_url,
             "edited_photo_url": edited_s3_url,
-            "photo_id": result.data[0]['id'] if result.data else None
+            "photo_id": result.data[0]['id'] if result.data else None,
+            "timings": timer.summary()
         }
         
     except Exception as e:
-        logger.error(f"Error in add_source_photo: {str(e)}")
+        message = str(e.detail) if isinstance(e, HTTPException) else str(e)
+        logger.error(f"Error in add_source_photo: {message}")
         return {
             "status": "error",
-            "message": str(e)
+            "message": message
         }
         
 # TODO: remove metadata that might indicated that the image was generated by AI
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, HTTPException, Request
+import json
+import logging
+
+from app.image_processing.predictions import prediction_manager
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/webhooks", tags=["webhooks"])
+
+# Replicate retries webhooks, but one older than this is not worth trusting
+WEBHOOK_TOLERANCE_SECONDS = 300
+
+
+@router.post("/replicate")
+async def replicate_webhook(request: Request):
+    """
+    Completion callback for predictions created by the prediction manager.
+
+    Payloads are only trusted with a valid signature. With several workers
+    the callback may reach one that isn't waiting on the prediction; it is
+    acknowledged anyway and the owning worker picks the result up by polling.
+    """
+    if not prediction_manager.webhooks_enabled:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    # Imported here so the SDK isn't loaded at startup, see app.core.clients
+    from replicate.webhook import Webhooks, WebhookSigningSecret
+
+    body = (await request.body()).decode("utf-8")
+    try:
+        Webhooks.validate(
+            headers=dict(request.headers),
+            body=body,
+            secret=WebhookSigningSecret(key=prediction_manager.webhook_secret),
+            tolerance=WEBHOOK_TOLERANCE_SECONDS
+        )
+    except ValueError as e:
+        # WebhookValidationError, or malformed base64 in the signature header
+        logger.warning(f"Rejected Replicate webhook: {str(e)}")
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid webhook body")
+
+    return {"resolved": prediction_manager.resolve(payload)}
@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 import base64
 from pydantic import BaseModel
-from openai import OpenAI
+from app.core.clients import get_openai_client
 from ..prompt_utils import generate_inpaint_prompt
 
 
@@ -18,7 +18,7 @@ def encode_image(image_path):
 
 def generate_ad_photo_prompt(product_image: str, product_description: str, target_audience: str, target_photo_description: str | None = None):
     ad_photo_generation_prompt = generate_inpaint_prompt(product_description, target_audience, target_photo_description)
-    client = OpenAI()
+    client = get_openai_client()
     
     # First, get the vision model to analyze the image and context
     vision_response = client.chat.completions.create(
@@ -34,7 +34,7 @@ def generate_ad_photo_prompt(product_image: str, product_description: str, targe
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": product_image if product_image.startswith('http') else f"data:image/jpeg;base64,{product_image}"
+                            "url": product_image if product_image.startswith(('http', 'data:')) else f"data:image/jpeg;base64,{product_image}"
                         }
                     }
                 ]
@@ -0,0 +1,26 @@
+"""
+Periodic repair jobs, meant to be run from cron:
+
+    python -m app.maintenance
+"""
+import asyncio
+import logging
+import config  # noqa: F401  loads the environment
+from app.core.auth import release_stale_reservations
+from app.db import get_supabase_client
+from app.stats.counters import reconcile_usage
+
+logger = logging.getLogger(__name__)
+
+
+async def run_maintenance() -> None:
+    released = await release_stale_reservations()
+    logger.info(f"Released {released} stale token reservations")
+
+    repaired = reconcile_usage(get_supabase_client())
+    logger.info(f"Reconciled usage counters for {repaired} users")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_maintenance())
@@ -0,0 +1,53 @@
+from fastapi import APIRouter, Header, HTTPException, Response
+from fastapi.responses import FileResponse
+from typing import Optional
+from app.core.diagnostics import request_profiler
+from app.core.metrics import CONTENT_TYPE_LATEST, render_metrics
+import hmac
+import os
+
+router = APIRouter(tags=["monitoring"])
+
+# When set, scrapers must send "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus metrics for every worker of this instance"""
+    if METRICS_TOKEN and not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=render_metrics(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+def _require_profile_token(token: Optional[str]) -> None:
+    # Without PROFILE_TOKEN the profile endpoints don't exist
+    if not request_profiler.token:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not request_profiler.authorized(token):
+        raise HTTPException(status_code=401, detail="Invalid profile token")
+
+@router.get("/debug/profiles", include_in_schema=False)
+async def list_profiles(x_profile_token: Optional[str] = Header(None)):
+    """Profiles captured by every worker on this instance, newest first"""
+    _require_profile_token(x_profile_token)
+    return {"profiles": request_profiler.list_profiles()}
+
+@router.get("/debug/profiles/{profile_id}", include_in_schema=False)
+async def get_profile(profile_id: str, x_profile_token: Optional[str] = Header(None)):
+    """
+    A captured profile in folded-stack format, for flamegraph.pl or speedscope.
+
+    Args:
+        profile_id: Value of the X-Profile-Id header on the profiled response
+        x_profile_token: Must match PROFILE_TOKEN
+
+    Returns:
+        The profile as plain text, one "frame;frame;frame samples" line per stack
+    """
+    _require_profile_token(x_profile_token)
+    try:
+        path = request_profiler.path(profile_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded")
@@ -0,0 +1,155 @@
+from datetime import datetime
+from typing import AsyncIterator, Callable, Iterable, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import zipfile
+
+from app.core.metrics import track_external
+from app.image_processing.variants import variant_key
+
+logger = logging.getLogger(__name__)
+
+# Number of S3 objects downloaded ahead of the one being written to the archive
+EXPORT_PREFETCH = int(os.getenv("EXPORT_PREFETCH", "8"))
+
+
+class _ZipStream:
+    """Write-only, unseekable file object that hands written bytes back to the caller"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _entry_name(index: int, photo: dict, key: str) -> str:
+    extension = os.path.splitext(key)[1] or ".jpg"
+    return f"images/{index:04d}_{photo['id']}{extension}"
+
+
+def _zip_info(name: str, created_at: Optional[str]) -> zipfile.ZipInfo:
+    try:
+        timestamp = datetime.fromisoformat(created_at).timetuple()[:6] if created_at else None
+    except ValueError:
+        timestamp = None
+    info = zipfile.ZipInfo(name, date_time=timestamp or datetime.now().timetuple()[:6])
+    # Photos are already compressed; storing them keeps the export I/O bound
+    info.compress_type = zipfile.ZIP_STORED
+    return info
+
+
+async def stream_product_zip(
+    s3_client,
+    bucket_name: str,
+    photos: Iterable[dict],
+    key_for: Callable[[dict], str],
+    include_manifest: bool = True,
+    variant: Optional[str] = None,
+    prefetch: int = EXPORT_PREFETCH
+) -> AsyncIterator[bytes]:
+    """
+    Build a ZIP of a product's photos on the fly, yielding it as it is written.
+
+    S3 objects are downloaded `prefetch` at a time in worker threads, so
+    memory use is bounded by the prefetch window rather than the number
+    of photos, and nothing touches the disk.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket_name: Bucket holding the photos
+        photos: product_photos rows, in archive order
+        key_for: Returns the S3 key to export for a photo row
+        include_manifest: Whether to append manifest.json with prompts and captions
+        variant: Content type of the stored variant to export instead of each master,
+            falling back to the master for photos without that variant
+        prefetch: Number of downloads kept in flight
+
+    Yields:
+        Consecutive chunks of the ZIP archive
+    """
+    photos = list(photos)
+    keys = [key_for(photo) for photo in photos]
+
+    def get(key: str) -> bytes:
+        with track_external("s3", "get_object"):
+            return s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+
+    def download(key: str) -> Tuple[str, bytes]:
+        candidate = variant_key(key, variant) if variant else key
+        if candidate != key:
+            try:
+                return candidate, get(candidate)
+            except s3_client.exceptions.NoSuchKey:
+                pass
+        return key, get(key)
+
+    stream = _ZipStream()
+    archive = zipfile.ZipFile(stream, mode="w", allowZip64=True)
+    manifest = []
+    pending: List[asyncio.Task] = []
+    next_index = 0
+
+    def schedule() -> None:
+        nonlocal next_index
+        while next_index < len(photos) and len(pending) < prefetch:
+            pending.append(asyncio.create_task(asyncio.to_thread(download, keys[next_index])))
+            next_index += 1
+
+    try:
+        schedule()
+        for index, (photo, key) in enumerate(zip(photos, keys)):
+            task = pending.pop(0)
+            entry = {
+                "id": photo["id"],
+                "created_at": photo.get("created_at"),
+                "background_description": photo.get("background_description"),
+                "positive_prompt": photo.get("positive_prompt"),
+                "negative_prompt": photo.get("negative_prompt"),
+                "caption": photo.get("caption"),
+                "user_rating": photo.get("user_rating")
+            }
+            try:
+                key, data = await task
+            except Exception as e:
+                # The response has already started, so a missing object is recorded rather than raised
+                logger.error(f"Export could not fetch {key}: {str(e)}")
+                data = None
+            finally:
+                schedule()
+
+            if data is None:
+                entry["file"] = None
+                entry["error"] = "Image could not be fetched"
+                manifest.append(entry)
+                continue
+
+            name = _entry_name(index, photo, key)
+            archive.writestr(_zip_info(name, photo.get("created_at")), data)
+            entry["file"] = name
+            manifest.append(entry)
+            yield stream.drain()
+
+        if include_manifest:
+            archive.writestr(_zip_info("manifest.json", None), json.dumps({"photos": manifest}, indent=2))
+        archive.close()
+        yield stream.drain()
+    finally:
+        for task in pending:
+            task.cancel()
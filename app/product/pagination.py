@@ -0,0 +1,150 @@
+from fastapi import HTTPException
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import base64
+import json
+import re
+import uuid
+
+# Page size when a cursor is given without a limit; without either, list endpoints return every row
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Page size used internally when streaming a whole listing
+STREAM_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Timestamps as PostgREST returns them, e.g. 2026-01-05T10:20:30.12345+00:00
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d{1,6})?(Z|[+-]\d{2}(:?\d{2})?)?")
+
+
+def encode_cursor(created_at: str, row_id: str) -> str:
+    """Encode the (created_at, id) key of the last row of a page as an opaque cursor"""
+    raw = json.dumps([created_at, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    The values end up in a PostgREST filter, so anything but a timestamp and
+    a UUID is refused rather than passed on.
+    """
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(created_at, str) or not _TIMESTAMP.fullmatch(created_at):
+            raise ValueError("created_at is not a timestamp")
+        return created_at, str(uuid.UUID(str(row_id)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def check_limit(limit: Optional[int]) -> None:
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_PAGE_SIZE}")
+
+
+def parse_fields(fields: Optional[str], field_columns: Dict[str, str]) -> Dict[str, str]:
+    """
+    Resolve a `fields=` projection into the API field -> DB column mapping to fetch.
+
+    Args:
+        fields: Comma separated API field names, or None for every field
+        field_columns: Mapping of every API field the endpoint exposes to its DB column
+
+    Returns:
+        The subset of field_columns that was requested, in request order
+    """
+    if not fields:
+        return dict(field_columns)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in field_columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return {field: field_columns[field] for field in requested}
+
+
+def select_columns(projection: Dict[str, str], *key_columns: str) -> str:
+    """Build a select list with the projected columns plus the keyset columns"""
+    columns = list(key_columns)
+    for column in projection.values():
+        if column and column not in columns:
+            columns.append(column)
+    return ", ".join(columns)
+
+
+def paginate(query, cursor: Optional[str], limit: int, created_column: str = "created_at", id_column: str = "id"):
+    """
+    Apply newest-first keyset ordering on (created_at, id) to a PostgREST query.
+
+    One extra row is requested so split_page can tell whether another page exists.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.or_(
+            f'{created_column}.lt."{created_at}",'
+            f'and({created_column}.eq."{created_at}",{id_column}.lt."{row_id}")'
+        )
+    return query\
+        .order(created_column, desc=True)\
+        .order(id_column, desc=True)\
+        .limit(limit + 1)
+
+
+def split_page(rows: List[dict], limit: int, created_column: str = "created_at", id_column: str = "id") -> Tuple[List[dict], Optional[str]]:
+    """Trim the look-ahead row and return the page with the cursor of the next one"""
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(page[-1][created_column], page[-1][id_column])
+    return page, next_cursor
+
+
+def iter_pages(
+    build_query: Callable,
+    cursor: Optional[str] = None,
+    page_size: int = STREAM_PAGE_SIZE,
+    created_column: str = "created_at",
+    id_column: str = "id"
+) -> Iterator[dict]:
+    """
+    Lazily yield every row after `cursor`, fetching one keyset page at a time.
+
+    Args:
+        build_query: Returns a fresh filtered query; called once per page
+        cursor: Cursor to start after, or None to start from the newest row
+        page_size: Rows fetched per round trip
+    """
+    while True:
+        result = paginate(build_query(), cursor, page_size, created_column, id_column).execute()
+        rows, cursor = split_page(result.data, page_size, created_column, id_column)
+        yield from rows
+        if not cursor:
+            return
+
+
+def fetch_page(
+    build_query: Callable,
+    cursor: Optional[str],
+    limit: Optional[int],
+    created_column: str = "created_at",
+    id_column: str = "id"
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Fetch one page of a listing, or all of it when neither a limit nor a cursor is given.
+
+    Clients written before pagination send neither and expect every row, so
+    they get the whole listing, fetched in keyset pages, and no next cursor.
+
+    Returns:
+        The rows and the cursor of the next page, if there is one
+    """
+    if limit is None and cursor is None:
+        return list(iter_pages(build_query, None, STREAM_PAGE_SIZE, created_column, id_column)), None
+    limit = limit or DEFAULT_PAGE_SIZE
+    result = paginate(build_query(), cursor, limit, created_column, id_column).execute()
+    return split_page(result.data, limit, created_column, id_column)
+
+
+def project(row: dict, projection: Dict[str, str]) -> dict:
+    """Rename DB columns to API fields, keeping only the projected ones"""
+    return {field: row.get(column) for field, column in projection.items()}
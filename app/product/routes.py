@@ -2,25 +2,51 @@ from fastapi import APIRouter, HTTPException, Depends, Request
 from pydantic import BaseModel
 from typing import Optional, List
 from app.core.auth import get_current_user, User
+from app.core.cache import TTLCache, response_cache
+from app.core.clients import get_s3_client
+from app.core.metrics import track_external
+from app.core.responses import FastJSONResponse, ndjson_response, wants_ndjson
+from app.core.ownership import product_ownership, require_product_owner
+from app.core.resilience import JOB_DEADLINE
 from app.db import get_supabase_client
-import boto3
+from app.image_processing.variants import VARIANT_FORMATS, negotiate_formats, variant_key
+from app.product.export import stream_product_zip
+from app.product.pagination import (
+    NEXT_CURSOR_HEADER, check_limit, fetch_page, iter_pages, parse_fields, project, select_columns
+)
+from app.stats.counters import increment_usage
+from datetime import datetime, timezone
+import asyncio
+import logging
 import os
-from fastapi.responses import StreamingResponse
-import requests
+from fastapi.responses import JSONResponse, StreamingResponse
 
 router = APIRouter(
     prefix="/products",
     tags=["products"]
 )
 
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('aws_access_key_id'),
-    aws_secret_access_key=os.getenv('aws_secret_access_key')
-)
+logger = logging.getLogger(__name__)
+
 BUCKET_NAME = os.getenv('bucket_name')
 
+# Variant keys S3 reported missing: False for a minute while the variant may still be uploading,
+# True for a day once its master is too old for the variant ever to appear
+_missing_variants: TTLCache[bool] = TTLCache(ttl_seconds=60, max_entries=50000)
+MISSING_VARIANT_TTL = 86400
+# Variants are uploaded within a job deadline of their master; older masters have all they'll get
+VARIANT_PENDING_WINDOW = 2 * JOB_DEADLINE
+# Browser cache lifetime of a master served in place of a variant that may not have been uploaded yet
+VARIANT_FALLBACK_MAX_AGE = int(os.getenv("VARIANT_FALLBACK_MAX_AGE", "300"))
+
+
+def _variants_pending(s3_response: dict) -> bool:
+    """Whether a master's variants may still be uploading, judged by the master's age"""
+    last_modified = s3_response.get("LastModified")
+    if last_modified is None:
+        return False
+    return (datetime.now(timezone.utc) - last_modified).total_seconds() < VARIANT_PENDING_WINDOW
+
 class ProductCreate(BaseModel):
     name: str
     target_audience: str
@@ -61,37 +87,68 @@ class PhotoRatingUpdate(BaseModel):
 class PhotoCaptionUpdate(BaseModel):
     caption: str
 
+class ProductBatchCreate(BaseModel):
+    products: List[ProductCreate]
+
+class PhotoBatchUpdateItem(BaseModel):
+    photo_id: str
+    rating: Optional[int] = None
+    caption: Optional[str] = None
+
+class PhotoBatchUpdate(BaseModel):
+    updates: List[PhotoBatchUpdateItem]
+
+# Largest number of items a batch endpoint accepts in one request
+MAX_BATCH_SIZE = 100
+
+# API field -> DB column for the list endpoints' `fields=` projection
+PRODUCT_FIELDS = {
+    "id": "id",
+    "name": "name",
+    "target_audience": "target_customers",
+    "description": "product_description",
+    "user_id": None
+}
+SOURCE_PHOTO_FIELDS = {
+    "id": "id",
+    "url": "edited_photo_url",
+    "created_at": "created_at"
+}
+GENERATED_IMAGE_FIELDS = {
+    "id": "id",
+    "url": "image_url",
+    "created_at": "created_at"
+}
+
+def _check_batch_size(size: int) -> None:
+    if not 1 <= size <= MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch must contain between 1 and {MAX_BATCH_SIZE} items")
+
+def _page_response(items: List[dict], next_cursor: Optional[str]) -> FastJSONResponse:
+    """Return a page of list items with the next-page cursor in a header"""
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return FastJSONResponse(content=items, headers=headers)
+
 @router.post("/", response_model=ProductResponse)
 async def create_product(product_data: ProductCreate, request: Request):
     try:
         user = get_current_user(request)
         supabase = get_supabase_client()
         
-        # Create product in the product_descriptions table
-        product_data_dict = {
-            "name": product_data.name,
-            "product_description": product_data.description,
-            "target_customers": product_data.target_audience
-        }
-        
-        result = supabase.table("product_descriptions").insert(product_data_dict).execute()
+        # Create the product, link it to the user and count it in one call
+        result = supabase.rpc("create_user_product", {
+            "p_user_id": user.id,
+            "p_name": product_data.name,
+            "p_product_description": product_data.description,
+            "p_target_customers": product_data.target_audience
+        }).execute()
         
         if not result.data:
             raise HTTPException(status_code=400, detail="Failed to create product")
             
         created_product = result.data[0]
-        
-        # Create entry in user_products table
-        user_product_data = {
-            "user_id": user.id,
-            "product_id": created_product["id"]
-        }
-        user_product_result = supabase.table("user_products").insert(user_product_data).execute()
-        
-        if not user_product_result.data:
-            # Rollback product creation if user_product entry fails
-            supabase.table("product_descriptions").delete().eq("id", created_product["id"]).execute()
-            raise HTTPException(status_code=400, detail="Failed to link product to user")
+        product_ownership.add_product(user.id, created_product["id"])
+        await response_cache.invalidate_user(user.id)
         
         return ProductResponse(
             id=created_product["id"],
@@ -100,44 +157,97 @@ async def create_product(product_data: ProductCreate, request: Request):
             description=created_product["product_description"],
             user_id=user.id
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.get("/", response_model=List[ProductResponse])
-async def get_products(request: Request):
+@router.post("/batch", response_model=List[ProductResponse])
+async def create_products(batch: ProductBatchCreate, request: Request):
+    """Create several products in one request and one database call"""
     try:
         user = get_current_user(request)
+        _check_batch_size(len(batch.products))
         supabase = get_supabase_client()
         
-        # First get the user's product IDs from user_products
-        user_products_result = supabase.table("user_products")\
-            .select("product_id")\
-            .eq("user_id", user.id)\
-            .execute()
-            
-        if not user_products_result.data:
-            return []
-            
-        # Get the product IDs
-        product_ids = [up["product_id"] for up in user_products_result.data]
-        
-        # Then get the product details for those IDs
-        products_result = supabase.table("product_descriptions")\
-            .select("*")\
-            .in_("id", product_ids)\
-            .execute()
-        
-        products = []
-        for product in products_result.data:
-            products.append(ProductResponse(
-                id=product["id"],
-                name=product["name"],
-                target_audience=product["target_customers"],
-                description=product["product_description"],
+        result = supabase.rpc("create_user_products", {
+            "p_user_id": user.id,
+            "p_products": [
+                {
+                    "name": product.name,
+                    "product_description": product.description,
+                    "target_customers": product.target_audience
+                }
+                for product in batch.products
+            ]
+        }).execute()
+        
+        if not result.data:
+            raise HTTPException(status_code=400, detail="Failed to create products")
+        
+        for created_product in result.data:
+            product_ownership.add_product(user.id, created_product["id"])
+        await response_cache.invalidate_user(user.id)
+        
+        return [
+            ProductResponse(
+                id=created_product["id"],
+                name=created_product["name"],
+                target_audience=created_product["target_customers"],
+                description=created_product["product_description"],
                 user_id=user.id
-            ))
+            )
+            for created_product in result.data
+        ]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/", response_model=List[ProductResponse])
+async def get_products(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """List the user's products, newest first, one keyset page at a time.
+    
+    The cursor for the next page is returned in the X-Next-Cursor header.
+    Without `limit` or `cursor` every product is returned, as before paging.
+    With `Accept: application/x-ndjson` every product after the cursor is
+    streamed instead, one JSON object per line.
+    """
+    try:
+        user = get_current_user(request)
+        check_limit(limit)
+        projection = parse_fields(fields, PRODUCT_FIELDS)
+        supabase = get_supabase_client()
+        
+        def user_products_query():
+            # The user's products with their details embedded
+            return supabase.table("user_products")\
+                .select(f"product_id, created_at, product_descriptions({select_columns(projection, 'id')})")\
+                .eq("user_id", user.id)
         
-        return products
+        def to_product(user_product: dict) -> dict:
+            product = project(user_product["product_descriptions"], projection)
+            if "user_id" in projection:
+                product["user_id"] = user.id
+            return product
+        
+        if wants_ndjson(request):
+            user_products = iter_pages(user_products_query, cursor, id_column="product_id")
+            return ndjson_response(to_product(up) for up in user_products if up["product_descriptions"])
+        
+        async def load_products():
+            user_products, next_cursor = fetch_page(user_products_query, cursor, limit, id_column="product_id")
+            products = [to_product(up) for up in user_products if up["product_descriptions"]]
+            return _page_response(products, next_cursor)
+        
+        return await response_cache.respond(request, user.id, load_products)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -147,6 +257,8 @@ async def update_product(product_id: str, product_data: ProductCreate, request:
         user = get_current_user(request)
         supabase = get_supabase_client()
         
+        require_product_owner(supabase, user.id, product_id)
+        
         # Update product in the product_descriptions table
         product_data_dict = {
             "name": product_data.name,
@@ -160,6 +272,8 @@ async def update_product(product_id: str, product_data: ProductCreate, request:
             raise HTTPException(status_code=404, detail="Product not found")
             
         updated_product = result.data[0]
+        increment_usage(supabase, user.id)
+        await response_cache.invalidate_user(user.id)
         return ProductResponse(
             id=updated_product["id"],
             name=updated_product["name"],
@@ -167,6 +281,8 @@ async def update_product(product_id: str, product_data: ProductCreate, request:
             description=updated_product["product_description"],
             user_id=user.id
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -176,83 +292,140 @@ async def delete_product(product_id: str, request: Request):
         user = get_current_user(request)
         supabase = get_supabase_client()
         
-        result = supabase.table("product_descriptions").delete().eq("id", product_id).execute()
+        require_product_owner(supabase, user.id, product_id)
+        
+        # Ownership is re-checked in the same call as the delete and counter update
+        result = supabase.rpc("delete_user_product", {
+            "p_user_id": user.id,
+            "p_product_id": product_id
+        }).execute()
         
         if not result.data:
             raise HTTPException(status_code=404, detail="Product not found")
+        product_ownership.remove_product(user.id, product_id)
+        await response_cache.invalidate_user(user.id)
             
         return {"message": "Product deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/{product_id}/source-images", response_model=List[SourcePhotoResponse])
-async def get_source_images(product_id: str, request: Request):
+async def get_source_images(
+    product_id: str,
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
     try:
         user = get_current_user(request)
         supabase = get_supabase_client()
+        check_limit(limit)
+        projection = parse_fields(fields, SOURCE_PHOTO_FIELDS)
         
         # First verify that the user has access to this product
-        user_product_result = supabase.table("user_products")\
-            .select("*")\
-            .eq("user_id", user.id)\
-            .eq("product_id", product_id)\
-            .execute()
-            
-        if not user_product_result.data:
-            raise HTTPException(status_code=404, detail="Product not found or access denied")
-        
-        # Get source photos for the product
-        photos_result = supabase.table("source_photos")\
-            .select("id, edited_photo_url, created_at")\
-            .eq("product_id", product_id)\
-            .order("created_at", desc=True)\
-            .execute()
-        
-        source_images = []
-        for photo in photos_result.data:
-            if photo["edited_photo_url"]:  # Only include photos that have been processed
-                source_images.append(SourcePhotoResponse(
-                    id=photo["id"],
-                    url=photo["edited_photo_url"],
-                    created_at=photo["created_at"]
-                ))
-        
-        return source_images
+        require_product_owner(supabase, user.id, product_id)
+        
+        def photos_query():
+            # Processed source photos for the product
+            return supabase.table("source_photos")\
+                .select(select_columns(projection, "id", "created_at"))\
+                .eq("product_id", product_id)\
+                .not_.is_("edited_photo_url", "null")
+        
+        if wants_ndjson(request):
+            return ndjson_response(project(photo, projection) for photo in iter_pages(photos_query, cursor))
+        
+        photos, next_cursor = fetch_page(photos_query, cursor, limit)
+        
+        return _page_response([project(photo, projection) for photo in photos], next_cursor)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/{product_id}/images", response_model=List[GeneratedImageResponse])
-async def get_generated_images(product_id: str, request: Request):
+async def get_generated_images(
+    product_id: str,
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
     try:
         user = get_current_user(request)
         supabase = get_supabase_client()
+        check_limit(limit)
+        projection = parse_fields(fields, GENERATED_IMAGE_FIELDS)
         
         # First verify that the user has access to this product
-        user_product_result = supabase.table("user_products")\
-            .select("*")\
-            .eq("user_id", user.id)\
-            .eq("product_id", product_id)\
-            .execute()
-            
-        if not user_product_result.data:
-            raise HTTPException(status_code=404, detail="Product not found or access denied")
-        
-        # Get generated images for the product
-        images_result = supabase.table("product_photos")\
-            .select("id, image_url, created_at")\
-            .eq("product_id", product_id)\
-            .order("created_at", desc=True)\
-            .execute()
-        
-        generated_images = []
-        for image in images_result.data:
-            generated_images.append(GeneratedImageResponse(
-                id=image["id"],
-                url=image["image_url"],
-                created_at=image["created_at"]
-            ))
-        
-        return generated_images
+        require_product_owner(supabase, user.id, product_id)
+        
+        def images_query():
+            # Generated images for the product
+            return supabase.table("product_photos")\
+                .select(select_columns(projection, "id", "created_at"))\
+                .eq("product_id", product_id)
+        
+        if wants_ndjson(request):
+            return ndjson_response(project(image, projection) for image in iter_pages(images_query, cursor))
+        
+        images, next_cursor = fetch_page(images_query, cursor, limit)
+        
+        return _page_response([project(image, projection) for image in images], next_cursor)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/{product_id}/export.zip")
+async def export_product_images(product_id: str, request: Request, include_manifest: bool = True,
+                                format: Optional[str] = None):
+    """Download all of a product's generated images as a ZIP streamed straight from S3.
+    
+    With include_manifest the archive also contains manifest.json listing
+    each image's prompts, background description, caption and rating.
+    With format (e.g. webp or avif) each image is exported as that stored
+    variant where one exists.
+    """
+    try:
+        user = get_current_user(request)
+        supabase = get_supabase_client()
+        
+        variant = None
+        if format:
+            variant = format if "/" in format else f"image/{format}"
+            if variant not in VARIANT_FORMATS:
+                raise HTTPException(status_code=400, detail=f"Unsupported export format: {format}")
+        
+        require_product_owner(supabase, user.id, product_id)
+        
+        def photos_query():
+            return supabase.table("product_photos")\
+                .select("id, image_url, created_at, background_description, positive_prompt, negative_prompt, caption, user_rating")\
+                .eq("product_id", product_id)
+        
+        bucket_prefix = f"https://{BUCKET_NAME}.s3.amazonaws.com/"
+        photos = await asyncio.to_thread(
+            lambda: [photo for photo in iter_pages(photos_query) if (photo["image_url"] or "").startswith(bucket_prefix)]
+        )
+        
+        return StreamingResponse(
+            stream_product_zip(
+                get_s3_client(),
+                BUCKET_NAME,
+                photos,
+                key_for=lambda photo: photo["image_url"][len(bucket_prefix):],
+                include_manifest=include_manifest,
+                variant=variant
+            ),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="product_{product_id}.zip"'}
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -269,9 +442,43 @@ async def proxy_s3_image(url: str, request: Request):
         # Extract the key from the URL
         key = url.replace(f"https://{BUCKET_NAME}.s3.amazonaws.com/", "")
         
-        # Get the image from S3
+        # Get the image from S3, as the most compact variant the browser accepts when one exists
         try:
-            s3_response = s3_client.get_object(Bucket=BUCKET_NAME, Key=key)
+            s3_response = None
+            missing = []
+            unavailable = False
+            for content_type in negotiate_formats(request.headers.get("accept")):
+                candidate = variant_key(key, content_type)
+                known_missing = _missing_variants.get(candidate)
+                if candidate == key or known_missing:
+                    continue
+                if known_missing is not None:
+                    # Missing a moment ago; the master's age decides whether it may still appear
+                    missing.append(candidate)
+                    continue
+                try:
+                    with track_external("s3", "get_object"):
+                        s3_response = await asyncio.to_thread(
+                            get_s3_client().get_object, Bucket=BUCKET_NAME, Key=candidate
+                        )
+                    break
+                except get_s3_client().exceptions.NoSuchKey:
+                    missing.append(candidate)
+                    _missing_variants.set(candidate, False)
+                except Exception as e:
+                    # Not known to be missing, so try it again next time but serve the master now
+                    logger.warning(f"Could not fetch variant {candidate}: {str(e)}")
+                    unavailable = True
+            max_age = 31536000
+            if s3_response is None:
+                with track_external("s3", "get_object"):
+                    s3_response = await asyncio.to_thread(get_s3_client().get_object, Bucket=BUCKET_NAME, Key=key)
+                if unavailable or (missing and _variants_pending(s3_response)):
+                    # A better variant may exist soon (or already), so don't pin the master for a year
+                    max_age = VARIANT_FALLBACK_MAX_AGE
+                else:
+                    for candidate in missing:
+                        _missing_variants.set(candidate, True, ttl_seconds=MISSING_VARIANT_TTL)
             content_type = s3_response['ContentType']
             
             def iterfile():
@@ -282,95 +489,143 @@ async def proxy_s3_image(url: str, request: Request):
                 media_type=content_type,
                 headers={
                     "Access-Control-Allow-Origin": "*",
-                    "Cache-Control": "public, max-age=31536000"
+                    "Cache-Control": f"public, max-age={max_age}",
+                    "Vary": "Accept"
                 }
             )
         except Exception as e:
             raise HTTPException(status_code=404, detail="Image not found")
             
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.get("/photos/{photo_id}", response_model=GeneratedPhotoDetail)
-async def get_generated_photo(photo_id: str, request: Request):
+@router.get("/photos", response_model=List[GeneratedPhotoDetail])
+async def get_generated_photos(ids: str, request: Request):
+    """Get the details of several photos by comma separated ID.
+    
+    Photos that don't exist or belong to another user are left out.
+    """
     try:
         user = get_current_user(request)
-        supabase = get_supabase_client()
+        photo_ids = list(dict.fromkeys(photo_id.strip() for photo_id in ids.split(",") if photo_id.strip()))
+        _check_batch_size(len(photo_ids))
         
-        # Get the photo details
-        photo_result = supabase.table("product_photos")\
-            .select("*")\
-            .eq("id", photo_id)\
-            .single()\
-            .execute()
-            
-        if not photo_result.data:
-            raise HTTPException(status_code=404, detail="Photo not found")
+        async def load_photos():
+            supabase = get_supabase_client()
             
-        # Verify user has access to the product this photo belongs to
-        user_product_result = supabase.table("user_products")\
-            .select("*")\
-            .eq("user_id", user.id)\
-            .eq("product_id", photo_result.data["product_id"])\
-            .execute()
+            # All requested photos in one query, joined through to user_products for ownership
+            photos_result = supabase.table("product_photos")\
+                .select("*, product_descriptions!inner(user_products!inner(user_id))")\
+                .in_("id", photo_ids)\
+                .eq("product_descriptions.user_products.user_id", user.id)\
+                .execute()
             
-        if not user_product_result.data:
-            raise HTTPException(status_code=403, detail="Access denied")
-        
-        return GeneratedPhotoDetail(
-            id=photo_result.data["id"],
-            image_url=photo_result.data["image_url"],
-            source_image_url=photo_result.data["source_image_url"],
-            background_description=photo_result.data.get("background_description"),
-            positive_prompt=photo_result.data.get("positive_prompt"),
-            negative_prompt=photo_result.data.get("negative_prompt"),
-            user_rating=photo_result.data.get("user_rating"),
-            no_bg_image_url=photo_result.data.get("no_bg_image_url"),
-            created_at=photo_result.data["created_at"],
-            caption=photo_result.data.get("caption")
-        )
+            photos_by_id = {photo["id"]: photo for photo in photos_result.data}
+            return FastJSONResponse(content=[
+                GeneratedPhotoDetail(**photos_by_id[photo_id]).model_dump()
+                for photo_id in photo_ids if photo_id in photos_by_id
+            ])
+        
+        return await response_cache.respond(request, user.id, load_photos)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.put("/photos/{photo_id}/rating", response_model=GeneratedPhotoDetail)
-async def update_photo_rating(photo_id: str, rating_data: PhotoRatingUpdate, request: Request):
+@router.put("/photos/batch", response_model=List[GeneratedPhotoDetail])
+async def update_photos(batch: PhotoBatchUpdate, request: Request):
+    """Update ratings and/or captions of several photos in one database call.
+    
+    Photos that don't exist or belong to another user are left out of the result.
+    """
     try:
         user = get_current_user(request)
+        _check_batch_size(len(batch.updates))
+        
+        photo_ids = [update.photo_id for update in batch.updates]
+        if len(set(photo_ids)) != len(photo_ids):
+            raise HTTPException(status_code=400, detail="Each photo may only appear once per batch")
+        for update in batch.updates:
+            if update.rating is not None and not 1 <= update.rating <= 5:
+                raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
+        
         supabase = get_supabase_client()
+        update_result = supabase.rpc("update_owned_photos", {
+            "p_user_id": user.id,
+            "p_updates": [update.model_dump() for update in batch.updates]
+        }).execute()
+        await response_cache.invalidate_user(user.id)
         
-        # Verify user has access to the photo
-        photo_result = supabase.table("product_photos")\
-            .select("product_id")\
-            .eq("id", photo_id)\
-            .single()\
-            .execute()
-            
-        if not photo_result.data:
-            raise HTTPException(status_code=404, detail="Photo not found")
+        return [GeneratedPhotoDetail(**photo) for photo in update_result.data]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/photos/{photo_id}", response_model=GeneratedPhotoDetail)
+async def get_generated_photo(photo_id: str, request: Request):
+    try:
+        user = get_current_user(request)
+        
+        async def load_photo():
+            supabase = get_supabase_client()
             
-        # Verify user has access to the product
-        user_product_result = supabase.table("user_products")\
-            .select("*")\
-            .eq("user_id", user.id)\
-            .eq("product_id", photo_result.data["product_id"])\
-            .execute()
+            # Get the photo details, joined through to user_products so only the owner gets a row
+            photo_result = supabase.table("product_photos")\
+                .select("*, product_descriptions!inner(user_products!inner(user_id))")\
+                .eq("id", photo_id)\
+                .eq("product_descriptions.user_products.user_id", user.id)\
+                .execute()
+                
+            if not photo_result.data:
+                raise HTTPException(status_code=404, detail="Photo not found or access denied")
             
-        if not user_product_result.data:
-            raise HTTPException(status_code=403, detail="Access denied")
+            photo = photo_result.data[0]
+            return JSONResponse(content=GeneratedPhotoDetail(
+                id=photo["id"],
+                image_url=photo["image_url"],
+                source_image_url=photo["source_image_url"],
+                background_description=photo.get("background_description"),
+                positive_prompt=photo.get("positive_prompt"),
+                negative_prompt=photo.get("negative_prompt"),
+                user_rating=photo.get("user_rating"),
+                no_bg_image_url=photo.get("no_bg_image_url"),
+                created_at=photo["created_at"],
+                caption=photo.get("caption")
+            ).model_dump())
+        
+        return await response_cache.respond(request, user.id, load_photo)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.put("/photos/{photo_id}/rating", response_model=GeneratedPhotoDetail)
+async def update_photo_rating(photo_id: str, rating_data: PhotoRatingUpdate, request: Request):
+    try:
+        user = get_current_user(request)
         
-        # Update the rating
         if not 1 <= rating_data.rating <= 5:
             raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
-            
-        update_result = supabase.table("product_photos")\
-            .update({"user_rating": rating_data.rating})\
-            .eq("id", photo_id)\
-            .execute()
+        
+        supabase = get_supabase_client()
+        
+        # Update the rating if the user owns the photo
+        update_result = supabase.rpc("update_owned_photo", {
+            "p_user_id": user.id,
+            "p_photo_id": photo_id,
+            "p_user_rating": rating_data.rating
+        }).execute()
             
         if not update_result.data:
-            raise HTTPException(status_code=400, detail="Failed to update rating")
+            raise HTTPException(status_code=404, detail="Photo not found or access denied")
+        await response_cache.invalidate_user(user.id)
             
         return GeneratedPhotoDetail(**update_result.data[0])
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -380,35 +635,19 @@ async def update_photo_caption(photo_id: str, caption_data: PhotoCaptionUpdate,
         user = get_current_user(request)
         supabase = get_supabase_client()
         
-        # Verify user has access to the photo
-        photo_result = supabase.table("product_photos")\
-            .select("product_id")\
-            .eq("id", photo_id)\
-            .single()\
-            .execute()
-            
-        if not photo_result.data:
-            raise HTTPException(status_code=404, detail="Photo not found")
-            
-        # Verify user has access to the product
-        user_product_result = supabase.table("user_products")\
-            .select("*")\
-            .eq("user_id", user.id)\
-            .eq("product_id", photo_result.data["product_id"])\
-            .execute()
-            
-        if not user_product_result.data:
-            raise HTTPException(status_code=403, detail="Access denied")
-        
-        # Update the caption
-        update_result = supabase.table("product_photos")\
-            .update({"caption": caption_data.caption})\
-            .eq("id", photo_id)\
-            .execute()
+        # Update the caption if the user owns the photo
+        update_result = supabase.rpc("update_owned_photo", {
+            "p_user_id": user.id,
+            "p_photo_id": photo_id,
+            "p_caption": caption_data.caption
+        }).execute()
             
         if not update_result.data:
-            raise HTTPException(status_code=400, detail="Failed to update caption")
+            raise HTTPException(status_code=404, detail="Photo not found or access denied")
+        await response_cache.invalidate_user(user.id)
             
         return GeneratedPhotoDetail(**update_result.data[0])
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,69 @@
+from typing import TYPE_CHECKING, Optional
+import logging
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+logger = logging.getLogger(__name__)
+
+
+def increment_usage(
+    supabase: "Client",
+    user_id: str,
+    products: int = 0,
+    source_photos: int = 0,
+    generated_images: int = 0,
+    touch: bool = True
+) -> None:
+    """
+    Apply deltas to the user's usage counters in a single round trip.
+
+    Counter updates never fail the calling request; any drift is repaired
+    by reconcile_usage.
+
+    Args:
+        supabase: Supabase client to issue the RPC with
+        user_id: ID of the user whose counters change
+        products: Change in number of products
+        source_photos: Change in number of source photos
+        generated_images: Change in number of generated images
+        touch: Whether to bump last_activity to now
+    """
+    try:
+        supabase.rpc("increment_user_usage", {
+            "p_user_id": str(user_id),
+            "p_products": products,
+            "p_source_photos": source_photos,
+            "p_generated_images": generated_images,
+            "p_touch": touch
+        }).execute()
+    except Exception as e:
+        logger.error(f"Failed to update usage counters for user {user_id}: {str(e)}")
+
+
+def get_usage(supabase: "Client", user_id: str) -> Optional[dict]:
+    """Read the user's counters and token balance as a single row"""
+    result = supabase.table("user_stats")\
+        .select("token_balance, num_products, num_source_photos, num_generated_images, last_activity")\
+        .eq("user_id", str(user_id))\
+        .limit(1)\
+        .execute()
+    return result.data[0] if result.data else None
+
+
+def reconcile_usage(supabase: "Client", user_id: Optional[str] = None) -> int:
+    """
+    Recompute usage counters from the source tables.
+
+    Args:
+        supabase: Supabase client to issue the RPC with
+        user_id: Only repair this user's counters; all users if None
+
+    Returns:
+        Number of counter rows rewritten
+    """
+    result = supabase.rpc("reconcile_user_usage", {
+        "p_user_id": str(user_id) if user_id else None
+    }).execute()
+    return result.data or 0
+
@@ -1,97 +1,122 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import Dict
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
+from typing import Dict, List, Optional
 from app.core.auth import get_current_user
+from app.core.cache import response_cache
 from app.db import get_supabase_client
+from app.stats.counters import get_usage, reconcile_usage
 import uuid
 router = APIRouter(
     prefix="/stats",
     tags=["stats"]
 )
 
+# Newest activities included in /stats/user, so the dashboard read stays bounded
+STATS_ACTIVITY_LIMIT = 50
+
+def _load_activities(supabase, user_id: str, limit: Optional[int] = None) -> List[dict]:
+    """The user's product, source photo and generated image activity, newest first; all of it if no limit"""
+    activities = []
+
+    # Get the user's products and their IDs
+    products_response = supabase.table("user_products")\
+        .select("product_id, created_at, updated_at, product_descriptions(name)")\
+        .eq("user_id", str(user_id))\
+        .execute()
+    for product in products_response.data:
+        if product["created_at"] == product["updated_at"]:
+            activity = {'type': 'product_created', 'product_id': product["product_id"], 'date': product["created_at"], 'name': product["product_descriptions"]["name"]}
+        else:
+            activity = {'type': 'product_updated', 'product_id': product["product_id"], 'date': product["updated_at"], 'name': product["product_descriptions"]["name"]}
+        activities.append(activity)
+    product_ids = [product["product_id"] for product in products_response.data]  # Already strings from JSON
+
+    if product_ids:  # Only query if user has products
+        source_photos_query = supabase.table("source_photos")\
+            .select("id, original_photo_url, edited_photo_url, product_id, created_at")\
+            .in_("product_id", product_ids)\
+            .order("created_at", desc=True)
+        images_query = supabase.table("product_photos")\
+            .select("id, product_id, image_url, created_at")\
+            .in_("product_id", product_ids)\
+            .order("created_at", desc=True)
+        if limit is not None:
+            # Only the newest `limit` rows of each kind can make the final cut
+            source_photos_query = source_photos_query.limit(limit)
+            images_query = images_query.limit(limit)
+
+        for source_photo in source_photos_query.execute().data:
+            activity = {'type': 'source_photo_uploaded', 'product_id': source_photo["product_id"], 'date': source_photo["created_at"], 'original_photo_url': source_photo["original_photo_url"], 'edited_photo_url': source_photo["edited_photo_url"]}
+            activities.append(activity)
+
+        for image in images_query.execute().data:
+            activity = {
+                'type': 'image_generated', 
+                'product_id': image["product_id"], 
+                'date': image["created_at"], 
+                'image_url': image["image_url"],
+                'photo_id': image["id"]
+            }
+            activities.append(activity)
+
+    activities.sort(key=lambda x: x['date'], reverse=True)
+    return activities if limit is None else activities[:limit]
+
 @router.get("/user")
-async def get_user_stats(current_user: Dict = Depends(get_current_user)):
+async def get_user_stats(request: Request, activities: bool = True, current_user: Dict = Depends(get_current_user)):
     """
     Get user statistics including:
     - Number of products
+    - Number of source photos
     - Number of generated images
     - Last activity
     - Available tokens
+    - The newest STATS_ACTIVITY_LIMIT activities, unless `activities=false`
+
+    Counters are maintained at write time, so the counters are a single-row
+    read and the activity feed is bounded. /stats/user/activities returns
+    a longer feed.
     """
     try:
-        activities = []
-        supabase = get_supabase_client()
         user_id = current_user.id
 
-        # Get number of products and their IDs
-        products_response = supabase.table("user_products")\
-            .select("product_id, created_at, updated_at, product_descriptions(name)")\
-            .eq("user_id", str(user_id))\
-            .execute()
-        for product in products_response.data:
-            if product["created_at"] == product["updated_at"]:
-                activity = {'type': 'product_created', 'product_id': product["product_id"], 'date': product["created_at"], 'name': product["product_descriptions"]["name"]}
-            else:
-                activity = {'type': 'product_updated', 'product_id': product["product_id"], 'date': product["updated_at"], 'name': product["product_descriptions"]["name"]}
-            activities.append(activity)
-        product_ids = [product["product_id"] for product in products_response.data]  # Already strings from JSON
-        num_products = len(products_response.data)
-        
-        # Simple query to get source photos
-        source_photos_response = supabase.table("source_photos")\
-            .select("id, original_photo_url, edited_photo_url, product_id, created_at")\
-            .in_("product_id", product_ids)\
-            .execute()
-            
-        for source_photo in source_photos_response.data:
-            activity = {'type': 'source_photo_uploaded', 'product_id': source_photo["product_id"], 'date': source_photo["created_at"], 'original_photo_url': source_photo["original_photo_url"], 'edited_photo_url': source_photo["edited_photo_url"]}
-            activities.append(activity)
-        
-        
+        async def load_stats():
+            supabase = get_supabase_client()
+            usage = get_usage(supabase, user_id)
+            if usage is None:
+                # No counters yet for this user; build them once from the source tables
+                reconcile_usage(supabase, user_id)
+                usage = get_usage(supabase, user_id)
+            usage = usage or {}
 
-        # Get number of generated images for user's products
-        num_generated_images = 0
-        if product_ids:  # Only query if user has products
-            images_response = supabase.table("product_photos")\
-                .select("id, product_id, image_url, created_at")\
-                .in_("product_id", product_ids)\
-                .execute()
-            for image in images_response.data:
-                activity = {
-                    'type': 'image_generated', 
-                    'product_id': image["product_id"], 
-                    'date': image["created_at"], 
-                    'image_url': image["image_url"],
-                    'photo_id': image["id"]
-                }
-                activities.append(activity)
-            num_generated_images = len(images_response.data)
+            content = {
+                "num_products": usage.get("num_products") or 0,
+                "num_source_photos": usage.get("num_source_photos") or 0,
+                "num_generated_images": usage.get("num_generated_images") or 0,
+                "last_activity": usage.get("last_activity"),
+                "available_tokens": usage.get("token_balance") or 0
+            }
+            if activities:
+                content["activities"] = _load_activities(supabase, user_id, STATS_ACTIVITY_LIMIT)
+            return JSONResponse(content=content)
 
-        # Get last activity (most recent between product creation and image generation)
-        activities.sort(key=lambda x: x['date'], reverse=True)
-        last_activity = activities[0]['date'] if activities else None
-        
-    
-        
-        last_activity = None
-        if activities:
-            last_activity = activities[0]['date']
+        return await response_cache.respond(request, user_id, load_stats)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Get available tokens
-        tokens_response = supabase.table("user_tokens")\
-            .select("token_balance")\
-            .eq("user_id", str(user_id))\
-            .single()\
-            .execute()
-        available_tokens = 0
-        if tokens_response.data:
-            available_tokens = tokens_response.data["token_balance"]
+@router.get("/user/activities")
+async def get_user_activities(limit: int = 50, current_user: Dict = Depends(get_current_user)):
+    """
+    Get the user's most recent activities, newest first.
+    """
+    try:
+        if not 1 <= limit <= 200:
+            raise HTTPException(status_code=400, detail="Limit must be between 1 and 200")
 
-        return {
-            "num_products": num_products,
-            "num_generated_images": num_generated_images,
-            "last_activity": last_activity,
-            "available_tokens": available_tokens,
-            "activities": activities
-        }
+        return {"activities": _load_activities(get_supabase_client(), current_user.id, limit)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
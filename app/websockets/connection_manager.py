@@ -1,5 +1,6 @@
 from fastapi import WebSocket
 from typing import Dict, List
+from app.core.metrics import WEBSOCKET_CONNECTIONS
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,10 +13,12 @@ class ConnectionManager:
         if client_id not in self.active_connections:
             self.active_connections[client_id] = []
         self.active_connections[client_id].append(websocket)
+        WEBSOCKET_CONNECTIONS.inc()
 
     async def disconnect(self, websocket: WebSocket, client_id: str):
-        if client_id in self.active_connections:
+        if client_id in self.active_connections and websocket in self.active_connections[client_id]:
             self.active_connections[client_id].remove(websocket)
+            WEBSOCKET_CONNECTIONS.dec()
             if not self.active_connections[client_id]:
                 del self.active_connections[client_id]
 
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from app.websockets.connection_manager import manager
 from app.image_processing.product_image_generator import generate_ad_photo, add_source_photo
+from app.image_processing.batch_generator import generate_ad_photo_batch
+from app.core.draining import ServerDrainingError, generation_jobs
 import logging
 import base64
 router = APIRouter()
@@ -28,19 +30,46 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                     image = data.get("image")
                     product_id = data.get("product_id")
                     background_description = data.get("background_description")
+                    variant_count = data.get("variant_count")
                     auth = data.get("auth")
                     
                     if not all([image, product_id, auth]) or not all([auth.get("access_token"), auth.get("refresh_token")]):
                         raise ValueError("Image, product ID, and auth tokens are required")
                     
                     # Process the image with the background description
-                    result = await generate_ad_photo(
-                        image=image, 
-                        background_description=background_description, 
-                        product_id=product_id,
-                        access_token=auth["access_token"],
-                        refresh_token=auth["refresh_token"]
-                    )
+                    async with generation_jobs.track():
+                        result = await generate_ad_photo(
+                            image=image, 
+                            background_description=background_description, 
+                            product_id=product_id,
+                            access_token=auth["access_token"],
+                            refresh_token=auth["refresh_token"],
+                            variant_count=variant_count
+                        )
+                    if websocket.client_state.value != 3:  # Check if still connected before sending
+                        await manager.send_personal_message({
+                            "type": "process_complete",
+                            "data": result
+                        }, websocket)
+                elif data.get("type") == "generate_ad_photo_batch":
+                    # Every combination of existing source photos and background descriptions
+                    product_id = data.get("product_id")
+                    source_photo_ids = data.get("source_photo_ids")
+                    background_descriptions = data.get("background_descriptions")
+                    auth = data.get("auth")
+                    
+                    if not all([product_id, source_photo_ids, background_descriptions, auth]) or not all([auth.get("access_token"), auth.get("refresh_token")]):
+                        raise ValueError("Product ID, source photo IDs, background descriptions and auth tokens are required")
+                    
+                    async with generation_jobs.track():
+                        result = await generate_ad_photo_batch(
+                            product_id=product_id,
+                            source_photo_ids=source_photo_ids,
+                            background_descriptions=background_descriptions,
+                            access_token=auth["access_token"],
+                            refresh_token=auth["refresh_token"],
+                            variant_count=data.get("variant_count")
+                        )
                     if websocket.client_state.value != 3:  # Check if still connected before sending
                         await manager.send_personal_message({
                             "type": "process_complete",
@@ -54,12 +83,13 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                     if not all([image, product_id, auth]) or not all([auth.get("access_token"), auth.get("refresh_token")]):
                         raise ValueError("Image, product ID, and auth tokens are required")
                         
-                    result = await add_source_photo(
-                        image=image,
-                        access_token=auth["access_token"],
-                        refresh_token=auth["refresh_token"],
-                        product_id=product_id
-                    )
+                    async with generation_jobs.track():
+                        result = await add_source_photo(
+                            image=image,
+                            access_token=auth["access_token"],
+                            refresh_token=auth["refresh_token"],
+                            product_id=product_id
+                        )
                     if websocket.client_state.value != 3:  # Check if still connected before sending
                         await manager.send_personal_message({
                             "type": "process_complete",
@@ -71,6 +101,12 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
             except WebSocketDisconnect:
                 logger.info(f"Client {client_id} disconnected during message processing")
                 break  # Break the receive loop on disconnect
+            except ServerDrainingError as e:
+                # The worker is shutting down; the client should resubmit to another worker
+                await manager.send_personal_message({
+                    "type": "error",
+                    "data": {"message": str(e), "code": e.code}
+                }, websocket)
             except Exception as e:
                 logger.error(f"Error processing message from client {client_id}: {str(e)}")
                 if websocket.client_state.value != 3:  # Check if still connected before sending error
@@ -0,0 +1,298 @@
+"""
+End-to-end load benchmark against local fakes of every external service.
+
+    python -m benchmarks.bench_load [--scenarios crud,stats,generate] [--duration 20]
+                                    [--concurrency 32] [--generations 16] [--workers 1]
+                                    [--replicate 1.0:0.01] [--json results.json]
+
+Starts benchmarks.fakes (Supabase, S3, Replicate, OpenAI) and the app in
+separate processes, then drives:
+
+  crud      authenticated create/list/update/images/delete cycles on /products
+  stats     /stats/user, activities and 200-item product pages for heavy users
+  generate  concurrent websocket generate_ad_photos jobs, end to end
+
+and reports throughput, p50/p95/p99 latency and errors per operation, plus
+the app's peak resident memory. Fake latency and failure rates are set per
+service as "median[:error_rate[:sigma]]".
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+from benchmarks.fakes import token_for, user_id_for
+from benchmarks.fakes.images import png_bytes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Recorder:
+    """Latencies and errors per operation"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def record(self, operation: str, seconds: float, ok: bool) -> None:
+        self.latencies[operation].append(seconds)
+        if not ok:
+            self.errors[operation] += 1
+
+    def summary(self) -> List[dict]:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        rows = []
+        for operation, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            rows.append({
+                "operation": operation,
+                "count": len(ordered),
+                "errors": self.errors[operation],
+                "throughput": len(ordered) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(ordered, 50) * 1000,
+                "p95_ms": percentile(ordered, 95) * 1000,
+                "p99_ms": percentile(ordered, 99) * 1000,
+            })
+        return rows
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def free_port_block(count: int) -> int:
+    """First of `count` consecutive free ports"""
+    for _ in range(100):
+        base = random.randint(20000, 60000)
+        sockets = []
+        try:
+            for offset in range(count):
+                sock = socket.socket()
+                sock.bind(("127.0.0.1", base + offset))
+                sockets.append(sock)
+            return base
+        except OSError:
+            continue
+        finally:
+            for sock in sockets:
+                sock.close()
+    raise RuntimeError("No free port range found")
+
+
+def peak_rss_mb(pid: int) -> float:
+    """Peak resident memory of a process and its children, from /proc (Linux only)"""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1])
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return total / 1024
+
+
+async def timed(recorder: Recorder, operation: str, call) -> Optional[httpx.Response]:
+    start = time.perf_counter()
+    try:
+        response = await call
+        recorder.record(operation, time.perf_counter() - start, response.status_code < 400)
+        return response
+    except Exception:
+        recorder.record(operation, time.perf_counter() - start, False)
+        return None
+
+
+def auth_headers(index: int) -> dict:
+    return {"Authorization": f"Bearer {token_for(user_id_for(index))}"}
+
+
+async def crud_worker(client: httpx.AsyncClient, recorder: Recorder, user_index: int, deadline: float) -> None:
+    headers = auth_headers(user_index)
+    product = {"name": "Bench mug", "target_audience": "Coffee lovers", "description": "A mug"}
+    while time.perf_counter() < deadline:
+        created = await timed(recorder, "POST /products", client.post("/products/", json=product, headers=headers))
+        await timed(recorder, "GET /products", client.get("/products/", params={"limit": 50}, headers=headers))
+        if created is None or created.status_code >= 400:
+            continue
+        product_id = created.json()["id"]
+        await timed(recorder, "PUT /products/{id}",
+                    client.put(f"/products/{product_id}", json={**product, "name": "Renamed mug"}, headers=headers))
+        await timed(recorder, "GET /products/{id}/images", client.get(f"/products/{product_id}/images", headers=headers))
+        await timed(recorder, "DELETE /products/{id}", client.delete(f"/products/{product_id}", headers=headers))
+
+
+async def stats_worker(client: httpx.AsyncClient, recorder: Recorder, user_index: int, deadline: float) -> None:
+    headers = auth_headers(user_index)
+    while time.perf_counter() < deadline:
+        await timed(recorder, "GET /stats/user", client.get("/stats/user", params={"activities": "false"}, headers=headers))
+        await timed(recorder, "GET /stats/user/activities", client.get("/stats/user/activities", headers=headers))
+        await timed(recorder, "GET /products (200)", client.get("/products/", params={"limit": 200}, headers=headers))
+
+
+async def generate_job(base_url: str, client: httpx.AsyncClient, recorder: Recorder, user_index: int, image: str) -> None:
+    headers = auth_headers(user_index)
+    user_id = user_id_for(user_index)
+    created = await client.post("/products/", json={"name": "Generated", "target_audience": "Everyone",
+                                                    "description": "A lamp"}, headers=headers)
+    product_id = created.json()["id"]
+    start = time.perf_counter()
+    ok = False
+    try:
+        async with websockets.connect(f"{base_url.replace('http', 'ws')}/ws/{uuid.uuid4()}", max_size=None) as ws:
+            await ws.send(json.dumps({
+                "type": "generate_ad_photos",
+                "image": image,
+                "product_id": product_id,
+                "background_description": "On a marble kitchen counter",
+                "auth": {"access_token": token_for(user_id), "refresh_token": f"refresh-{user_id}"}
+            }))
+            while True:
+                message = json.loads(await ws.recv())
+                if message.get("type") == "process_complete":
+                    ok = message["data"].get("status") == "success"
+                    # Per-stage server timings show where a slow generation spent its time
+                    for stage, seconds in (message["data"].get("timings") or {}).get("stages", {}).items():
+                        recorder.record(f"  stage {stage}", seconds, True)
+                    break
+                if message.get("type") == "error":
+                    break
+    except Exception:
+        ok = False
+    recorder.record("ws generate_ad_photos", time.perf_counter() - start, ok)
+
+
+async def run_scenario(name: str, base_url: str, args) -> Recorder:
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        light_users = list(range(args.heavy_users, args.users)) or [0]
+        heavy_users = list(range(args.heavy_users)) or [0]
+        if name == "crud":
+            await asyncio.gather(*(crud_worker(client, recorder, light_users[i % len(light_users)], deadline)
+                                   for i in range(args.concurrency)))
+        elif name == "stats":
+            await asyncio.gather(*(stats_worker(client, recorder, heavy_users[i % len(heavy_users)], deadline)
+                                   for i in range(args.concurrency)))
+        elif name == "generate":
+            image = base64.b64encode(png_bytes(512, 512)).decode()
+            await asyncio.gather(*(generate_job(base_url, client, recorder, light_users[i % len(light_users)], image)
+                                   for i in range(args.generations)))
+        else:
+            raise ValueError(f"Unknown scenario {name}")
+    recorder.finished = time.perf_counter()
+    return recorder
+
+
+def start_fakes(args) -> (subprocess.Popen, dict):
+    port = free_port_block(4)
+    command = [
+        sys.executable, "-m", "benchmarks.fakes", "--port", str(port),
+        "--users", str(args.users), "--heavy-users", str(args.heavy_users),
+        "--heavy-products", str(args.heavy_products),
+        "--supabase", args.supabase, "--s3", args.s3, "--replicate", args.replicate, "--openai", args.openai,
+    ]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line:
+        raise RuntimeError("Fake services failed to start")
+    return process, json.loads(line)
+
+
+def start_app(env: dict, workers: int, webhooks: bool) -> (subprocess.Popen, str):
+    port = free_port_block(1)
+    data_dir = tempfile.mkdtemp(prefix="fotnik-bench-")
+    for folder in ("source", "removed_bg", "generated"):
+        os.makedirs(os.path.join(data_dir, "images", folder))
+    app_env = {**os.environ, **env, "DATA_DIR": data_dir, "ENVIRONMENT": "benchmark",
+               "PORT": str(port), "WEB_CONCURRENCY": str(workers), "LOG_LEVEL": "warning"}
+    if webhooks:
+        app_env["REPLICATE_WEBHOOK_URL"] = f"http://127.0.0.1:{port}/webhooks/replicate"
+    process = subprocess.Popen([sys.executable, "serve.py"], cwd=ROOT, env=app_env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{base_url}/", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("App did not start")
+
+
+def print_report(results: Dict[str, List[dict]], peak_mb: float) -> None:
+    print(f"{'operation':<30} {'count':>7} {'errors':>7} {'ops/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for scenario, rows in results.items():
+        print(f"-- {scenario}")
+        for row in rows:
+            print(f"{row['operation']:<30} {row['count']:>7} {row['errors']:>7} {row['throughput']:>8.1f} "
+                  f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+    print(f"app peak RSS: {peak_mb:.1f} MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="crud,stats,generate")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per crud/stats scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--generations", type=int, default=16, help="concurrent websocket generation jobs")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--heavy-users", type=int, default=4)
+    parser.add_argument("--heavy-products", type=int, default=500)
+    parser.add_argument("--supabase", default="0.003")
+    parser.add_argument("--s3", default="0.01")
+    parser.add_argument("--replicate", default="1.0")
+    parser.add_argument("--openai", default="0.3")
+    parser.add_argument("--no-webhooks", action="store_true",
+                        help="complete Replicate predictions by polling only")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    fakes, env = start_fakes(args)
+    app = None
+    try:
+        app, base_url = start_app(env, args.workers, not args.no_webhooks)
+        results = {}
+        for scenario in args.scenarios.split(","):
+            results[scenario] = asyncio.run(run_scenario(scenario.strip(), base_url, args)).summary()
+        peak_mb = peak_rss_mb(app.pid)
+        print_report(results, peak_mb)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"args": vars(args), "results": results, "peak_rss_mb": peak_mb}, f, indent=2)
+    finally:
+        for process in (app, fakes):
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Background removal benchmark: the local ONNX backend against Replicate.
+
+    python -m benchmarks.bench_remove_bg --model u2netp.onnx [--family u2net] [--images DIR]
+                                         [--count 24] [--concurrency 4] [--workers 2]
+                                         [--replicate 1.0] [--real] [--json results.json]
+
+Every image is normalised as in the pipeline and sent through both
+backends. Reported per backend: start-up (spawning workers and loading the
+model, for local), warm latency p50/p95 and throughput at --concurrency,
+and quality as mean IoU of the alpha mask against the ground truth.
+
+Without --images, synthetic product shots with known masks are used; with
+it, DIR/<name>.mask.png is used as ground truth where it exists. The
+remote side runs against the Replicate fake unless --real is given, in
+which case REPLICATE_API_TOKEN must be set. The fake returns placeholder
+images, so remote quality is only meaningful with --real.
+"""
+import argparse
+import asyncio
+import base64
+import glob
+import io
+import json
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
+
+from benchmarks.bench_load import percentile, start_fakes
+
+
+def synthetic_shot(seed: int, size: Tuple[int, int] = (1024, 768)):
+    """A product-like shape on a light, noisy studio background, and its mask"""
+    from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+    rng = random.Random(seed)
+    width, height = size
+    background = Image.linear_gradient("L").resize(size).point(lambda v: 200 + v // 5).convert("RGB")
+    noise = Image.effect_noise(size, 12).convert("RGB")
+    background = ImageChops.add(background, noise, scale=1.0, offset=-64)
+
+    mask = Image.new("L", size, 0)
+    draw = ImageDraw.Draw(mask)
+    cx, cy = width // 2 + rng.randint(-100, 100), height // 2 + rng.randint(-60, 60)
+    body_w, body_h = rng.randint(150, 300), rng.randint(200, 320)
+    draw.rounded_rectangle((cx - body_w // 2, cy - body_h // 2, cx + body_w // 2, cy + body_h // 2), radius=30, fill=255)
+    draw.ellipse((cx - body_w // 3, cy - body_h // 2 - 80, cx + body_w // 3, cy - body_h // 2 + 20), fill=255)
+
+    colour = tuple(rng.randint(20, 160) for _ in range(3))
+    product = Image.new("RGB", size, colour)
+    shaded = ImageChops.multiply(product, Image.linear_gradient("L").rotate(90).resize(size).point(lambda v: 128 + v // 2).convert("RGB"))
+    image = Image.composite(shaded, background, mask.filter(ImageFilter.GaussianBlur(1)))
+
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=92)
+    return output.getvalue(), mask
+
+
+def load_images(directory: Optional[str], count: int) -> List[tuple]:
+    from PIL import Image
+
+    if not directory:
+        return [synthetic_shot(seed) for seed in range(count)]
+    images = []
+    for path in sorted(glob.glob(os.path.join(directory, "*")))[:count]:
+        if path.endswith(".mask.png"):
+            continue
+        mask_path = os.path.splitext(path)[0] + ".mask.png"
+        mask = Image.open(mask_path).convert("L") if os.path.exists(mask_path) else None
+        with open(path, "rb") as f:
+            images.append((f.read(), mask))
+    return images
+
+
+def mask_iou(cutout: bytes, truth) -> Optional[float]:
+    from PIL import Image, ImageChops
+
+    if truth is None:
+        return None
+    with Image.open(io.BytesIO(cutout)) as image:
+        if "A" not in image.getbands():
+            return 0.0
+        alpha = image.getchannel("A").resize(truth.size).point(lambda v: 255 if v > 127 else 0)
+    truth = truth.point(lambda v: 255 if v > 127 else 0)
+    intersection = ImageChops.multiply(alpha, truth).histogram()[255]
+    union = ImageChops.lighter(alpha, truth).histogram()[255]
+    return intersection / union if union else 1.0
+
+
+async def fetch_cutout(output: str) -> bytes:
+    if output.startswith("data:"):
+        return base64.b64decode(output.split(",", 1)[1])
+    from app.core.clients import get_http_session
+
+    session = await get_http_session()
+    async with session.get(output) as response:
+        response.raise_for_status()
+        return await response.read()
+
+
+async def run_backend(remover, inputs: List[tuple], concurrency: int) -> dict:
+    from app.core.resilience import Deadline
+
+    start = time.perf_counter()
+    await remover.start()
+    startup = time.perf_counter() - start
+
+    latencies, ious, errors = [], [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(data_uri: str, truth) -> None:
+        nonlocal errors
+        async with semaphore:
+            began = time.perf_counter()
+            try:
+                cutout = await fetch_cutout(await remover.remove(data_uri, Deadline(300)))
+            except Exception as e:
+                errors += 1
+                print(f"{remover.name}: {type(e).__name__}: {str(e)}", file=sys.stderr)
+                return
+            latencies.append(time.perf_counter() - began)
+        iou = mask_iou(cutout, truth)
+        if iou is not None:
+            ious.append(iou)
+
+    began = time.perf_counter()
+    await asyncio.gather(*(one(data_uri, truth) for data_uri, truth in inputs))
+    elapsed = time.perf_counter() - began
+    await remover.close()
+
+    ordered = sorted(latencies)
+    return {
+        "backend": remover.name,
+        "count": len(inputs),
+        "errors": errors,
+        "startup_s": round(startup, 3),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 1),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 1),
+        "images_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_iou": round(sum(ious) / len(ious), 3) if ious else None,
+    }
+
+
+async def run(args) -> List[dict]:
+    # Imported only now, so the fakes' environment is in place when the app's settings are read
+    from app.core.clients import close_clients
+    from app.image_processing.background_removal import LocalBackgroundRemover, ReplicateBackgroundRemover
+    from app.image_processing.preprocess import normalize_image
+
+    inputs = []
+    for data, truth in load_images(args.images, args.count):
+        inputs.append((normalize_image(data).data_uri(), truth))
+
+    backends = [LocalBackgroundRemover(args.model, args.family, workers=args.workers, threads=args.threads)]
+    if not args.local_only:
+        backends.append(ReplicateBackgroundRemover())
+    try:
+        return [await run_backend(remover, inputs, args.concurrency) for remover in backends]
+    finally:
+        await close_clients()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="ONNX segmentation model for the local backend")
+    parser.add_argument("--family", default="u2net", help="u2net, isnet or birefnet")
+    parser.add_argument("--images", help="directory of product photos instead of synthetic shots")
+    parser.add_argument("--count", type=int, default=24)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2, help="local worker processes")
+    parser.add_argument("--threads", type=int, default=1, help="onnxruntime threads per local worker")
+    parser.add_argument("--replicate", default="1.0", help="fake Replicate latency as median[:error_rate[:sigma]]")
+    parser.add_argument("--real", action="store_true", help="use the real Replicate API instead of the fake")
+    parser.add_argument("--local-only", action="store_true")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    fakes = None
+    if not args.real and not args.local_only:
+        fakes, env = start_fakes(SimpleNamespace(
+            users=1, heavy_users=0, heavy_products=0,
+            supabase="0.003", s3="0.01", replicate=args.replicate, openai="0.3"
+        ))
+        os.environ.update(env)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if fakes is not None:
+            fakes.terminate()
+            fakes.wait()
+
+    print(f"{'backend':<12} {'count':>6} {'errors':>7} {'startup s':>10} {'p50 ms':>9} {'p95 ms':>9} {'img/s':>7} {'IoU':>6}")
+    for row in results:
+        iou = f"{row['mean_iou']:.3f}" if row["mean_iou"] is not None else "n/a"
+        print(f"{row['backend']:<12} {row['count']:>6} {row['errors']:>7} {row['startup_s']:>10.2f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['images_per_s']:>7.2f} {iou:>6}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Micro-benchmarks for list-endpoint serialisation and compression on 10k rows.
+
+    python -m benchmarks.bench_serialization [--rows 10000] [--repeat 5]
+
+Compares the old per-row pydantic path with the FastJSONResponse fast path
+and the NDJSON stream, and reports compressed sizes for gzip and brotli.
+"""
+import argparse
+import asyncio
+import gzip
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.core.responses import FastJSONResponse, ndjson_response, orjson
+from app.product.routes import GeneratedImageResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def make_rows(count: int) -> List[dict]:
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "url": f"https://bucket.s3.amazonaws.com/products/{uuid.uuid4()}/generated_{i}.jpg",
+            "created_at": (now - timedelta(seconds=i)).isoformat()
+        }
+        for i in range(count)
+    ]
+
+
+def timed(fn: Callable[[], object], repeat: int) -> float:
+    """Median wall time of fn in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def pydantic_path(rows: List[dict]) -> bytes:
+    # What the list endpoints did before: a model per row, then FastAPI's encoder
+    models = [GeneratedImageResponse(**row) for row in rows]
+    return JSONResponse(content=jsonable_encoder(models)).body
+
+
+def stdlib_path(rows: List[dict]) -> bytes:
+    return JSONResponse(content=rows).body
+
+
+def fast_path(rows: List[dict]) -> bytes:
+    return FastJSONResponse(content=rows).body
+
+
+def ndjson_path(rows: List[dict]) -> bytes:
+    async def collect() -> bytes:
+        return b"".join([chunk async for chunk in ndjson_response(iter(rows)).body_iterator])
+    return asyncio.run(collect())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    print(f"{args.rows} rows, median of {args.repeat} runs, orjson {'on' if orjson else 'off'}")
+
+    for name, fn in [
+        ("pydantic models + jsonable_encoder", pydantic_path),
+        ("JSONResponse (stdlib json)", stdlib_path),
+        ("FastJSONResponse", fast_path),
+        ("NDJSON stream", ndjson_path),
+    ]:
+        body = fn(rows)
+        print(f"  {name:<38} {timed(lambda: fn(rows), args.repeat):8.2f} ms  {len(body) / 1024:8.1f} KiB")
+
+    body = fast_path(rows)
+    print("compression of the FastJSONResponse body:")
+    print(f"  {'gzip level 6':<38} {timed(lambda: gzip.compress(body, 6), args.repeat):8.2f} ms  "
+          f"{len(gzip.compress(body, 6)) / 1024:8.1f} KiB")
+    if brotli is not None:
+        print(f"  {'brotli quality 4':<38} {timed(lambda: brotli.compress(body, quality=4), args.repeat):8.2f} ms  "
+              f"{len(brotli.compress(body, quality=4)) / 1024:8.1f} KiB")
+    else:
+        print("  brotli not installed, skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Cold-start benchmark: import time of main.py and time to first request.
+
+    python -m benchmarks.bench_startup [--runs 5] [--importtime]
+
+Every sample runs in a fresh interpreter, so module caches don't hide
+import cost. Time to first request starts uvicorn on a free port and polls
+the health check until it answers.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def import_seconds() -> float:
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT)
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def first_request_seconds(timeout: float = 60.0) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError("server did not answer the health check")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def slowest_imports(limit: int = 15) -> list:
+    """Top-level packages by cumulative import time, from python -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, capture_output=True, text=True)
+    totals = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        package = name.split(".")[0]
+        totals[package] = max(totals.get(package, 0), int(cumulative))
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+def summarise(name: str, samples: list) -> None:
+    print(f"  {name:<24} median {statistics.median(samples) * 1000:8.1f} ms   "
+          f"min {min(samples) * 1000:8.1f} ms   max {max(samples) * 1000:8.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="also list the slowest top-level imports")
+    args = parser.parse_args()
+
+    print(f"{args.runs} cold starts each")
+    summarise("import main", [import_seconds() for _ in range(args.runs)])
+    summarise("time to first request", [first_request_seconds() for _ in range(args.runs)])
+
+    if args.importtime:
+        print("slowest top-level imports (cumulative):")
+        for package, micros in slowest_imports():
+            print(f"  {package:<24} {micros / 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
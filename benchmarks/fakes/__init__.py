@@ -0,0 +1,50 @@
+"""
+Local stand-ins for Supabase, S3, Replicate and OpenAI.
+
+    python -m benchmarks.fakes --users 50 --heavy-users 5 --replicate 2.0:0.01
+
+starts all four on consecutive ports and prints the environment variables
+that point the app at them. Each fake takes a LatencyModel written as
+"median[:error_rate[:sigma]]". State lives in memory and is lost on exit.
+"""
+from typing import Dict, Optional
+
+from benchmarks.fakes.latency import LatencyModel
+from benchmarks.fakes.replicate import WEBHOOK_SECRET
+from benchmarks.fakes.supabase import SERVICE_ROLE_KEY, FakeDatabase, token_for, user_id_for
+
+__all__ = ['LatencyModel', 'FakeDatabase', 'token_for', 'user_id_for', 'service_env', 'BUCKET_NAME']
+
+BUCKET_NAME = "fotnik-bench"
+
+
+def service_env(host: str, base_port: int, ca_file: Optional[str] = None) -> Dict[str, str]:
+    """Environment that points the app's SDK clients at fakes started on base_port..base_port+3
+
+    Args:
+        host: Interface the fakes listen on
+        base_port: Port of the Supabase fake; S3, Replicate and OpenAI follow it
+        ca_file: Certificate the Replicate fake serves, when it runs over TLS
+
+    Returns:
+        Environment variables for the app process
+    """
+    replicate_scheme = "https" if ca_file else "http"
+    env = {
+        "SUPABASE_URL": f"http://{host}:{base_port}",
+        "SUPABASE_SERVICE_ROLE_KEY": SERVICE_ROLE_KEY,
+        "AWS_ENDPOINT_URL_S3": f"http://{host}:{base_port + 1}",
+        "aws_access_key_id": "fake",
+        "aws_secret_access_key": "fake",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "bucket_name": BUCKET_NAME,
+        "REPLICATE_BASE_URL": f"{replicate_scheme}://{host}:{base_port + 2}",
+        "REPLICATE_API_TOKEN": "fake",
+        "REPLICATE_POLL_INTERVAL": "0.1",
+        "REPLICATE_WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "OPENAI_BASE_URL": f"http://{host}:{base_port + 3}/v1",
+        "OPENAI_API_KEY": "fake",
+    }
+    if ca_file:
+        env["SSL_CERT_FILE"] = ca_file
+    return env
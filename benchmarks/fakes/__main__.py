@@ -0,0 +1,73 @@
+import argparse
+import asyncio
+import json
+import sys
+from urllib.parse import urlparse
+
+import uvicorn
+
+from benchmarks.fakes import BUCKET_NAME, FakeDatabase, LatencyModel, service_env
+from benchmarks.fakes import openai, replicate, s3, supabase
+from benchmarks.fakes.images import png_bytes
+from benchmarks.fakes.tls import self_signed_cert
+
+
+async def serve(apps, host: str, base_port: int, certfile: str, keyfile: str) -> None:
+    servers = []
+    for offset, app in enumerate(apps):
+        # Only the Replicate fake needs TLS, see benchmarks.fakes.tls
+        tls = {"ssl_certfile": certfile, "ssl_keyfile": keyfile} if offset == 2 else {}
+        config = uvicorn.Config(app, host=host, port=base_port + offset, log_level="warning", lifespan="off", **tls)
+        servers.append(uvicorn.Server(config))
+    tasks = [asyncio.create_task(server.serve()) for server in servers]
+    while not all(server.started for server in servers):
+        if any(task.done() for task in tasks):
+            raise SystemExit("A fake service failed to start")
+        await asyncio.sleep(0.05)
+    # The load driver waits for this line before starting the app
+    print(json.dumps(service_env(host, base_port, ca_file=certfile)), flush=True)
+    await asyncio.gather(*tasks)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run local fakes of the app's external services")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9400, help="first of four consecutive ports")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--heavy-users", type=int, default=2)
+    parser.add_argument("--heavy-products", type=int, default=200)
+    parser.add_argument("--photos-per-product", type=int, default=8)
+    parser.add_argument("--supabase", type=LatencyModel.parse, default=LatencyModel(0.003), metavar="MEDIAN[:ERR]")
+    parser.add_argument("--s3", type=LatencyModel.parse, default=LatencyModel(0.01), metavar="MEDIAN[:ERR]")
+    parser.add_argument("--replicate", type=LatencyModel.parse, default=LatencyModel(1.0), metavar="MEDIAN[:ERR]")
+    parser.add_argument("--openai", type=LatencyModel.parse, default=LatencyModel(0.3), metavar="MEDIAN[:ERR]")
+    args = parser.parse_args()
+
+    db = FakeDatabase()
+    db.seed(args.users, args.heavy_users, args.heavy_products, args.photos_per_product, bucket=BUCKET_NAME)
+
+    s3_app = s3.create_app(args.s3)
+    # Seeded photos point at real objects, so proxy and export requests succeed
+    image = png_bytes()
+    for table in ("product_photos", "source_photos"):
+        for row in db.tables[table]:
+            for column in ("image_url", "source_image_url", "original_photo_url", "edited_photo_url"):
+                if row.get(column):
+                    s3_app.state.objects[(BUCKET_NAME, urlparse(row[column]).path.lstrip("/"))] = (image, "image/png", '"seed"')
+
+    certfile, keyfile = self_signed_cert(args.host)
+    replicate_url = f"https://{args.host}:{args.port + 2}"
+    apps = [
+        supabase.create_app(db, args.supabase),
+        s3_app,
+        replicate.create_app(replicate_url, args.replicate),
+        openai.create_app(args.openai),
+    ]
+    try:
+        asyncio.run(serve(apps, args.host, args.port, certfile, keyfile))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import struct
+import zlib
+
+
+def png_bytes(width: int = 256, height: int = 256, rgba=(200, 120, 40, 255)) -> bytes:
+    """A solid-colour RGBA PNG, built with the standard library only"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    row = b"\x00" + bytes(rgba) * width
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(row * height))
+        + chunk(b"IEND", b"")
+    )
@@ -0,0 +1,36 @@
+import asyncio
+import math
+import random
+from dataclasses import dataclass
+
+
+@dataclass
+class LatencyModel:
+    """
+    Log-normal response time with a median and spread, plus a failure rate.
+
+    Written on the command line as "median[:error_rate[:sigma]]", e.g.
+    "2.5:0.02" for a 2.5s median with 2% of calls failing.
+    """
+
+    median: float = 0.0
+    error_rate: float = 0.0
+    sigma: float = 0.5
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        parts = [float(part) for part in spec.split(":")]
+        return cls(*parts)
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(self.sigma * random.gauss(0, 1))
+
+    def fails(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    async def wait(self) -> None:
+        delay = self.sample()
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,49 @@
+"""
+OpenAI chat completions stand-in. Requests with a json_schema response
+format get a JSON object with every required property filled in, which
+is enough for `beta.chat.completions.parse`.
+"""
+from typing import Optional
+import json
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from benchmarks.fakes.latency import LatencyModel
+
+
+def create_app(latency: Optional[LatencyModel] = None) -> FastAPI:
+    latency = latency or LatencyModel()
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await latency.wait()
+        if latency.fails():
+            return JSONResponse(status_code=500, content={"error": {"message": "Fake OpenAI failure", "type": "server_error"}})
+
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"]["schema"]
+            content = json.dumps({name: f"fake {name.replace('_', ' ')}" for name in schema.get("required", [])})
+        else:
+            content = "A product photo on a sunlit wooden table with soft shadows."
+
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150},
+        }
+
+    return app
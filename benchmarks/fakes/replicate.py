@@ -0,0 +1,161 @@
+"""
+Replicate API stand-in: predictions that finish after a sampled latency,
+`Prefer: wait` blocking creates, polling, cancellation and webhooks.
+Outputs are URLs served by the fake itself under /files.
+
+A prediction whose input has `image_num` behaves like ad-inpaint and
+returns image_num + 1 images (the first being the mask, as the real model
+does); anything else behaves like remove-bg and returns one image.
+"""
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import re
+import time
+import uuid
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+from benchmarks.fakes.images import png_bytes
+from benchmarks.fakes.latency import LatencyModel
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+# Webhooks are signed the way Replicate signs them, with this secret
+WEBHOOK_SECRET = "whsec_" + base64.b64encode(b"fotnik-bench-webhook-secret").decode()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def sign_webhook(body: str, secret: str = WEBHOOK_SECRET) -> Dict[str, str]:
+    """webhook-id/timestamp/signature headers for a payload"""
+    webhook_id = f"msg_{uuid.uuid4().hex}"
+    timestamp = str(int(time.time()))
+    key = base64.b64decode(secret.split("_", 1)[1])
+    digest = hmac.new(key, f"{webhook_id}.{timestamp}.{body}".encode(), hashlib.sha256).digest()
+    return {
+        "webhook-id": webhook_id,
+        "webhook-timestamp": timestamp,
+        "webhook-signature": f"v1,{base64.b64encode(digest).decode()}",
+    }
+
+
+def create_app(base_url: str, latency: Optional[LatencyModel] = None, webhook_secret: str = WEBHOOK_SECRET) -> FastAPI:
+    """
+    Args:
+        base_url: URL the fake is reachable at, used in prediction and output URLs
+        latency: Time from creation to completion, and the share of predictions that fail
+        webhook_secret: Secret webhooks are signed with
+    """
+    latency = latency or LatencyModel()
+    predictions: Dict[str, dict] = {}
+    finished: Dict[str, asyncio.Event] = {}
+    image = png_bytes()
+    app = FastAPI()
+    app.state.predictions = predictions
+
+    webhook_client: Dict[str, httpx.AsyncClient] = {}
+
+    async def send_webhook(prediction: dict, webhook: str) -> None:
+        body = json.dumps(prediction)
+        headers = {"Content-Type": "application/json", **sign_webhook(body, webhook_secret)}
+        try:
+            # One pooled client, created on the serving loop, for every callback
+            client = webhook_client.setdefault("client", httpx.AsyncClient(timeout=10))
+            await client.post(webhook, content=body, headers=headers)
+        except Exception as e:
+            logger.warning(f"Webhook to {webhook} failed: {str(e)}")
+
+    async def run(prediction: dict, webhook: Optional[str]) -> None:
+        await asyncio.sleep(min(0.05, latency.median))
+        if prediction["status"] == "starting":
+            prediction["status"] = "processing"
+            prediction["started_at"] = _now()
+        await latency.wait()
+        if prediction["status"] == "canceled":
+            return
+        if latency.fails():
+            prediction["status"] = "failed"
+            prediction["error"] = "Fake model failure"
+        else:
+            count = int(prediction["input"].get("image_num", 0))
+            outputs = [f"{base_url}/files/{prediction['id']}_{index}.png" for index in range(count + 1)]
+            prediction["output"] = outputs if count else outputs[0]
+            prediction["status"] = "succeeded"
+            prediction["metrics"] = {"predict_time": latency.median}
+        prediction["completed_at"] = _now()
+        finished[prediction["id"]].set()
+        if webhook:
+            await send_webhook(prediction, webhook)
+
+    @app.post("/v1/predictions")
+    async def create_prediction(request: Request):
+        body = await request.json()
+        prediction_id = uuid.uuid4().hex
+        prediction = {
+            "id": prediction_id,
+            "model": body.get("model", "fake/model"),
+            "version": body.get("version", ""),
+            "input": body.get("input") or {},
+            "output": None,
+            "logs": "",
+            "error": None,
+            "status": "starting",
+            "metrics": None,
+            "created_at": _now(),
+            "started_at": None,
+            "completed_at": None,
+            "urls": {
+                "get": f"{base_url}/v1/predictions/{prediction_id}",
+                "cancel": f"{base_url}/v1/predictions/{prediction_id}/cancel",
+            },
+        }
+        predictions[prediction_id] = prediction
+        finished[prediction_id] = asyncio.Event()
+        asyncio.create_task(run(prediction, body.get("webhook")))
+
+        prefer = re.match(r"wait(?:=(\d+))?", request.headers.get("prefer", ""))
+        if prefer:
+            try:
+                await asyncio.wait_for(finished[prediction_id].wait(), timeout=float(prefer.group(1) or 60))
+            except asyncio.TimeoutError:
+                pass
+        return JSONResponse(status_code=201, content=prediction)
+
+    @app.get("/v1/predictions/{prediction_id}")
+    async def get_prediction(prediction_id: str):
+        if prediction_id not in predictions:
+            return JSONResponse(status_code=404, content={"detail": "Not found."})
+        return predictions[prediction_id]
+
+    @app.post("/v1/predictions/{prediction_id}/cancel")
+    async def cancel_prediction(prediction_id: str):
+        prediction = predictions.get(prediction_id)
+        if prediction is None:
+            return JSONResponse(status_code=404, content={"detail": "Not found."})
+        if prediction["status"] not in TERMINAL_STATUSES:
+            prediction["status"] = "canceled"
+            prediction["completed_at"] = _now()
+            finished[prediction_id].set()
+        return prediction
+
+    @app.get("/v1/models/{owner}/{name}/versions/{version_id}")
+    async def get_version(owner: str, name: str, version_id: str):
+        return {"id": version_id, "created_at": _now(), "cog_version": "0.9.0", "openapi_schema": {}}
+
+    @app.get("/files/{name}")
+    async def get_file(name: str):
+        return Response(content=image, media_type="image/png")
+
+    return app
@@ -0,0 +1,86 @@
+"""
+In-memory, path-style S3 stand-in covering PutObject, GetObject,
+HeadObject and DeleteObject. Point boto3 at it with AWS_ENDPOINT_URL_S3.
+"""
+from email.utils import formatdate
+from typing import Dict, Optional, Tuple
+import hashlib
+import mimetypes
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+from benchmarks.fakes.latency import LatencyModel
+
+
+def _decode_aws_chunked(body: bytes) -> bytes:
+    """Strip the aws-chunked framing newer botocore uses for streaming uploads with checksums"""
+    data, position = bytearray(), 0
+    while position < len(body):
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";")[0], 16)
+        position = line_end + 2
+        if size == 0:
+            break
+        data += body[position:position + size]
+        position += size + 2
+    return bytes(data)
+
+
+def _error(status: int, code: str, message: str) -> Response:
+    xml = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code><Message>{message}</Message></Error>'
+    return Response(status_code=status, content=xml, media_type="application/xml")
+
+
+def create_app(latency: Optional[LatencyModel] = None) -> FastAPI:
+    latency = latency or LatencyModel()
+    objects: Dict[Tuple[str, str], Tuple[bytes, str, str]] = {}
+    app = FastAPI()
+    app.state.objects = objects
+
+    def headers_for(data: bytes, content_type: str, etag: str) -> dict:
+        return {
+            "ETag": etag,
+            "Content-Type": content_type,
+            "Content-Length": str(len(data)),
+            "Last-Modified": formatdate(usegmt=True),
+        }
+
+    @app.put("/{bucket}/{key:path}")
+    async def put_object(bucket: str, key: str, request: Request):
+        # Read the body even when failing, or the kept-alive connection is left mid-request
+        body = await request.body()
+        await latency.wait()
+        if latency.fails():
+            return _error(503, "SlowDown", "Fake S3 failure")
+        if "aws-chunked" in request.headers.get("content-encoding", "") or \
+                request.headers.get("x-amz-content-sha256", "").startswith("STREAMING-"):
+            body = _decode_aws_chunked(body)
+        content_type = request.headers.get("content-type") or mimetypes.guess_type(key)[0] or "binary/octet-stream"
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        objects[(bucket, key)] = (body, content_type, etag)
+        return Response(status_code=200, headers={"ETag": etag})
+
+    @app.get("/{bucket}/{key:path}")
+    async def get_object(bucket: str, key: str):
+        await latency.wait()
+        if latency.fails():
+            return _error(503, "SlowDown", "Fake S3 failure")
+        if (bucket, key) not in objects:
+            return _error(404, "NoSuchKey", "The specified key does not exist.")
+        data, content_type, etag = objects[(bucket, key)]
+        return Response(content=data, headers=headers_for(data, content_type, etag))
+
+    @app.head("/{bucket}/{key:path}")
+    async def head_object(bucket: str, key: str):
+        if (bucket, key) not in objects:
+            return Response(status_code=404)
+        data, content_type, etag = objects[(bucket, key)]
+        return Response(headers=headers_for(data, content_type, etag))
+
+    @app.delete("/{bucket}/{key:path}")
+    async def delete_object(bucket: str, key: str):
+        objects.pop((bucket, key), None)
+        return Response(status_code=204)
+
+    return app
@@ -0,0 +1,587 @@
+"""
+In-memory stand-in for the parts of Supabase the app uses: PostgREST
+tables, views and RPC functions under /rest/v1, and GoTrue's user lookup
+under /auth/v1.
+
+Only the PostgREST features the app's queries rely on are implemented:
+column lists and `*`, embedded resources (with `!inner`), eq/neq/lt/lte/
+gt/gte/in/is filters and their `not.` forms, filters on embedded columns,
+nested `or=`/`and()` groups, multi-column `order=` and `limit=`. The RPC
+functions mirror supabase/migrations.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import base64
+import json
+import re
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+from benchmarks.fakes.latency import LatencyModel
+
+USER_NAMESPACE = uuid.UUID("6f1c1d39-8a4c-4b7e-9a43-1d7a1e0e5a11")
+
+# (table, column) -> referenced table, for resolving embedded resources
+FOREIGN_KEYS = {
+    ("user_products", "product_id"): "product_descriptions",
+    ("source_photos", "product_id"): "product_descriptions",
+    ("product_photos", "product_id"): "product_descriptions",
+}
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def user_id_for(index: int) -> str:
+    """Stable user ID for the n-th seeded user, so load drivers can compute it too"""
+    return str(uuid.uuid5(USER_NAMESPACE, f"user-{index}"))
+
+
+def _b64(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+def make_jwt(claims: dict) -> str:
+    """Unsigned JWT; the fake never checks signatures, the client only decodes the payload"""
+    return f"{_b64({'alg': 'HS256', 'typ': 'JWT'})}.{_b64(claims)}.{_b64({'sig': 'fake'})}"
+
+
+def token_for(user_id: str) -> str:
+    return make_jwt({"sub": user_id, "role": "authenticated", "aud": "authenticated", "exp": 4102444800})
+
+
+SERVICE_ROLE_KEY = make_jwt({"role": "service_role", "exp": 4102444800})
+
+
+def _decode_jwt(token: str) -> Optional[dict]:
+    try:
+        payload = token.split(".")[1]
+        return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except Exception:
+        return None
+
+
+# --- select parsing -----------------------------------------------------------
+
+def _split_top_level(text: str) -> List[str]:
+    """Split on commas that are not inside parentheses or double quotes"""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        if char == "," and depth == 0 and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    if current:
+        parts.append("".join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def parse_select(text: str) -> List[Tuple]:
+    """'a, b, rel!inner(c)' -> [('column', 'a', 'a'), ..., ('embed', 'rel', True, [...])]"""
+    items = []
+    for part in _split_top_level(text or "*"):
+        if "(" in part and part.endswith(")"):
+            head, inner = part[:-1].split("(", 1)
+            alias, _, relation = head.rpartition(":")
+            relation, _, hint = relation.partition("!")
+            items.append(("embed", relation, hint == "inner", parse_select(inner), alias or relation))
+        elif part == "*":
+            items.append(("star",))
+        else:
+            alias, _, column = part.rpartition(":")
+            items.append(("column", column, alias or column))
+    return items
+
+
+# --- filters ------------------------------------------------------------------
+
+def _unquote(value: str) -> str:
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+
+
+def _compare(left: Any, right: str) -> Tuple[Any, Any]:
+    if isinstance(left, bool) or left is None:
+        return str(left).lower(), right
+    if isinstance(left, (int, float)):
+        try:
+            return left, float(right)
+        except ValueError:
+            return str(left), right
+    return str(left), right
+
+
+def _matches(value: Any, operator: str, operand: str) -> bool:
+    negate = operator.startswith("not.")
+    if negate:
+        operator = operator[4:]
+    if operator == "is":
+        expected = {"null": None, "true": True, "false": False}[operand.lower()]
+        result = value is expected
+    elif operator == "in":
+        options = [_unquote(option) for option in _split_top_level(operand.strip("()"))]
+        result = value is not None and str(value) in options
+    elif value is None:
+        result = False
+    else:
+        left, right = _compare(value, _unquote(operand))
+        result = {
+            "eq": left == right, "neq": left != right,
+            "lt": left < right, "lte": left <= right,
+            "gt": left > right, "gte": left >= right,
+        }[operator]
+    return not result if negate else result
+
+
+def _parse_condition(text: str) -> Callable[[dict], bool]:
+    """One element of an or=/and() group: 'col.op.value', 'and(...)', 'or(...)' or 'not.and(...)'"""
+    negate = text.startswith("not.") and (text[4:].startswith("and(") or text[4:].startswith("or("))
+    if negate:
+        text = text[4:]
+    if text.startswith("and(") or text.startswith("or("):
+        combinator = all if text.startswith("and(") else any
+        conditions = [_parse_condition(part) for part in _split_top_level(text[text.index("(") + 1:-1])]
+        check = lambda row: combinator(condition(row) for condition in conditions)
+        return (lambda row: not check(row)) if negate else check
+    column, rest = text.split(".", 1)
+    operator, _, operand = rest.partition(".")
+    if operator == "not":
+        inner_operator, _, operand = operand.partition(".")
+        operator = f"not.{inner_operator}"
+    return lambda row: _matches(row.get(column), operator, operand)
+
+
+def _parse_filter(value: str) -> Tuple[str, str]:
+    operator, _, operand = value.partition(".")
+    if operator == "not":
+        inner_operator, _, operand = operand.partition(".")
+        operator = f"not.{inner_operator}"
+    return operator, operand
+
+
+class FakeDatabase:
+    """Tables as lists of dicts, with the app's RPC functions implemented in Python"""
+
+    def __init__(self):
+        self.tables: Dict[str, List[dict]] = {
+            "user_tokens": [],
+            "product_descriptions": [],
+            "user_products": [],
+            "source_photos": [],
+            "product_photos": [],
+            "user_usage_counters": [],
+            "token_reservations": [],
+        }
+        self.users: Dict[str, dict] = {}
+
+    # -- rows --
+
+    def rows(self, table: str) -> List[dict]:
+        if table == "user_stats":
+            counters = {row["user_id"]: row for row in self.tables["user_usage_counters"]}
+            return [
+                {
+                    "user_id": tokens["user_id"],
+                    "token_balance": tokens["token_balance"],
+                    "num_products": counters.get(tokens["user_id"], {}).get("num_products"),
+                    "num_source_photos": counters.get(tokens["user_id"], {}).get("num_source_photos"),
+                    "num_generated_images": counters.get(tokens["user_id"], {}).get("num_generated_images"),
+                    "last_activity": counters.get(tokens["user_id"], {}).get("last_activity"),
+                }
+                for tokens in self.tables["user_tokens"]
+            ]
+        if table not in self.tables:
+            raise KeyError(f'relation "public.{table}" does not exist')
+        return self.tables[table]
+
+    def insert(self, table: str, row: dict) -> dict:
+        row = dict(row)
+        if table != "user_tokens" and table != "user_usage_counters":
+            row.setdefault("id", str(uuid.uuid4()))
+        row.setdefault("created_at", now_iso())
+        if table in ("user_products", "product_descriptions"):
+            row.setdefault("updated_at", row["created_at"])
+        if table == "product_photos":
+            for column in ("caption", "user_rating", "background_description", "positive_prompt",
+                           "negative_prompt", "source_image_url", "no_bg_image_url"):
+                row.setdefault(column, None)
+        self.rows(table).append(row)
+        return row
+
+    def _owned_product_ids(self, user_id: str) -> set:
+        return {row["product_id"] for row in self.tables["user_products"] if row["user_id"] == user_id}
+
+    # -- PostgREST reads --
+
+    def _embed(self, table: str, row: dict, item: Tuple, filters: Dict[str, List[Tuple[str, str]]], path: str):
+        _, relation, inner, children, alias = item
+        prefix = f"{path}{relation}."
+        own_filters = [(column[len(prefix):], op) for column, ops in filters.items() if column.startswith(prefix)
+                       and "." not in column[len(prefix):] for op in ops]
+        many_to_one = next((column for (source, column), target in FOREIGN_KEYS.items()
+                            if source == table and target == relation), None)
+        if many_to_one:
+            candidates = [r for r in self.rows(relation) if r.get("id") == row.get(many_to_one)]
+        else:
+            back_reference = next(column for (source, column), target in FOREIGN_KEYS.items()
+                                  if source == relation and target == table)
+            candidates = [r for r in self.rows(relation) if r.get(back_reference) == row.get("id")]
+
+        embedded = []
+        for candidate in candidates:
+            if not all(_matches(candidate.get(column), *op) for column, op in own_filters):
+                continue
+            shaped = self._shape(relation, candidate, children, filters, prefix)
+            if shaped is not None:
+                embedded.append(shaped)
+
+        if many_to_one:
+            value = embedded[0] if embedded else None
+            return value, not (inner and value is None)
+        return embedded, not (inner and not embedded)
+
+    def _shape(self, table: str, row: dict, items: List[Tuple], filters, path: str = "") -> Optional[dict]:
+        """Project a row onto the select list; None if an inner embed dropped it"""
+        shaped = {}
+        for item in items:
+            if item[0] == "star":
+                shaped.update(row)
+            elif item[0] == "column":
+                shaped[item[2]] = row.get(item[1])
+            else:
+                value, keep = self._embed(table, row, item, filters, path)
+                if not keep:
+                    return None
+                shaped[item[4]] = value
+        return shaped
+
+    def select(self, table: str, params: List[Tuple[str, str]]) -> List[dict]:
+        select = parse_select(next((value for key, value in params if key == "select"), "*"))
+        filters: Dict[str, List[Tuple[str, str]]] = {}
+        groups = []
+        order, limit, offset = [], None, 0
+        for key, value in params:
+            if key == "select":
+                continue
+            elif key == "order":
+                for term in value.split(","):
+                    column, *modifiers = term.split(".")
+                    order.append((column, "desc" in modifiers))
+            elif key == "limit":
+                limit = int(value)
+            elif key == "offset":
+                offset = int(value)
+            elif key in ("or", "and", "not.or", "not.and"):
+                groups.append(_parse_condition(f"{key}{value}"))
+            else:
+                filters.setdefault(key, []).append(_parse_filter(value))
+
+        top_filters = [(column, op) for column, ops in filters.items() if "." not in column for op in ops]
+        result = []
+        for row in self.rows(table):
+            if not all(_matches(row.get(column), *op) for column, op in top_filters):
+                continue
+            if not all(group(row) for group in groups):
+                continue
+            shaped = self._shape(table, row, select, filters)
+            if shaped is not None:
+                result.append((row, shaped))
+
+        for column, descending in reversed(order):
+            result.sort(key=lambda pair: (pair[0].get(column) is None, str(pair[0].get(column))), reverse=descending)
+        shaped_rows = [shaped for _, shaped in result][offset:]
+        return shaped_rows[:limit] if limit is not None else shaped_rows
+
+    def matching(self, table: str, params: List[Tuple[str, str]]) -> List[dict]:
+        conditions = [(key, _parse_filter(value)) for key, value in params if key not in ("select", "columns")]
+        return [row for row in self.rows(table) if all(_matches(row.get(column), *op) for column, op in conditions)]
+
+    # -- RPC functions (see supabase/migrations) --
+
+    def increment_user_usage(self, p_user_id, p_products=0, p_source_photos=0, p_generated_images=0, p_touch=True):
+        counters = next((row for row in self.tables["user_usage_counters"] if row["user_id"] == p_user_id), None)
+        if counters is None:
+            counters = self.insert("user_usage_counters", {
+                "user_id": p_user_id, "num_products": 0, "num_source_photos": 0,
+                "num_generated_images": 0, "last_activity": None
+            })
+        counters["num_products"] = max(counters["num_products"] + p_products, 0)
+        counters["num_source_photos"] = max(counters["num_source_photos"] + p_source_photos, 0)
+        counters["num_generated_images"] = max(counters["num_generated_images"] + p_generated_images, 0)
+        if p_touch:
+            counters["last_activity"] = now_iso()
+        return None
+
+    def reconcile_user_usage(self, p_user_id=None):
+        users = {row["user_id"] for row in self.tables["user_products"] + self.tables["user_usage_counters"]
+                 if p_user_id is None or row["user_id"] == p_user_id}
+        for user_id in users:
+            product_ids = self._owned_product_ids(user_id)
+            self.tables["user_usage_counters"] = [row for row in self.tables["user_usage_counters"]
+                                                  if row["user_id"] != user_id]
+            self.insert("user_usage_counters", {
+                "user_id": user_id,
+                "num_products": len(product_ids),
+                "num_source_photos": sum(1 for row in self.tables["source_photos"] if row["product_id"] in product_ids),
+                "num_generated_images": sum(1 for row in self.tables["product_photos"] if row["product_id"] in product_ids),
+                "last_activity": now_iso() if product_ids else None
+            })
+        return len(users)
+
+    def create_user_product(self, p_user_id, p_name, p_product_description, p_target_customers):
+        return self.create_user_products(p_user_id, [{
+            "name": p_name, "product_description": p_product_description, "target_customers": p_target_customers
+        }])
+
+    def create_user_products(self, p_user_id, p_products):
+        created = []
+        for product in p_products:
+            row = self.insert("product_descriptions", {
+                "name": product.get("name"),
+                "product_description": product.get("product_description"),
+                "target_customers": product.get("target_customers")
+            })
+            self.insert("user_products", {"user_id": p_user_id, "product_id": row["id"]})
+            created.append(row)
+        self.increment_user_usage(p_user_id, len(created))
+        return created
+
+    def delete_user_product(self, p_user_id, p_product_id):
+        if p_product_id not in self._owned_product_ids(p_user_id):
+            return []
+        product = next((row for row in self.tables["product_descriptions"] if row["id"] == p_product_id), None)
+        if product is None:
+            return []
+        sources = [row for row in self.tables["source_photos"] if row["product_id"] == p_product_id]
+        generated = [row for row in self.tables["product_photos"] if row["product_id"] == p_product_id]
+        for table in ("source_photos", "product_photos", "user_products"):
+            self.tables[table] = [row for row in self.tables[table] if row["product_id"] != p_product_id]
+        self.tables["product_descriptions"].remove(product)
+        self.increment_user_usage(p_user_id, -1, -len(sources), -len(generated), False)
+        return [product]
+
+    def update_owned_photos(self, p_user_id, p_updates):
+        owned = self._owned_product_ids(p_user_id)
+        updates = {update["photo_id"]: update for update in p_updates}
+        updated = []
+        for row in self.tables["product_photos"]:
+            update = updates.get(row["id"])
+            if update is None or row["product_id"] not in owned:
+                continue
+            if update.get("rating") is not None:
+                row["user_rating"] = update["rating"]
+            if update.get("caption") is not None:
+                row["caption"] = update["caption"]
+            updated.append(row)
+        return updated
+
+    def update_owned_photo(self, p_user_id, p_photo_id, p_user_rating=None, p_caption=None):
+        return self.update_owned_photos(p_user_id, [{"photo_id": p_photo_id, "rating": p_user_rating, "caption": p_caption}])
+
+    def _tokens(self, user_id) -> Optional[dict]:
+        return next((row for row in self.tables["user_tokens"] if row["user_id"] == user_id), None)
+
+    def reserve_tokens(self, p_user_id, p_amount=1, p_hold="1 hour"):
+        tokens = self._tokens(p_user_id)
+        if tokens is None:
+            return [{"reservation_id": None, "token_balance": None}]
+        if tokens["token_balance"] < p_amount:
+            return [{"reservation_id": None, "token_balance": tokens["token_balance"]}]
+        tokens["token_balance"] -= p_amount
+        value, unit = re.match(r"([\d.]+)\s*(\w+)", p_hold).groups()
+        expires_at = datetime.now(timezone.utc) + timedelta(**{unit.rstrip("s") + "s": float(value)})
+        reservation = self.insert("token_reservations", {
+            "user_id": p_user_id, "amount": p_amount, "status": "reserved", "expires_at": expires_at.isoformat()
+        })
+        return [{"reservation_id": reservation["id"], "token_balance": tokens["token_balance"]}]
+
+    def _reservation(self, reservation_id) -> Optional[dict]:
+        return next((row for row in self.tables["token_reservations"] if row["id"] == reservation_id), None)
+
+    def commit_token_reservation(self, p_reservation_id, p_amount=None):
+        reservation = self._reservation(p_reservation_id)
+        if reservation is None:
+            return None
+        tokens = self._tokens(reservation["user_id"])
+        if reservation["status"] == "reserved":
+            spent = min(reservation["amount"], max(reservation["amount"] if p_amount is None else p_amount, 0))
+            tokens["token_balance"] += reservation["amount"] - spent
+            reservation["status"] = "committed" if spent else "released"
+            reservation["amount"] = spent or reservation["amount"]
+        return tokens["token_balance"]
+
+    def release_token_reservation(self, p_reservation_id):
+        reservation = self._reservation(p_reservation_id)
+        if reservation is None:
+            return None
+        tokens = self._tokens(reservation["user_id"])
+        if reservation["status"] == "reserved":
+            reservation["status"] = "released"
+            tokens["token_balance"] += reservation["amount"]
+        return tokens["token_balance"]
+
+    def release_stale_token_reservations(self):
+        now = datetime.now(timezone.utc).isoformat()
+        released = 0
+        for reservation in self.tables["token_reservations"]:
+            if reservation["status"] == "reserved" and reservation["expires_at"] < now:
+                reservation["status"] = "released"
+                self._tokens(reservation["user_id"])["token_balance"] += reservation["amount"]
+                released += 1
+        return released
+
+    def consume_tokens(self, p_user_id, p_amount=1):
+        tokens = self._tokens(p_user_id)
+        if tokens is None:
+            return None
+        tokens["token_balance"] = max(tokens["token_balance"] - p_amount, 0)
+        return tokens["token_balance"]
+
+    RPC_FUNCTIONS = {
+        "increment_user_usage", "reconcile_user_usage", "create_user_product", "create_user_products",
+        "delete_user_product", "update_owned_photo", "update_owned_photos", "reserve_tokens",
+        "commit_token_reservation", "release_token_reservation", "release_stale_token_reservations",
+        "consume_tokens",
+    }
+
+    # -- seeding --
+
+    def add_user(self, index: int, token_balance: int = 1_000_000, plan: str = "free") -> str:
+        user_id = user_id_for(index)
+        self.users[user_id] = {
+            "id": user_id,
+            "aud": "authenticated",
+            "role": "authenticated",
+            "email": f"user{index}@example.com",
+            "phone": "",
+            "app_metadata": {"provider": "email"},
+            "user_metadata": {"full_name": f"User {index}"},
+            "identities": [],
+            "created_at": now_iso(),
+            "updated_at": now_iso(),
+        }
+        self.insert("user_tokens", {"user_id": user_id, "token_balance": token_balance, "plan": plan})
+        return user_id
+
+    def seed(self, users: int, heavy_users: int = 0, heavy_products: int = 200, photos_per_product: int = 8,
+             bucket: str = "fotnik-bench") -> None:
+        """Create `users` users; the first `heavy_users` own many products with photos"""
+        started = datetime.now(timezone.utc) - timedelta(days=30)
+        for index in range(users):
+            # Heavy users are on a paid plan, so scheduler weights show up in benchmarks
+            user_id = self.add_user(index, plan="pro" if index < heavy_users else "free")
+            products = heavy_products if index < heavy_users else 3
+            for product_index in range(products):
+                created_at = (started + timedelta(minutes=product_index)).isoformat()
+                product = self.insert("product_descriptions", {
+                    "name": f"Product {product_index}",
+                    "product_description": "A ceramic mug with a matte glaze",
+                    "target_customers": "Coffee lovers",
+                    "created_at": created_at,
+                })
+                self.insert("user_products", {"user_id": user_id, "product_id": product["id"], "created_at": created_at})
+                for photo_index in range(photos_per_product if index < heavy_users else 1):
+                    key = f"products/{product['id']}/generated_seed_{photo_index}.jpg"
+                    self.insert("product_photos", {
+                        "product_id": product["id"],
+                        "image_url": f"https://{bucket}.s3.amazonaws.com/{key}",
+                        "source_image_url": f"https://{bucket}.s3.amazonaws.com/products/{product['id']}/source.jpg",
+                        "created_at": (started + timedelta(minutes=product_index, seconds=photo_index)).isoformat(),
+                    })
+                self.insert("source_photos", {
+                    "product_id": product["id"],
+                    "original_photo_url": f"https://{bucket}.s3.amazonaws.com/products/{product['id']}/original.jpg",
+                    "edited_photo_url": f"https://{bucket}.s3.amazonaws.com/products/{product['id']}/edited.jpg",
+                    "created_at": created_at,
+                })
+        self.reconcile_user_usage()
+
+
+def create_app(db: FakeDatabase, latency: Optional[LatencyModel] = None) -> FastAPI:
+    latency = latency or LatencyModel()
+    app = FastAPI()
+
+    def error(status: int, message: str) -> JSONResponse:
+        return JSONResponse(status_code=status, content={"code": "PGRST000", "message": message, "details": None, "hint": None})
+
+    @app.get("/auth/v1/user")
+    async def get_user(request: Request):
+        await latency.wait()
+        claims = _decode_jwt(request.headers.get("authorization", "").replace("Bearer ", ""))
+        user = db.users.get((claims or {}).get("sub"))
+        if user is None:
+            return JSONResponse(status_code=401, content={"code": 401, "msg": "invalid JWT"})
+        return user
+
+    @app.post("/auth/v1/token")
+    async def refresh_token(request: Request):
+        body = await request.json()
+        user_id = (body.get("refresh_token") or "").removeprefix("refresh-")
+        user = db.users.get(user_id)
+        if user is None:
+            return JSONResponse(status_code=400, content={"code": 400, "msg": "invalid refresh token"})
+        return {
+            "access_token": token_for(user_id), "refresh_token": f"refresh-{user_id}",
+            "token_type": "bearer", "expires_in": 3600, "expires_at": 4102444800, "user": user
+        }
+
+    @app.post("/rest/v1/rpc/{function}")
+    async def rpc(function: str, request: Request):
+        await latency.wait()
+        if latency.fails():
+            return error(503, "fake database failure")
+        if function not in FakeDatabase.RPC_FUNCTIONS:
+            return error(404, f"Could not find the function public.{function}")
+        body = await request.body()
+        result = getattr(db, function)(**(json.loads(body) if body else {}))
+        return Response(content=json.dumps(result), media_type="application/json")
+
+    @app.get("/rest/v1/{table}")
+    async def select(table: str, request: Request):
+        await latency.wait()
+        if latency.fails():
+            return error(503, "fake database failure")
+        try:
+            return db.select(table, list(request.query_params.multi_items()))
+        except KeyError as e:
+            return error(404, str(e))
+
+    @app.post("/rest/v1/{table}")
+    async def insert(table: str, request: Request):
+        await latency.wait()
+        if latency.fails():
+            return error(503, "fake database failure")
+        body = await request.json()
+        rows = [db.insert(table, row) for row in (body if isinstance(body, list) else [body])]
+        return JSONResponse(status_code=201, content=rows)
+
+    @app.patch("/rest/v1/{table}")
+    async def update(table: str, request: Request):
+        await latency.wait()
+        if latency.fails():
+            return error(503, "fake database failure")
+        changes = await request.json()
+        rows = db.matching(table, list(request.query_params.multi_items()))
+        for row in rows:
+            row.update(changes)
+            if "updated_at" in row:
+                row["updated_at"] = now_iso()
+        return rows
+
+    @app.delete("/rest/v1/{table}")
+    async def delete(table: str, request: Request):
+        await latency.wait()
+        rows = db.matching(table, list(request.query_params.multi_items()))
+        db.tables[table] = [row for row in db.tables[table] if row not in rows]
+        return rows
+
+    return app
@@ -0,0 +1,24 @@
+"""
+Throwaway self-signed certificate for the Replicate fake. The Replicate SDK
+only turns https:// outputs into FileOutput objects, so that fake has to
+speak TLS; the app trusts the certificate through SSL_CERT_FILE.
+"""
+import os
+import subprocess
+import tempfile
+from typing import Tuple
+
+
+def self_signed_cert(host: str) -> Tuple[str, str]:
+    """Create a certificate for `host` with the openssl CLI and return (certfile, keyfile)"""
+    directory = tempfile.mkdtemp(prefix="fotnik-fakes-tls-")
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    san = f"IP:{host}" if host.replace(".", "").isdigit() else f"DNS:{host}"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "2",
+         "-subj", f"/CN={host}", "-addext", f"subjectAltName={san}",
+         "-keyout", keyfile, "-out", certfile],
+        check=True, capture_output=True,
+    )
+    return certfile, keyfile
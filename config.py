@@ -1,11 +1,9 @@
 import os
 from dotenv import load_dotenv
 
-# the cwd is the same folder as the current file; make sure to run the file from the backend folder
-# get the folder of the current file
+# resolve env files relative to this file so the process cwd doesn't matter
 current_file_path = os.path.abspath(__file__)
 current_file_dir = os.path.dirname(current_file_path)
-os.chdir(current_file_dir)
 
 # Load environment variables based on environment
 env = os.getenv("ENVIRONMENT", "development")
@@ -13,8 +11,8 @@ env_file = f"{current_file_dir}/.env.{env}"
 
 if os.path.exists(env_file):
     load_dotenv(env_file)
-elif os.path.exists(".env"):
-    load_dotenv(".env")
+elif os.path.exists(f"{current_file_dir}/.env"):
+    load_dotenv(f"{current_file_dir}/.env")
 
 # Configuration class
 class Settings:
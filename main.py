@@ -1,9 +1,11 @@
 import sys
 import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
 import config
 
 # Add the backend directory to Python path
@@ -15,11 +17,51 @@ from app.websockets.routes import router as websocket_router
 from app.auth.routes import router as auth_router
 from app.product.routes import router as product_router
 from app.stats.routes import router as stats_router
+from app.monitoring.routes import router as monitoring_router
+from app.image_processing.routes import router as webhook_router
+from app.core.responses import CompressionMiddleware
+from app.core.cache import response_cache
+from app.core.clients import close_clients, warm_clients
+from app.core.draining import generation_jobs
+from app.core.metrics import MetricsMiddleware
+from app.core.diagnostics import ProfilerMiddleware, loop_monitor
+from app.image_processing.background_removal import background_remover
+
+logger = logging.getLogger(__name__)
+
+def _log_warm_up_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception():
+        logger.error(f"Warm-up failed: {str(task.exception())}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # SDK clients are built on first use; optionally build them in the background
+    # right after startup so health checks are served before they are ready
+    if os.getenv("WARM_CLIENTS", "false").lower() == "true":
+        warm_task = asyncio.create_task(asyncio.to_thread(warm_clients))
+        warm_task.add_done_callback(_log_warm_up_failure)
+    # Loads the local background removal model in its workers; a no-op for remote backends
+    remover_task = asyncio.create_task(background_remover.start())
+    remover_task.add_done_callback(_log_warm_up_failure)
+    if os.getenv("LOOP_LAG_MONITOR", "true").lower() == "true":
+        loop_monitor.start()
+    if response_cache.backend is None:
+        logger.warning(
+            "Response cache is off: several workers are running and RESPONSE_CACHE_URL is not set. "
+            "Set it to a Redis URL to cache product, photo and stats reads."
+        )
+    yield
+    loop_monitor.stop()
+    # Under serve.py jobs are drained before connections close; this covers plain uvicorn
+    await generation_jobs.drain()
+    await close_clients()
+    await background_remover.close()
 
 app = FastAPI(
     title="Fotnik API",
     description="Backend API for Fotnik application",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -29,13 +71,29 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Compress large JSON/NDJSON responses; image bodies are already compressed
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+    excluded_paths=[r"^/products/image-proxy$", r"/export\.zip$"],
+)
+
+# Samples requests that carry X-Profile-Token, or PROFILE_SAMPLE_RATE of all requests
+app.add_middleware(ProfilerMiddleware)
+
+# Outermost, so latency includes compression and CORS handling
+app.add_middleware(MetricsMiddleware)
+
 # Include WebSocket routes
 app.include_router(websocket_router)
 app.include_router(auth_router)
 app.include_router(product_router)
 app.include_router(stats_router)
+app.include_router(monitoring_router)
+app.include_router(webhook_router)
 
 # Root endpoint for health check
 @app.get("/")
@@ -43,4 +101,6 @@ async def root():
     return {"status": "healthy", "message": "Fotnik API is running"}
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run("main:app", host="0.0.0.0", port=8010, reload=True) 
\ No newline at end of file
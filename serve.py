@@ -0,0 +1,147 @@
+"""
+Production entrypoint.
+
+    python serve.py
+
+Runs WEB_CONCURRENCY uvicorn workers (default: one per available CPU)
+sharing a single listening socket, on uvloop and httptools when they are
+installed. On SIGTERM each worker stops listening, refuses new generation
+jobs and waits up to DRAIN_TIMEOUT seconds for running ones while their
+websockets are still open to receive the result, then shuts down.
+Crashed workers are restarted, and share Prometheus metrics through
+PROMETHEUS_MULTIPROC_DIR (a temporary directory unless set). `python main.py` remains the development
+server with auto-reload.
+"""
+from typing import List, Optional
+import glob
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import uvicorn
+
+from app.core.draining import DRAIN_TIMEOUT, generation_jobs
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that lets in-flight generations finish before closing connections"""
+
+    async def shutdown(self, sockets: Optional[List[socket.socket]] = None) -> None:
+        # Stop taking connections first so the load balancer moves new clients elsewhere
+        for server in self.servers:
+            server.close()
+        for sock in sockets or []:
+            sock.close()
+        if not self.force_exit:
+            await generation_jobs.drain(DRAIN_TIMEOUT)
+        await super().shutdown(sockets=sockets)
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def build_config() -> uvicorn.Config:
+    return uvicorn.Config(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8010")),
+        # "auto" picks uvloop and httptools when installed
+        loop="auto",
+        http="auto",
+        backlog=int(os.getenv("BACKLOG", "2048")),
+        # Longer than the load balancer's idle timeout, so it never reuses a connection we closed
+        timeout_keep_alive=int(os.getenv("KEEP_ALIVE_TIMEOUT", "75")),
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "30")),
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        access_log=os.getenv("ACCESS_LOG", "false").lower() == "true",
+        log_level=os.getenv("LOG_LEVEL", "info"),
+    )
+
+
+def run_worker(config: uvicorn.Config, sockets: List[socket.socket]) -> None:
+    config.configure_logging()
+    try:
+        DrainingServer(config).run(sockets=sockets)
+    except KeyboardInterrupt:
+        pass
+
+
+def prepare_metrics_dir() -> str:
+    """Give the workers a fresh directory to share Prometheus metrics through"""
+    metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR") or tempfile.mkdtemp(prefix="fotnik-metrics-")
+    os.makedirs(metrics_dir, exist_ok=True)
+    # Values left by a previous run would otherwise be added to this one's
+    for stale in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.remove(stale)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+    return metrics_dir
+
+
+def supervise(config: uvicorn.Config, workers: int) -> None:
+    """Run workers on a shared socket, restarting any that die, until SIGTERM or SIGINT"""
+    from prometheus_client import multiprocess
+
+    # Workers are spawned, so they inherit the directory through the environment
+    prepare_metrics_dir()
+    # Tells the workers' per-process caches that other workers exist (see app.core.cache.local_cache_ttl)
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    sock = config.bind_socket()
+    context = multiprocessing.get_context("spawn")
+    processes: List[multiprocessing.Process] = []
+    stopping = False
+
+    def spawn() -> multiprocessing.Process:
+        process = context.Process(target=run_worker, args=(config, [sock]))
+        process.start()
+        return process
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info(f"Starting {workers} workers on {config.host}:{config.port}")
+    processes.extend(spawn() for _ in range(workers))
+
+    while not stopping:
+        for index, process in enumerate(processes):
+            if not process.is_alive() and not stopping:
+                logger.warning(f"Worker {process.pid} exited with code {process.exitcode}, restarting")
+                multiprocess.mark_process_dead(process.pid)
+                processes[index] = spawn()
+        time.sleep(1)
+
+    for process in processes:
+        process.join()
+        multiprocess.mark_process_dead(process.pid)
+    sock.close()
+
+
+def main() -> None:
+    config = build_config()
+    workers = int(os.getenv("WEB_CONCURRENCY", str(available_cpus())))
+    if workers <= 1:
+        DrainingServer(config).run()
+    else:
+        supervise(config, workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+-- Per-user usage counters maintained at write time by the API.
+-- /stats/user reads a single row from user_stats instead of recounting
+-- every product, source photo and generated image on each dashboard load.
+
+create table if not exists public.user_usage_counters (
+    user_id uuid primary key,
+    num_products integer not null default 0,
+    num_source_photos integer not null default 0,
+    num_generated_images integer not null default 0,
+    last_activity timestamptz,
+    updated_at timestamptz not null default now()
+);
+
+-- Apply signed deltas to a user's counters, creating the row on first use.
+create or replace function public.increment_user_usage(
+    p_user_id uuid,
+    p_products integer default 0,
+    p_source_photos integer default 0,
+    p_generated_images integer default 0,
+    p_touch boolean default true
+) returns void
+language sql
+as $$
+    insert into public.user_usage_counters as c (
+        user_id, num_products, num_source_photos, num_generated_images, last_activity
+    )
+    values (
+        p_user_id,
+        greatest(p_products, 0),
+        greatest(p_source_photos, 0),
+        greatest(p_generated_images, 0),
+        case when p_touch then now() end
+    )
+    on conflict (user_id) do update set
+        num_products = greatest(c.num_products + p_products, 0),
+        num_source_photos = greatest(c.num_source_photos + p_source_photos, 0),
+        num_generated_images = greatest(c.num_generated_images + p_generated_images, 0),
+        last_activity = case when p_touch then now() else c.last_activity end,
+        updated_at = now();
+$$;
+
+-- Recompute counters from the source tables to repair drift.
+-- Pass a user id to repair one user, or null to repair everyone.
+create or replace function public.reconcile_user_usage(p_user_id uuid default null)
+returns integer
+language sql
+as $$
+    -- A requested user always gets a row, even with nothing to count yet
+    with users as (
+        select p_user_id as user_id where p_user_id is not null
+        union
+        select user_id from public.user_products
+        where p_user_id is null or user_id = p_user_id
+        union
+        select user_id from public.user_tokens
+        where p_user_id is null or user_id = p_user_id
+        union
+        select user_id from public.user_usage_counters
+        where p_user_id is null or user_id = p_user_id
+    ),
+    products as (
+        select up.user_id, count(*) as n, max(greatest(up.created_at, up.updated_at)) as last_at
+        from public.user_products up
+        join users u using (user_id)
+        group by up.user_id
+    ),
+    sources as (
+        select up.user_id, count(sp.id) as n, max(sp.created_at) as last_at
+        from public.user_products up
+        join users u using (user_id)
+        join public.source_photos sp on sp.product_id = up.product_id
+        group by up.user_id
+    ),
+    generated as (
+        select up.user_id, count(pp.id) as n, max(pp.created_at) as last_at
+        from public.user_products up
+        join users u using (user_id)
+        join public.product_photos pp on pp.product_id = up.product_id
+        group by up.user_id
+    ),
+    upserted as (
+        insert into public.user_usage_counters as c (
+            user_id, num_products, num_source_photos, num_generated_images, last_activity, updated_at
+        )
+        select
+            u.user_id,
+            coalesce(p.n, 0),
+            coalesce(s.n, 0),
+            coalesce(g.n, 0),
+            greatest(p.last_at, s.last_at, g.last_at),
+            now()
+        from users u
+        left join products p using (user_id)
+        left join sources s using (user_id)
+        left join generated g using (user_id)
+        on conflict (user_id) do update set
+            num_products = excluded.num_products,
+            num_source_photos = excluded.num_source_photos,
+            num_generated_images = excluded.num_generated_images,
+            last_activity = excluded.last_activity,
+            updated_at = excluded.updated_at
+        returning 1
+    )
+    select count(*)::integer from upserted;
+$$;
+
+-- One row per user with everything the dashboard header needs. Driven from
+-- the counters, which every user gets, so a user without a user_tokens row
+-- still has stats.
+create or replace view public.user_stats
+with (security_invoker = true) as
+select
+    c.user_id,
+    t.token_balance,
+    c.num_products,
+    c.num_source_photos,
+    c.num_generated_images,
+    c.last_activity
+from public.user_usage_counters c
+left join public.user_tokens t on t.user_id = c.user_id;
+
+-- These functions trust the p_user_id they are given, so only the API's
+-- service role may call them; clients must not reach them through PostgREST.
+revoke execute on function public.increment_user_usage(uuid, integer, integer, integer, boolean) from public, anon, authenticated;
+revoke execute on function public.reconcile_user_usage(uuid) from public, anon, authenticated;
+
+-- Backfill counters for existing users.
+select public.reconcile_user_usage();
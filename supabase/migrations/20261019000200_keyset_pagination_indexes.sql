@@ -0,0 +1,12 @@
+-- Indexes backing newest-first keyset pagination on (created_at, id)
+-- for the product and image listing endpoints.
+
+create index if not exists user_products_user_created_idx
+    on public.user_products (user_id, created_at desc, product_id desc);
+
+create index if not exists product_photos_product_created_idx
+    on public.product_photos (product_id, created_at desc, id desc);
+
+create index if not exists source_photos_product_created_idx
+    on public.source_photos (product_id, created_at desc, id desc)
+    where edited_photo_url is not null;
@@ -0,0 +1,87 @@
+-- Database functions that let product handlers finish in one PostgREST
+-- round trip with ownership enforced in the same statement.
+
+-- Create a product, link it to the user and count it, atomically.
+create or replace function public.create_user_product(
+    p_user_id uuid,
+    p_name text,
+    p_product_description text,
+    p_target_customers text
+) returns setof public.product_descriptions
+language plpgsql
+as $$
+declare
+    v_product public.product_descriptions;
+begin
+    insert into public.product_descriptions (name, product_description, target_customers)
+    values (p_name, p_product_description, p_target_customers)
+    returning * into v_product;
+
+    insert into public.user_products (user_id, product_id)
+    values (p_user_id, v_product.id);
+
+    perform public.increment_user_usage(p_user_id, 1);
+    return next v_product;
+end;
+$$;
+
+-- Delete a product the user owns and remove its photos from the counters.
+-- Returns no rows when the product does not exist or belongs to someone else.
+create or replace function public.delete_user_product(
+    p_user_id uuid,
+    p_product_id uuid
+) returns setof public.product_descriptions
+language plpgsql
+as $$
+declare
+    v_source_photos integer;
+    v_generated_images integer;
+    v_product public.product_descriptions;
+begin
+    if not exists (
+        select 1 from public.user_products
+        where user_id = p_user_id and product_id = p_product_id
+    ) then
+        return;
+    end if;
+
+    select count(*) into v_source_photos from public.source_photos where product_id = p_product_id;
+    select count(*) into v_generated_images from public.product_photos where product_id = p_product_id;
+
+    delete from public.product_descriptions where id = p_product_id
+    returning * into v_product;
+    if v_product.id is null then
+        return;
+    end if;
+
+    perform public.increment_user_usage(p_user_id, -1, -v_source_photos, -v_generated_images, false);
+    return next v_product;
+end;
+$$;
+
+-- Update rating and/or caption of a photo the user owns; null leaves a value unchanged.
+-- Returns no rows when the photo does not exist or belongs to someone else.
+create or replace function public.update_owned_photo(
+    p_user_id uuid,
+    p_photo_id uuid,
+    p_user_rating integer default null,
+    p_caption text default null
+) returns setof public.product_photos
+language sql
+as $$
+    update public.product_photos pp set
+        user_rating = coalesce(p_user_rating, pp.user_rating),
+        caption = coalesce(p_caption, pp.caption)
+    where pp.id = p_photo_id
+      and exists (
+          select 1 from public.user_products up
+          where up.user_id = p_user_id and up.product_id = pp.product_id
+      )
+    returning pp.*;
+$$;
+
+-- These functions trust the p_user_id they are given, so only the API's
+-- service role may call them; clients must not reach them through PostgREST.
+revoke execute on function public.create_user_product(uuid, text, text, text) from public, anon, authenticated;
+revoke execute on function public.delete_user_product(uuid, uuid) from public, anon, authenticated;
+revoke execute on function public.update_owned_photo(uuid, uuid, integer, text) from public, anon, authenticated;
@@ -0,0 +1,142 @@
+-- Atomic token ledger. A generation reserves its tokens up front with a
+-- single conditional UPDATE, then commits the reservation on success or
+-- releases it (refunding the tokens) on failure. Each reservation records
+-- how long the job holding it may run; only after that is it treated as
+-- abandoned and refunded by release_stale_token_reservations.
+
+create table if not exists public.token_reservations (
+    id uuid primary key default gen_random_uuid(),
+    user_id uuid not null,
+    amount integer not null check (amount > 0),
+    status text not null default 'reserved'
+        check (status in ('reserved', 'committed', 'released')),
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now(),
+    expires_at timestamptz not null
+);
+
+create index if not exists token_reservations_reserved_idx
+    on public.token_reservations (expires_at)
+    where status = 'reserved';
+
+-- Take p_amount tokens if the balance allows it, for at most p_hold.
+-- reservation_id is null when refused; token_balance is then the current
+-- balance, or null when the user has no token allocation at all.
+create or replace function public.reserve_tokens(
+    p_user_id uuid,
+    p_amount integer default 1,
+    p_hold interval default interval '1 hour'
+) returns table (reservation_id uuid, token_balance integer)
+language plpgsql
+as $$
+declare
+    v_balance integer;
+    v_reservation_id uuid;
+begin
+    update public.user_tokens t
+    set token_balance = t.token_balance - p_amount
+    where t.user_id = p_user_id and t.token_balance >= p_amount
+    returning t.token_balance into v_balance;
+
+    if not found then
+        select t.token_balance into v_balance
+        from public.user_tokens t where t.user_id = p_user_id;
+        return query select null::uuid, v_balance;
+        return;
+    end if;
+
+    insert into public.token_reservations (user_id, amount, expires_at)
+    values (p_user_id, p_amount, now() + p_hold)
+    returning id into v_reservation_id;
+
+    return query select v_reservation_id, v_balance;
+end;
+$$;
+
+-- Mark a reservation as spent. Returns the user's balance.
+create or replace function public.commit_token_reservation(p_reservation_id uuid)
+returns integer
+language sql
+as $$
+    with committed as (
+        update public.token_reservations
+        set status = 'committed', updated_at = now()
+        where id = p_reservation_id and status = 'reserved'
+        returning user_id
+    )
+    select t.token_balance
+    from public.user_tokens t
+    join public.token_reservations r on r.user_id = t.user_id
+    where r.id = p_reservation_id;
+$$;
+
+-- Refund a reservation that was not used. Idempotent; returns the user's balance.
+create or replace function public.release_token_reservation(p_reservation_id uuid)
+returns integer
+language sql
+as $$
+    with released as (
+        update public.token_reservations
+        set status = 'released', updated_at = now()
+        where id = p_reservation_id and status = 'reserved'
+        returning user_id, amount
+    ),
+    refunded as (
+        update public.user_tokens t
+        set token_balance = t.token_balance + released.amount
+        from released
+        where t.user_id = released.user_id
+        returning t.token_balance
+    )
+    select coalesce(
+        (select token_balance from refunded),
+        (select t.token_balance from public.user_tokens t
+         join public.token_reservations r on r.user_id = t.user_id
+         where r.id = p_reservation_id)
+    );
+$$;
+
+-- Refund reservations abandoned by a crashed worker, i.e. held past their expiry.
+create or replace function public.release_stale_token_reservations()
+returns integer
+language sql
+as $$
+    with released as (
+        update public.token_reservations
+        set status = 'released', updated_at = now()
+        where status = 'reserved' and expires_at < now()
+        returning user_id, amount
+    ),
+    per_user as (
+        select user_id, sum(amount)::integer as amount from released group by user_id
+    ),
+    refunded as (
+        update public.user_tokens t
+        set token_balance = t.token_balance + per_user.amount
+        from per_user
+        where t.user_id = per_user.user_id
+        returning 1
+    )
+    select count(*)::integer from released;
+$$;
+
+-- Atomic, floor-at-zero deduction for callers that charge after the fact.
+create or replace function public.consume_tokens(
+    p_user_id uuid,
+    p_amount integer default 1
+) returns integer
+language sql
+as $$
+    update public.user_tokens
+    set token_balance = greatest(token_balance - p_amount, 0)
+    where user_id = p_user_id
+    returning token_balance;
+$$;
+
+-- These functions trust the p_user_id they are given, so only the API's
+-- service role may call them; clients must not reach them through PostgREST.
+revoke execute on function public.reserve_tokens(uuid, integer, interval) from public, anon, authenticated;
+revoke execute on function public.commit_token_reservation(uuid) from public, anon, authenticated;
+revoke execute on function public.release_token_reservation(uuid) from public, anon, authenticated;
+revoke execute on function public.release_stale_token_reservations() from public, anon, authenticated;
+revoke execute on function public.consume_tokens(uuid, integer) from public, anon, authenticated;
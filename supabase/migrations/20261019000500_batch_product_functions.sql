@@ -0,0 +1,55 @@
+-- Set-based variants of the product and photo write functions used by
+-- the batch endpoints. Ownership is checked once per statement.
+
+-- Create several products for a user, link and count them atomically.
+create or replace function public.create_user_products(
+    p_user_id uuid,
+    p_products jsonb
+) returns setof public.product_descriptions
+language plpgsql
+as $$
+declare
+    v_count integer;
+begin
+    return query
+    with created as (
+        insert into public.product_descriptions (name, product_description, target_customers)
+        select p.name, p.product_description, p.target_customers
+        from jsonb_to_recordset(p_products) as p(name text, product_description text, target_customers text)
+        returning *
+    ),
+    linked as (
+        insert into public.user_products (user_id, product_id)
+        select p_user_id, created.id from created
+        returning product_id
+    )
+    select created.* from created;
+
+    get diagnostics v_count = row_count;
+    perform public.increment_user_usage(p_user_id, v_count);
+end;
+$$;
+
+-- Apply rating and/or caption updates to many photos the user owns.
+-- p_updates is an array of {photo_id, rating, caption}; null leaves a value unchanged.
+-- Photos that do not exist or belong to someone else are skipped.
+create or replace function public.update_owned_photos(
+    p_user_id uuid,
+    p_updates jsonb
+) returns setof public.product_photos
+language sql
+as $$
+    update public.product_photos pp set
+        user_rating = coalesce(u.rating, pp.user_rating),
+        caption = coalesce(u.caption, pp.caption)
+    from jsonb_to_recordset(p_updates) as u(photo_id uuid, rating integer, caption text)
+    where pp.id = u.photo_id
+      and exists (
+          select 1 from public.user_products up
+          where up.user_id = p_user_id and up.product_id = pp.product_id
+      )
+    returning pp.*;
+$$;
+
+revoke execute on function public.create_user_products(uuid, jsonb) from public, anon, authenticated;
+revoke execute on function public.update_owned_photos(uuid, jsonb) from public, anon, authenticated;
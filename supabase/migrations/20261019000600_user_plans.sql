@@ -0,0 +1,5 @@
+-- Subscription plan per user, read by the generation scheduler to give
+-- paid plans a larger share of generation capacity (PLAN_WEIGHTS).
+
+alter table public.user_tokens
+    add column if not exists plan text not null default 'free';
@@ -0,0 +1,52 @@
+-- Let a generation that stored only some of its images pay for those alone.
+-- commit_token_reservation takes the number of tokens actually spent and
+-- refunds the rest of the reservation in the same transaction. Without
+-- p_amount the whole reservation is committed, as before.
+
+drop function if exists public.commit_token_reservation(uuid);
+
+-- Mark p_amount (default: all) of a reservation as spent and refund the rest.
+-- Committing nothing releases the reservation. Returns the user's balance.
+create or replace function public.commit_token_reservation(
+    p_reservation_id uuid,
+    p_amount integer default null
+) returns integer
+language plpgsql
+as $$
+declare
+    v_user_id uuid;
+    v_amount integer;
+    v_spent integer;
+    v_balance integer;
+begin
+    select r.user_id, r.amount into v_user_id, v_amount
+    from public.token_reservations r
+    where r.id = p_reservation_id and r.status = 'reserved'
+    for update;
+
+    if found then
+        v_spent := least(v_amount, greatest(coalesce(p_amount, v_amount), 0));
+
+        update public.token_reservations
+        set status = case when v_spent > 0 then 'committed' else 'released' end,
+            amount = case when v_spent > 0 then v_spent else amount end,
+            updated_at = now()
+        where id = p_reservation_id;
+
+        if v_spent < v_amount then
+            update public.user_tokens
+            set token_balance = token_balance + (v_amount - v_spent)
+            where user_id = v_user_id;
+        end if;
+    end if;
+
+    select t.token_balance into v_balance
+    from public.user_tokens t
+    join public.token_reservations r on r.user_id = t.user_id
+    where r.id = p_reservation_id;
+
+    return v_balance;
+end;
+$$;
+
+revoke execute on function public.commit_token_reservation(uuid, integer) from public, anon, authenticated;
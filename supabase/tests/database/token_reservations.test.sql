@@ -0,0 +1,93 @@
+-- Token ledger: reserve, commit, release and the stale-reservation sweep.
+-- Run with `supabase test db`.
+begin;
+select plan(20);
+
+insert into public.user_tokens (user_id, token_balance) values
+    ('00000000-0000-0000-0000-0000000000a1', 5),
+    ('00000000-0000-0000-0000-0000000000a2', 1);
+
+create temporary table held as
+select * from public.reserve_tokens('00000000-0000-0000-0000-0000000000a1', 2, interval '30 minutes');
+
+select ok((select reservation_id is not null from held), 'reserving within the balance returns a reservation');
+select is((select token_balance from held), 3, 'reserving deducts the amount');
+select is(
+    (select expires_at from public.token_reservations where id = (select reservation_id from held)),
+    now() + interval '30 minutes',
+    'the reservation expires after its hold'
+);
+
+select is(
+    (select reservation_id from public.reserve_tokens('00000000-0000-0000-0000-0000000000a2', 2)),
+    null,
+    'reserving more than the balance is refused'
+);
+select is(
+    (select token_balance from public.user_tokens where user_id = '00000000-0000-0000-0000-0000000000a2'),
+    1,
+    'a refused reservation leaves the balance alone'
+);
+select is(
+    (select token_balance from public.reserve_tokens('00000000-0000-0000-0000-0000000000a9', 1)),
+    null,
+    'a user without an allocation gets a null balance'
+);
+
+select is(public.commit_token_reservation((select reservation_id from held)), 3, 'commit returns the balance');
+select is(public.release_token_reservation((select reservation_id from held)), 3, 'a committed reservation is not refunded');
+
+create temporary table released as
+select * from public.reserve_tokens('00000000-0000-0000-0000-0000000000a1', 1);
+select is(public.release_token_reservation((select reservation_id from released)), 3, 'release refunds the amount');
+select is(public.release_token_reservation((select reservation_id from released)), 3, 'releasing twice refunds once');
+
+-- One reservation still within its hold, one past it
+create temporary table live as
+select * from public.reserve_tokens('00000000-0000-0000-0000-0000000000a1', 1, interval '2 hours');
+create temporary table abandoned as
+select * from public.reserve_tokens('00000000-0000-0000-0000-0000000000a1', 1, interval '-1 second');
+
+select is(public.release_stale_token_reservations(), 1, 'the sweep releases only expired reservations');
+select is(
+    (select status from public.token_reservations where id = (select reservation_id from live)),
+    'reserved',
+    'a reservation within its hold survives the sweep'
+);
+select is(
+    (select token_balance from public.user_tokens where user_id = '00000000-0000-0000-0000-0000000000a1'),
+    2,
+    'the sweep refunds the expired reservation'
+);
+select is(public.commit_token_reservation((select reservation_id from abandoned)), 2, 'committing a swept reservation charges nothing');
+
+-- A generation that stored 1 of the 2 tokens' worth of images it reserved
+create temporary table partial as
+select * from public.reserve_tokens('00000000-0000-0000-0000-0000000000a1', 2);
+select is(public.commit_token_reservation((select reservation_id from partial), 1), 1, 'a partial commit refunds the rest');
+select is(
+    (select amount from public.token_reservations where id = (select reservation_id from partial)),
+    1,
+    'a partial commit records what was spent'
+);
+
+create temporary table unused as
+select * from public.reserve_tokens('00000000-0000-0000-0000-0000000000a1', 1);
+select is(public.commit_token_reservation((select reservation_id from unused), 0), 1, 'committing nothing refunds everything');
+select is(
+    (select status from public.token_reservations where id = (select reservation_id from unused)),
+    'released',
+    'committing nothing releases the reservation'
+);
+
+select function_privs_are(
+    'public', 'reserve_tokens', array['uuid', 'integer', 'interval'], 'authenticated', array[]::text[],
+    'clients cannot reserve tokens for an arbitrary user'
+);
+select function_privs_are(
+    'public', 'release_token_reservation', array['uuid'], 'anon', array[]::text[],
+    'anonymous clients cannot refund reservations'
+);
+
+select * from finish();
+rollback;
@@ -0,0 +1,92 @@
+"""
+Shared fixtures: an in-memory stand-in for the Supabase client's query builder.
+
+Only the PostgREST calls the app makes are supported. Rows are returned as
+stored, so embedded resources such as `product_descriptions(name)` are
+given as nested dicts in the test data.
+"""
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+import pytest
+
+
+class FakeQuery:
+    def __init__(self, client: "FakeSupabase", table: str):
+        self.client = client
+        self.table = table
+        self.filters: List[Callable[[dict], bool]] = []
+        self.ordering: Optional[tuple] = None
+        self.row_limit: Optional[int] = None
+        self.insert_rows: Optional[List[dict]] = None
+
+    def select(self, *columns, **kwargs) -> "FakeQuery":
+        return self
+
+    def eq(self, column: str, value: Any) -> "FakeQuery":
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def in_(self, column: str, values) -> "FakeQuery":
+        values = {str(value) for value in values}
+        self.filters.append(lambda row: str(row.get(column)) in values)
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "FakeQuery":
+        self.ordering = (column, desc)
+        return self
+
+    def limit(self, count: int) -> "FakeQuery":
+        self.row_limit = count
+        return self
+
+    def insert(self, rows) -> "FakeQuery":
+        self.insert_rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def execute(self) -> SimpleNamespace:
+        self.client.queries.append(self)
+        rows = self.client.tables.setdefault(self.table, [])
+        if self.insert_rows is not None:
+            rows.extend(self.insert_rows)
+            return SimpleNamespace(data=list(self.insert_rows))
+        data = [row for row in rows if all(check(row) for check in self.filters)]
+        if self.ordering:
+            column, desc = self.ordering
+            data.sort(key=lambda row: row[column], reverse=desc)
+        if self.row_limit is not None:
+            data = data[:self.row_limit]
+        return SimpleNamespace(data=data)
+
+
+class FakeRpc:
+    def __init__(self, client: "FakeSupabase", name: str, params: dict):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self) -> SimpleNamespace:
+        self.client.rpcs.append((self.name, self.params))
+        handler = self.client.functions.get(self.name)
+        return SimpleNamespace(data=handler(self.params) if handler else None)
+
+
+class FakeSupabase:
+    """Tables as lists of row dicts; RPCs answered by `functions[name](params)`"""
+
+    def __init__(self, tables: Optional[Dict[str, List[dict]]] = None):
+        self.tables = tables or {}
+        self.functions: Dict[str, Callable[[dict], Any]] = {}
+        self.queries: List[FakeQuery] = []
+        self.rpcs: List[tuple] = []
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: Optional[dict] = None) -> FakeRpc:
+        return FakeRpc(self, name, params or {})
+
+
+@pytest.fixture
+def supabase() -> FakeSupabase:
+    return FakeSupabase()
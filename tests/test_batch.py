@@ -0,0 +1,102 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.auth import TokenReservation
+from app.image_processing import batch_generator
+from app.image_processing.batch_generator import _SourcePhoto, generate_ad_photo_batch
+
+USER_ID = "11111111-1111-1111-1111-111111111111"
+
+
+@pytest.fixture
+def batch(supabase, monkeypatch):
+    """A batch run against fakes; `settled` records each reservation's commit or release"""
+    supabase.auth = SimpleNamespace(get_user=lambda: SimpleNamespace(user=SimpleNamespace(id=USER_ID)))
+    supabase.tables.update({
+        "product_descriptions": [{"id": "p1", "product_description": "A mug", "target_customers": "Everyone"}],
+        "source_photos": [{"id": "s1", "product_id": "p1", "edited_photo_url": "https://bucket/s1.png"}],
+    })
+    settled = []
+    failing_uploads = set()
+
+    async def noop(*args, **kwargs):
+        return None
+
+    async def reserve(user_id, amount, supabase, hold_seconds):
+        return TokenReservation(id=f"r{len(settled)}", user_id=user_id, amount=amount, token_balance=10)
+
+    async def commit(reservation, supabase=None, amount=None):
+        settled.append(("commit", reservation.amount if amount is None else amount))
+
+    async def release(reservation, supabase=None):
+        settled.append(("release", reservation.amount))
+
+    async def fetch_photo(row, deadline):
+        return _SourcePhoto(id=row["id"], url=row["edited_photo_url"], path="/tmp/none", data_uri="data:,")
+
+    async def inpaint(prompt, negative_prompt, image, count, deadline):
+        for idx in range(count):
+            yield f"https://replicate/out_{idx}.png"
+
+    uploads = []
+
+    async def upload(path, key_stem, deadline):
+        uploads.append(key_stem)
+        if len(uploads) in failing_uploads:
+            raise ConnectionError("S3 unavailable")
+        return f"https://bucket/{key_stem}.png"
+
+    for name, value in {
+        "get_user_supabase_client": lambda access_token, refresh_token: supabase,
+        "get_supabase_client": lambda: supabase,
+        "require_product_owner": lambda *args: None,
+        "_fetch_source_photo": fetch_photo,
+        "resolve_variant_count": lambda requested, user_id, client: requested,
+        "reserve_tokens": reserve,
+        "commit_reservation": commit,
+        "release_reservation": release,
+        "generate_ad_photo_prompt": lambda *args: SimpleNamespace(positive_prompt="+", negative_prompt="-"),
+        "plan_weight": lambda user_id, client: 1.0,
+        "inpaint_variants": inpaint,
+        "download_file": noop,
+        "upload_image": upload,
+        "increment_usage": lambda *args, **kwargs: None,
+        "manager": SimpleNamespace(broadcast=noop),
+        "response_cache": SimpleNamespace(invalidate_user=noop),
+    }.items():
+        monkeypatch.setattr(batch_generator, name, value)
+
+    def run(variant_count, fail_upload=()):
+        failing_uploads.update(fail_upload)
+        result = asyncio.run(generate_ad_photo_batch("p1", ["s1"], ["beach"], "access", "refresh", variant_count))
+        return result, settled
+
+    return run
+
+
+def test_successful_item_commits_its_reservation(batch, supabase):
+    result, settled = batch(variant_count=4)
+
+    assert result["status"] == "success"
+    assert settled == [("commit", 1)]
+    assert len(supabase.tables["product_photos"]) == 4
+
+
+def test_item_failing_after_storing_images_pays_for_those(batch, supabase):
+    result, settled = batch(variant_count=8, fail_upload={3})
+
+    item = result["items"][0]
+    assert item["status"] == "error"
+    assert len(item["image_urls"]) == 2
+    assert len(supabase.tables["product_photos"]) == 2
+    assert settled == [("commit", 1)]
+
+
+def test_item_failing_before_storing_anything_is_refunded(batch, supabase):
+    result, settled = batch(variant_count=4, fail_upload={1})
+
+    assert result["status"] == "error"
+    assert settled == [("release", 1)]
+    assert "product_photos" not in supabase.tables
@@ -0,0 +1,210 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.responses import JSONResponse
+from starlette.requests import Request
+
+from app.core import cache
+from app.core.cache import MemoryCacheBackend, ResponseCache, TTLCache, local_cache_ttl
+
+USER_ID = "11111111-1111-1111-1111-111111111111"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    monkeypatch.setattr(cache.time, "time", clock)
+    return clock
+
+
+def test_ttl_cache_expires_entries(clock):
+    entries = TTLCache(ttl_seconds=10, max_entries=10)
+    entries.set("a", 1)
+    entries.set("b", 2, ttl_seconds=30)
+
+    clock.now += 11
+    assert entries.get("a") is None
+    assert entries.get("b") == 2
+
+
+def test_ttl_cache_evicts_least_recently_used(clock):
+    entries = TTLCache(ttl_seconds=10, max_entries=2)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    entries.get("a")
+    entries.set("c", 3)
+
+    assert (entries.get("a"), entries.get("b"), entries.get("c")) == (1, None, 3)
+
+
+def test_ttl_cache_with_zero_ttl_stores_nothing():
+    entries = TTLCache(ttl_seconds=0, max_entries=10)
+    entries.set("a", 1)
+    assert entries.get("a") is None
+
+
+def test_ttl_cache_replace_keeps_the_expiry(clock):
+    entries = TTLCache(ttl_seconds=10, max_entries=10)
+    entries.set("a", {1})
+    clock.now += 5
+    entries.replace("a", lambda value: value | {2})
+    entries.replace("missing", lambda value: value | {2})
+
+    assert entries.get("a") == {1, 2}
+    assert entries.get("missing") is None
+    clock.now += 6
+    assert entries.get("a") is None
+
+
+def test_local_caches_are_off_or_short_with_several_workers(monkeypatch):
+    monkeypatch.delenv("SOME_CACHE_TTL", raising=False)
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    assert local_cache_ttl("SOME_CACHE_TTL", 60.0) == 60.0
+
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    assert local_cache_ttl("SOME_CACHE_TTL", 60.0) == 0.0
+    assert local_cache_ttl("SOME_CACHE_TTL", 60.0, several_workers=10.0) == 10.0
+
+    monkeypatch.setenv("SOME_CACHE_TTL", "5")
+    assert local_cache_ttl("SOME_CACHE_TTL", 60.0) == 5.0
+
+
+def test_response_cache_needs_a_shared_store_with_several_workers(monkeypatch):
+    monkeypatch.delenv("RESPONSE_CACHE_URL", raising=False)
+    monkeypatch.setenv("WEB_CONCURRENCY", "1")
+    assert isinstance(cache._create_backend(), MemoryCacheBackend)
+
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    assert cache._create_backend() is None
+
+
+def key(version: int, path: str = "/products/") -> str:
+    return f"{USER_ID}:{version}:{path}?"
+
+
+def test_memory_backend_bump_drops_the_users_responses():
+    backend = MemoryCacheBackend()
+
+    async def scenario():
+        await backend.set(key(0), {"body": "old"}, 60)
+        assert await backend.get(key(0)) == {"body": "old"}
+        await backend.bump_version(USER_ID)
+        version = await backend.get_version(USER_ID)
+        assert version == 1
+        assert await backend.get(key(0)) is None
+        # A response computed before the bump must not be stored as current
+        await backend.set(key(0), {"body": "computed before the write"}, 60)
+        assert await backend.get(key(0)) is None
+
+    asyncio.run(scenario())
+
+
+def test_memory_backend_is_bounded_by_users_and_entries_per_user():
+    backend = MemoryCacheBackend(max_users=2, max_entries_per_user=2)
+
+    async def scenario():
+        for index in range(3):
+            await backend.set(key(0, f"/p{index}"), {"body": index}, 60)
+        assert await backend.get(key(0, "/p0")) is None
+        assert await backend.get(key(0, "/p2")) == {"body": 2}
+
+        for index in range(3):
+            await backend.bump_version(f"user-{index}")
+        assert len(backend._users._entries) == 2
+        # An evicted user's version and responses go together, so version 0 is safe to reuse
+        assert await backend.get(key(0, "/p2")) is None
+
+    asyncio.run(scenario())
+
+
+def request(path: str = "/products/", if_none_match: str = None) -> Request:
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": headers})
+
+
+def test_response_cache_serves_304_for_a_matching_etag():
+    responses = ResponseCache(MemoryCacheBackend(), ttl_seconds=30, stale_seconds=300)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return JSONResponse({"items": [1, 2]})
+
+    async def scenario():
+        first = await responses.respond(request(), USER_ID, compute)
+        etag = first.headers["etag"]
+        second = await responses.respond(request(if_none_match=etag), USER_ID, compute)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert json.loads(first.body) == {"items": [1, 2]}
+    assert second.status_code == 304
+    assert len(calls) == 1
+
+
+def test_response_cache_revalidates_stale_entries_in_a_held_task(clock):
+    responses = ResponseCache(MemoryCacheBackend(), ttl_seconds=30, stale_seconds=300)
+    bodies = iter([{"n": 1}, {"n": 2}])
+
+    async def compute():
+        return JSONResponse(next(bodies))
+
+    async def scenario():
+        await responses.respond(request(), USER_ID, compute)
+        clock.now += 60
+        stale = await responses.respond(request(), USER_ID, compute)
+        task = next(iter(responses._revalidating.values()))
+        await task
+        fresh = await responses.respond(request(), USER_ID, compute)
+        return stale, fresh
+
+    stale, fresh = asyncio.run(scenario())
+    assert json.loads(stale.body) == {"n": 1}
+    assert json.loads(fresh.body) == {"n": 2}
+    assert responses._revalidating == {}
+
+
+def test_response_cache_without_a_backend_always_computes():
+    responses = ResponseCache(None)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return JSONResponse({})
+
+    async def scenario():
+        await responses.respond(request(), USER_ID, compute)
+        await responses.respond(request(), USER_ID, compute)
+        await responses.invalidate_user(USER_ID)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_etags_are_weak_and_compared_weakly():
+    responses = ResponseCache(MemoryCacheBackend(), ttl_seconds=30, stale_seconds=300)
+
+    async def compute():
+        return JSONResponse({"items": []})
+
+    async def scenario():
+        first = await responses.respond(request(), USER_ID, compute)
+        etag = first.headers["etag"]
+        strong = await responses.respond(request(if_none_match=f'"other", {etag[2:]}'), USER_ID, compute)
+        other = await responses.respond(request(if_none_match='W/"other"'), USER_ID, compute)
+        return etag, strong, other
+
+    etag, strong, other = asyncio.run(scenario())
+    assert etag.startswith('W/"')
+    assert strong.status_code == 304
+    assert other.status_code == 200
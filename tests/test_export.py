@@ -0,0 +1,69 @@
+import asyncio
+import io
+import json
+import zipfile
+from types import SimpleNamespace
+
+from app.product.export import stream_product_zip
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class FakeS3:
+    exceptions = SimpleNamespace(NoSuchKey=NoSuchKey)
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.requested = []
+
+    def get_object(self, Bucket, Key):
+        self.requested.append(Key)
+        if Key not in self.objects:
+            raise NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+
+def export(s3, photos, **kwargs) -> zipfile.ZipFile:
+    async def collect():
+        return b"".join([chunk async for chunk in stream_product_zip(
+            s3, "bucket", photos, key_for=lambda photo: photo["key"], **kwargs
+        )])
+
+    return zipfile.ZipFile(io.BytesIO(asyncio.run(collect())))
+
+
+def test_archive_holds_images_in_order_with_manifest():
+    s3 = FakeS3({"a.png": b"first", "b.png": b"second"})
+    photos = [{"id": "p1", "key": "a.png", "caption": "one"}, {"id": "p2", "key": "b.png"}]
+
+    archive = export(s3, photos, prefetch=1)
+
+    assert archive.read("images/0000_p1.png") == b"first"
+    assert archive.read("images/0001_p2.png") == b"second"
+    manifest = json.loads(archive.read("manifest.json"))
+    assert [entry["file"] for entry in manifest["photos"]] == ["images/0000_p1.png", "images/0001_p2.png"]
+    assert manifest["photos"][0]["caption"] == "one"
+
+
+def test_missing_object_is_recorded_in_the_manifest():
+    s3 = FakeS3({"a.png": b"first"})
+    photos = [{"id": "p1", "key": "a.png"}, {"id": "p2", "key": "gone.png"}]
+
+    archive = export(s3, photos)
+
+    assert archive.namelist() == ["images/0000_p1.png", "manifest.json"]
+    entry = json.loads(archive.read("manifest.json"))["photos"][1]
+    assert entry["file"] is None and entry["error"]
+
+
+def test_variant_is_exported_where_it_exists():
+    s3 = FakeS3({"a.png": b"master", "a.webp": b"variant", "b.png": b"old master"})
+    photos = [{"id": "p1", "key": "a.png"}, {"id": "p2", "key": "b.png"}]
+
+    archive = export(s3, photos, include_manifest=False, variant="image/webp")
+
+    assert archive.read("images/0000_p1.webp") == b"variant"
+    assert archive.read("images/0001_p2.png") == b"old master"
+    assert "a.png" not in s3.requested
@@ -0,0 +1,107 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.core import scheduler
+from app.core.auth import TokenReservation
+from app.image_processing import product_image_generator as generator
+from app.image_processing.product_image_generator import resolve_variant_count, variant_tokens
+
+USER_ID = "11111111-1111-1111-1111-111111111111"
+
+
+def settle(monkeypatch, outcomes):
+    """Run _settle_failed_job over store tasks ending in `outcomes` and return what it settled"""
+    settled = []
+
+    async def noop(*args, **kwargs):
+        return None
+
+    async def commit(reservation, supabase=None, amount=None):
+        settled.append(("commit", amount))
+
+    async def release(reservation, supabase=None):
+        settled.append(("release", reservation.amount))
+
+    monkeypatch.setattr(generator, "commit_reservation", commit)
+    monkeypatch.setattr(generator, "release_reservation", release)
+    monkeypatch.setattr(generator, "response_cache", SimpleNamespace(invalidate_user=noop))
+
+    async def store(outcome, delay):
+        await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        settled.append(("stored", outcome))
+        return outcome
+
+    async def scenario():
+        tasks = [asyncio.create_task(store(outcome, 0.01 * index)) for index, outcome in enumerate(outcomes)]
+        reservation = TokenReservation(id="r1", user_id=USER_ID, amount=2, token_balance=0)
+        await generator._settle_failed_job(reservation, tasks)
+
+    asyncio.run(scenario())
+    return settled
+
+
+def test_failed_job_waits_for_stores_and_pays_for_stored_variants(monkeypatch):
+    settled = settle(monkeypatch, [ConnectionError("S3"), "https://bucket/a.png", "https://bucket/b.png"])
+
+    # Both stores finish before the reservation is settled, and only their block is charged
+    assert settled == [("stored", "https://bucket/a.png"), ("stored", "https://bucket/b.png"), ("commit", 1)]
+
+
+def test_failed_job_without_stored_variants_is_refunded(monkeypatch):
+    assert settle(monkeypatch, [ConnectionError("S3")]) == [("release", 2)]
+    assert settle(monkeypatch, []) == [("release", 2)]
+
+
+@pytest.fixture
+def plan(supabase, monkeypatch):
+    """Sets the test user's plan; plans are read from user_tokens"""
+    monkeypatch.setattr(scheduler, "_plans", scheduler.TTLCache(ttl_seconds=60, max_entries=10))
+
+    def set_plan(name):
+        supabase.tables["user_tokens"] = [{"user_id": USER_ID, "plan": name}]
+        return supabase
+
+    return set_plan
+
+
+def test_variant_tokens_charge_per_started_block():
+    per_token = generator.VARIANTS_PER_TOKEN
+
+    assert variant_tokens(1) == 1
+    assert variant_tokens(per_token) == 1
+    assert variant_tokens(per_token + 1) == 2
+
+
+def test_variant_count_defaults_within_the_plan(plan):
+    assert resolve_variant_count(None, USER_ID, plan("free")) == min(
+        generator.DEFAULT_VARIANT_COUNT, scheduler.PLAN_MAX_VARIANTS["free"]
+    )
+
+
+@pytest.mark.parametrize("requested", [0, -1, "4", 2.5, True])
+def test_invalid_variant_counts_are_refused(plan, requested):
+    with pytest.raises(HTTPException) as error:
+        resolve_variant_count(requested, USER_ID, plan("free"))
+    assert error.value.status_code == 400
+    assert error.value.detail["code"] == "INVALID_VARIANT_COUNT"
+
+
+def test_variant_count_is_bounded_by_the_plan(plan):
+    free_limit = scheduler.PLAN_MAX_VARIANTS["free"]
+
+    with pytest.raises(HTTPException) as error:
+        resolve_variant_count(free_limit + 1, USER_ID, plan("free"))
+    assert error.value.status_code == 403
+    assert error.value.detail["code"] == "VARIANT_LIMIT"
+    assert resolve_variant_count(free_limit, USER_ID, plan("free")) == free_limit
+
+
+def test_larger_plans_allow_more_variants(plan):
+    pro_limit = scheduler.PLAN_MAX_VARIANTS["pro"]
+
+    assert resolve_variant_count(pro_limit, USER_ID, plan("pro")) == pro_limit
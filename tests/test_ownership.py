@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.core import ownership
+from app.core.ownership import ProductOwnershipCache
+from app.image_processing import product_image_generator as generator
+
+USER_ID = "11111111-1111-1111-1111-111111111111"
+
+
+def product_loads(supabase) -> int:
+    return sum(1 for query in supabase.queries if query.table == "user_products")
+
+
+def test_owns_loads_the_product_set_once(supabase):
+    supabase.tables["user_products"] = [{"user_id": USER_ID, "product_id": "p1"}]
+    cache = ProductOwnershipCache(ttl_seconds=60, max_users=10)
+
+    assert cache.owns(supabase, USER_ID, "p1")
+    assert cache.owns(supabase, USER_ID, "p1")
+    assert product_loads(supabase) == 1
+
+
+def test_missing_product_reloads_before_refusing(supabase):
+    supabase.tables["user_products"] = [{"user_id": USER_ID, "product_id": "p1"}]
+    cache = ProductOwnershipCache(ttl_seconds=60, max_users=10)
+    cache.owns(supabase, USER_ID, "p1")
+
+    # Created through another worker, so this worker's cached set doesn't have it
+    supabase.tables["user_products"].append({"user_id": USER_ID, "product_id": "p2"})
+    assert cache.owns(supabase, USER_ID, "p2")
+    assert not cache.owns(supabase, USER_ID, "p3")
+    assert product_loads(supabase) == 3
+
+
+def test_writes_go_through_to_the_cached_set(supabase):
+    supabase.tables["user_products"] = [{"user_id": USER_ID, "product_id": "p1"}]
+    cache = ProductOwnershipCache(ttl_seconds=60, max_users=10)
+    cache.owns(supabase, USER_ID, "p1")
+
+    cache.add_product(USER_ID, "p2")
+    assert cache.owns(supabase, USER_ID, "p2")
+    cache.remove_product(USER_ID, "p1")
+    supabase.tables["user_products"].clear()
+    assert not cache.owns(supabase, USER_ID, "p1")
+
+
+def test_least_recently_used_user_is_evicted(supabase):
+    supabase.tables["user_products"] = [{"user_id": f"u{index}", "product_id": "p"} for index in range(3)]
+    cache = ProductOwnershipCache(ttl_seconds=60, max_users=2)
+    for index in range(3):
+        cache.owns(supabase, f"u{index}", "p")
+
+    cache.owns(supabase, "u0", "p")
+    assert product_loads(supabase) == 4
+
+
+def test_require_product_owner_raises_404(supabase, monkeypatch):
+    monkeypatch.setattr(ownership, "product_ownership", ProductOwnershipCache())
+    with pytest.raises(HTTPException) as error:
+        ownership.require_product_owner(supabase, USER_ID, "p1")
+    assert error.value.status_code == 404
+
+
+@pytest.fixture
+def someone_elses_product(supabase, monkeypatch):
+    """A signed-in user without products, and a pipeline that fails the test if it gets past the check"""
+    supabase.auth = SimpleNamespace(get_user=lambda: SimpleNamespace(user=SimpleNamespace(id=USER_ID)))
+    monkeypatch.setattr(ownership, "product_ownership", ProductOwnershipCache())
+    monkeypatch.setattr(generator, "get_user_supabase_client", lambda access_token, refresh_token: supabase)
+
+    async def broadcast(message):
+        pass
+
+    async def unexpected(*args, **kwargs):
+        raise AssertionError("work started for a product the user doesn't own")
+
+    monkeypatch.setattr(generator.manager, "broadcast", broadcast)
+    monkeypatch.setattr(generator, "reserve_tokens", unexpected)
+    monkeypatch.setattr(generator, "upload_image", unexpected)
+
+
+def test_generate_ad_photo_refuses_products_the_user_does_not_own(someone_elses_product):
+    result = asyncio.run(generator._generate_ad_photo("aW1hZ2U=", "p1", "access", "refresh"))
+
+    assert result["status"] == "error"
+    assert result["message"] == "Product not found or access denied"
+
+
+def test_add_source_photo_refuses_products_the_user_does_not_own(someone_elses_product):
+    result = asyncio.run(generator._add_source_photo("aW1hZ2U=", "access", "refresh", "p1"))
+
+    assert result == {"status": "error", "message": "Product not found or access denied"}
@@ -0,0 +1,128 @@
+import base64
+import json
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from app.product.pagination import (
+    DEFAULT_PAGE_SIZE, check_limit, decode_cursor, encode_cursor, fetch_page, parse_fields, split_page
+)
+
+ROW_ID = "3f2b8a44-3f8c-4a55-9d57-0cbe5f2b9a10"
+
+
+def raw_cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii")
+
+
+@pytest.mark.parametrize("created_at", [
+    "2026-01-05T10:20:30+00:00",
+    "2026-01-05T10:20:30.12345+00:00",
+    "2026-01-05 10:20:30.123456Z",
+    "2026-01-05T10:20:30",
+])
+def test_cursor_round_trip(created_at):
+    assert decode_cursor(encode_cursor(created_at, ROW_ID)) == (created_at, ROW_ID)
+
+
+@pytest.mark.parametrize("value", [
+    ['2026-01-05T10:20:30"),id.gt.(0', ROW_ID],
+    ["2026-01-05T10:20:30,and(id.gt.0)", ROW_ID],
+    ["2026-01-05T10:20:30", f'{ROW_ID}",user_id.neq."x'],
+    ["2026-01-05T10:20:30", "42"],
+    [20260105, ROW_ID],
+    ["2026-01-05T10:20:30"],
+    {"created_at": "2026-01-05T10:20:30"},
+])
+def test_decode_cursor_rejects_anything_but_a_timestamp_and_uuid(value):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(raw_cursor(value))
+    assert error.value.status_code == 400
+
+
+def test_decode_cursor_rejects_garbage():
+    with pytest.raises(HTTPException):
+        decode_cursor("not base64 at all!")
+
+
+def test_check_limit():
+    check_limit(None)
+    check_limit(1)
+    with pytest.raises(HTTPException):
+        check_limit(0)
+    with pytest.raises(HTTPException):
+        check_limit(201)
+
+
+def test_parse_fields():
+    columns = {"id": "id", "name": "name", "description": "product_description"}
+    assert parse_fields(None, columns) == columns
+    assert parse_fields("description, id", columns) == {"description": "product_description", "id": "id"}
+    with pytest.raises(HTTPException):
+        parse_fields("id,secret", columns)
+
+
+def rows(count: int):
+    return [
+        {"id": str(uuid.UUID(int=index)), "created_at": f"2026-01-01T00:{index // 60:02d}:{index % 60:02d}"}
+        for index in range(count)
+    ]
+
+
+def test_split_page_returns_cursor_only_when_more_rows_exist():
+    page, cursor = split_page(rows(3), 2)
+    assert len(page) == 2
+    assert decode_cursor(cursor) == (page[-1]["created_at"], page[-1]["id"])
+    assert split_page(rows(2), 2) == (rows(2), None)
+
+
+class KeysetQuery:
+    """Just enough of a PostgREST query for keyset paging over rows sorted newest first"""
+
+    def __init__(self, data):
+        self.data = sorted(data, key=lambda row: (row["created_at"], row["id"]), reverse=True)
+        self.after = None
+        self.count = None
+
+    def or_(self, expression):
+        created_at = expression.split('lt."', 1)[1].split('"', 1)[0]
+        row_id = expression.rsplit('lt."', 1)[1].split('"', 1)[0]
+        self.after = (created_at, row_id)
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def execute(self):
+        data = [row for row in self.data if self.after is None or (row["created_at"], row["id"]) < self.after]
+        return type("Result", (), {"data": data[:self.count]})
+
+
+def test_fetch_page_without_limit_or_cursor_returns_every_row():
+    data = rows(DEFAULT_PAGE_SIZE * 12)
+    page, cursor = fetch_page(lambda: KeysetQuery(data), None, None)
+    assert len(page) == len(data)
+    assert cursor is None
+
+
+def test_fetch_page_walks_pages_with_the_cursor():
+    data = rows(120)
+    seen, cursor = [], None
+    page, cursor = fetch_page(lambda: KeysetQuery(data), cursor, 50)
+    seen += page
+    while cursor:
+        page, cursor = fetch_page(lambda: KeysetQuery(data), cursor, 50)
+        seen += page
+    assert [row["id"] for row in seen] == [row["id"] for row in reversed(data)]
+
+
+def test_fetch_page_with_cursor_only_uses_the_default_size():
+    data = rows(DEFAULT_PAGE_SIZE * 2 + 1)
+    first, cursor = fetch_page(lambda: KeysetQuery(data), None, 10)
+    page, _ = fetch_page(lambda: KeysetQuery(data), cursor, None)
+    assert len(page) == DEFAULT_PAGE_SIZE
@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from replicate.client import Client
+
+from app.image_processing import predictions
+from app.image_processing.predictions import PredictionManager
+from benchmarks.fakes.latency import LatencyModel
+from benchmarks.fakes.replicate import create_app
+
+BASE_URL = "http://replicate.test"
+
+
+@pytest.fixture
+def fake_replicate(monkeypatch):
+    """The benchmark's Replicate fake, served in-process; predictions take `latency` seconds"""
+
+    def start(latency: float):
+        app = create_app(BASE_URL, LatencyModel(median=latency, sigma=0.0))
+        client = Client(api_token="test", base_url=BASE_URL, transport=httpx.ASGITransport(app=app))
+        monkeypatch.setattr(predictions, "get_replicate", lambda: SimpleNamespace(predictions=client.predictions))
+        return app.state.predictions
+
+    return start
+
+
+def test_cancelled_waiter_cancels_the_prediction(fake_replicate):
+    remote = fake_replicate(latency=30)
+
+    async def scenario():
+        manager = PredictionManager(poll_initial=0.01, poll_max=0.05)
+        prediction = await manager.create("fake/model:v1", {"prompt": "mug"})
+        waiter = asyncio.create_task(manager.wait(prediction))
+        await asyncio.sleep(0.1)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return prediction["id"], manager.outstanding
+
+    prediction_id, outstanding = asyncio.run(scenario())
+
+    assert remote[prediction_id]["status"] == "canceled"
+    assert outstanding == 0
+
+
+def test_finished_prediction_is_returned_and_not_cancelled(fake_replicate):
+    remote = fake_replicate(latency=0.05)
+
+    async def scenario():
+        manager = PredictionManager(poll_initial=0.01, poll_max=0.05)
+        prediction = await manager.create("fake/model:v1", {"prompt": "mug"})
+        return prediction["id"], await asyncio.wait_for(manager.wait(prediction), timeout=5)
+
+    prediction_id, output = asyncio.run(scenario())
+
+    assert remote[prediction_id]["status"] == "succeeded"
+    assert output.endswith(".png")
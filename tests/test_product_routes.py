@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core import ownership
+from app.core.ownership import ProductOwnershipCache
+from app.product import routes
+from main import app
+
+USER_ID = "22222222-2222-2222-2222-222222222222"
+
+
+@pytest.fixture
+def client(supabase, monkeypatch):
+    supabase.tables.update({
+        "user_products": [{"user_id": USER_ID, "product_id": "p1"}],
+        "product_photos": [{"id": "g1", "product_id": "p2", "image_url": "u1", "created_at": "2026-01-01T00:00:00"}],
+    })
+    monkeypatch.setattr(ownership, "product_ownership", ProductOwnershipCache())
+    monkeypatch.setattr(routes, "get_supabase_client", lambda: supabase)
+    monkeypatch.setattr(routes, "get_current_user", lambda request: SimpleNamespace(id=USER_ID))
+    return TestClient(app)
+
+
+def test_someone_elses_photo_is_a_404(client):
+    response = client.get("/products/photos/g1")
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Photo not found or access denied"
+
+
+def test_someone_elses_product_is_a_404(client):
+    response = client.get("/products/p2/images")
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Product not found or access denied"
+
+
+@pytest.mark.parametrize("params, detail", [
+    ({"cursor": "garbage"}, "Invalid cursor"),
+    ({"limit": "0"}, "Limit must be between 1 and"),
+])
+def test_bad_paging_parameters_keep_their_400(client, params, detail):
+    response = client.get("/products/p1/images", params=params)
+
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith(detail)
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.core import auth
+from app.core.auth import release_stale_reservations, reservation_hold, reserve_tokens
+from app.core.resilience import JOB_DEADLINE
+from app.core.scheduler import generation_scheduler
+
+USER_ID = "11111111-1111-1111-1111-111111111111"
+
+
+def test_reservation_hold_covers_queue_waits_and_the_deadline_with_margin():
+    longest_job = generation_scheduler.queue_timeout + JOB_DEADLINE
+
+    assert reservation_hold() == auth.RESERVATION_MARGIN * longest_job
+    assert reservation_hold() > longest_job
+    assert reservation_hold(queue_waits=15) - reservation_hold() == (
+        auth.RESERVATION_MARGIN * 14 * generation_scheduler.queue_timeout
+    )
+
+
+def test_reserve_tokens_sends_the_hold(supabase):
+    supabase.functions["reserve_tokens"] = lambda params: [{"reservation_id": "r1", "token_balance": 4}]
+
+    reservation = asyncio.run(reserve_tokens(USER_ID, amount=2, supabase=supabase, hold_seconds=90))
+
+    assert (reservation.id, reservation.amount, reservation.token_balance) == ("r1", 2, 4)
+    assert supabase.rpcs == [("reserve_tokens", {"p_user_id": USER_ID, "p_amount": 2, "p_hold": "90 seconds"})]
+
+
+def test_reserve_tokens_defaults_to_the_derived_hold(supabase):
+    supabase.functions["reserve_tokens"] = lambda params: [{"reservation_id": "r1", "token_balance": 4}]
+
+    asyncio.run(reserve_tokens(USER_ID, supabase=supabase))
+
+    assert supabase.rpcs[0][1]["p_hold"] == f"{reservation_hold():.0f} seconds"
+
+
+@pytest.mark.parametrize("row, code", [
+    ({"reservation_id": None, "token_balance": None}, "NO_TOKENS"),
+    ({"reservation_id": None, "token_balance": 0}, "INSUFFICIENT_TOKENS"),
+])
+def test_refused_reservations_raise_402(supabase, row, code):
+    supabase.functions["reserve_tokens"] = lambda params: [row]
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(reserve_tokens(USER_ID, supabase=supabase))
+    assert error.value.status_code == 402
+    assert error.value.detail["code"] == code
+
+
+def test_stale_sweep_relies_on_each_reservations_expiry(supabase, monkeypatch):
+    supabase.functions["release_stale_token_reservations"] = lambda params: 3
+    monkeypatch.setattr(auth, "get_supabase_client", lambda: supabase)
+
+    assert asyncio.run(release_stale_reservations()) == 3
+    assert supabase.rpcs == [("release_stale_token_reservations", {})]
+
+
+def test_commit_sends_the_amount_spent(supabase):
+    supabase.functions["commit_token_reservation"] = lambda params: 7
+    reservation = auth.TokenReservation(id="r1", user_id=USER_ID, amount=2, token_balance=6)
+
+    assert asyncio.run(auth.commit_reservation(reservation, supabase=supabase, amount=1)) == 7
+    asyncio.run(auth.commit_reservation(reservation, supabase=supabase))
+    assert supabase.rpcs == [
+        ("commit_token_reservation", {"p_reservation_id": "r1", "p_amount": 1}),
+        ("commit_token_reservation", {"p_reservation_id": "r1", "p_amount": None}),
+    ]
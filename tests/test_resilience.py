@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from app.core import resilience
+from app.core.resilience import (
+    CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceededError, call_with_retries, hedged
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_breakers(monkeypatch):
+    monkeypatch.setattr(resilience, "_breakers", {})
+
+
+def flaky(failures: int, result: str = "ok"):
+    """Coroutine function failing `failures` times before returning `result`; `calls` counts attempts"""
+    calls = []
+
+    async def fn(timeout: float) -> str:
+        calls.append(timeout)
+        if len(calls) <= failures:
+            raise ConnectionError("unavailable")
+        return result
+
+    return fn, calls
+
+
+def test_breaker_opens_after_consecutive_failures_and_recovers_through_one_trial(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+
+    breaker.allow()
+    breaker.record_failure()
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    now[0] = 31.0
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_trial_reopens_the_breaker(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+
+    now[0] = 31.0
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_retries_until_success_with_capped_attempt_timeouts():
+    fn, calls = flaky(failures=2)
+
+    result = asyncio.run(call_with_retries(
+        fn, dependency="test", operation="op", deadline=Deadline(60), attempt_timeout=5, base_delay=0.001
+    ))
+
+    assert result == "ok"
+    assert len(calls) == 3
+    assert all(timeout <= 5 for timeout in calls)
+
+
+def test_last_error_is_raised_once_attempts_run_out():
+    fn, calls = flaky(failures=5)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(call_with_retries(
+            fn, dependency="test", operation="op", deadline=Deadline(60), attempts=3, base_delay=0.001
+        ))
+    assert len(calls) == 3
+
+
+def test_nothing_is_attempted_past_the_deadline():
+    fn, calls = flaky(failures=0)
+
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(call_with_retries(fn, dependency="test", operation="op", deadline=Deadline(0)))
+    assert calls == []
+
+
+def test_errors_that_do_not_trip_the_breaker_keep_it_closed(monkeypatch):
+    monkeypatch.setenv("CIRCUIT_FAILURE_THRESHOLD", "1")
+    fn, _ = flaky(failures=5)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(call_with_retries(
+            fn, dependency="test", operation="op", deadline=Deadline(60), attempts=2, base_delay=0.001,
+            trips_breaker=lambda e: False
+        ))
+    assert resilience.get_breaker("test").state == CircuitBreaker.CLOSED
+
+
+def test_open_breaker_fails_calls_immediately(monkeypatch):
+    monkeypatch.setenv("CIRCUIT_FAILURE_THRESHOLD", "1")
+    fn, calls = flaky(failures=5)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(call_with_retries(fn, dependency="test", operation="op", deadline=Deadline(60), attempts=1))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(call_with_retries(fn, dependency="test", operation="op", deadline=Deadline(60)))
+    assert len(calls) == 1
+
+
+def test_hedged_call_returns_the_backup_when_the_first_is_slow():
+    async def scenario():
+        started = []
+
+        async def fetch():
+            started.append(1)
+            await asyncio.sleep(1 if len(started) == 1 else 0.01)
+            return len(started)
+
+        return await asyncio.wait_for(hedged(fetch, 0.02, "download"), timeout=0.5), started
+
+    result, started = asyncio.run(scenario())
+
+    assert len(started) == 2
+    assert result == 2
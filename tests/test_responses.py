@@ -0,0 +1,52 @@
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.responses import CompressionMiddleware, FastJSONResponse, dumps, ndjson_response
+
+
+def test_dumps_is_compact_json():
+    assert json.loads(dumps({"a": [1, "é"], 2: None})) == {"a": [1, "é"], "2": None}
+    assert b" " not in dumps({"a": [1, 2]})
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/rows")
+    async def rows():
+        return FastJSONResponse([{"id": index, "name": "x" * 20} for index in range(200)])
+
+    @app.get("/stream")
+    async def stream():
+        return ndjson_response({"id": index} for index in range(600))
+
+    @app.get("/images/big")
+    async def image():
+        return FastJSONResponse(["x" * 2000])
+
+    app.add_middleware(CompressionMiddleware, minimum_size=1024, excluded_paths=[r"^/images/"])
+    return app
+
+
+def test_large_responses_are_compressed_unless_excluded():
+    client = TestClient(make_app())
+
+    compressed = client.get("/rows", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert len(compressed.json()) == 200
+
+    excluded = client.get("/images/big", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in excluded.headers
+
+    plain = client.get("/rows", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+
+
+def test_ndjson_stream_has_one_object_per_line():
+    response = TestClient(make_app()).get("/stream", headers={"Accept-Encoding": "identity"})
+
+    lines = response.text.splitlines()
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line)["id"] for line in lines] == list(range(600))
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.scheduler import FairScheduler, _worker_share
+
+
+def scheduler(**kwargs) -> FairScheduler:
+    settings = {"capacity": 1, "per_user_limit": 1, "max_queued_per_user": 10, "queue_timeout": 5.0}
+    settings.update(kwargs)
+    return FairScheduler(**settings)
+
+
+async def run_in_grant_order(fair: FairScheduler, jobs):
+    """Submit (user, weight) jobs behind a held slot and return users in the order they are granted"""
+    order = []
+    holder = await fair.acquire("holder")
+
+    async def job(user_id, weight):
+        ticket = await fair.acquire(user_id, weight)
+        order.append(user_id)
+        await asyncio.sleep(0)
+        fair.release(ticket)
+
+    tasks = [asyncio.create_task(job(user_id, weight)) for user_id, weight in jobs]
+    await asyncio.sleep(0)
+    fair.release(holder)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_users_are_interleaved_rather_than_served_in_submission_order():
+    fair = scheduler()
+    jobs = [("a", 1.0)] * 3 + [("b", 1.0)] * 3
+
+    order = asyncio.run(run_in_grant_order(fair, jobs))
+
+    assert order == ["a", "b", "a", "b", "a", "b"]
+
+
+def test_heavier_plans_are_served_in_proportion_to_weight():
+    fair = scheduler()
+    jobs = [("free", 1.0)] * 4 + [("pro", 4.0)] * 8
+
+    order = asyncio.run(run_in_grant_order(fair, jobs))
+
+    assert order[:5].count("pro") == 4
+
+
+def test_per_user_limit_leaves_capacity_to_others():
+    async def scenario():
+        fair = scheduler(capacity=3, per_user_limit=2)
+        a1 = await fair.acquire("a")
+        a2 = await fair.acquire("a")
+        waiting = asyncio.create_task(fair.acquire("a"))
+        b1 = await asyncio.wait_for(fair.acquire("b"), timeout=1)
+        await asyncio.sleep(0)
+        assert not waiting.done() and fair.active == 3
+        fair.release(a1)
+        a3 = await asyncio.wait_for(waiting, timeout=1)
+        for ticket in (a2, a3, b1):
+            fair.release(ticket)
+        assert fair.active == 0 and fair.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_limit_and_timeout_are_refused():
+    async def scenario():
+        fair = scheduler(max_queued_per_user=1, queue_timeout=0.05)
+        held = await fair.acquire("a")
+        with pytest.raises(HTTPException) as timeout:
+            await fair.acquire("b")
+        assert timeout.value.status_code == 503
+
+        waiting = asyncio.create_task(fair.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as too_many:
+            await fair.acquire("b")
+        assert too_many.value.status_code == 429
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        fair.release(held)
+        assert fair.active == 0 and fair.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_dependency_limits_are_split_over_workers(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    assert _worker_share(32) == 8
+    assert _worker_share(6) == 2
+    assert _worker_share(2) == 1
+    assert _worker_share(0) == 0
+    monkeypatch.delenv("WEB_CONCURRENCY")
+    assert _worker_share(32) == 32
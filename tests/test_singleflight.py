@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from app.core.singleflight import SingleFlight, flight_key
+
+
+def test_flight_key_separates_none_from_empty_and_operations():
+    assert flight_key("remove_bg", "a", None) == flight_key("remove_bg", "a", None)
+    assert flight_key("remove_bg", "a", None) != flight_key("remove_bg", "a", "")
+    assert flight_key("remove_bg", "a") != flight_key("prompt", "a")
+    assert flight_key("remove_bg", "a").startswith("remove_bg:")
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flights = SingleFlight("test")
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flights.do("key", work) for _ in range(5)))
+        return results, calls, flights.in_flight
+
+    results, calls, in_flight = asyncio.run(scenario())
+
+    assert results == ["result"] * 5
+    assert len(calls) == 1
+    assert in_flight == 0
+
+
+def test_errors_are_shared_and_nothing_is_cached():
+    async def scenario():
+        flights = SingleFlight("test")
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        results = await asyncio.gather(*(flights.do("key", work) for _ in range(3)), return_exceptions=True)
+        with pytest.raises(ValueError):
+            await flights.do("key", work)
+        return results, calls
+
+    results, calls = asyncio.run(scenario())
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(calls) == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_work():
+    async def scenario():
+        flights = SingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        first = asyncio.create_task(flights.do("key", work))
+        second = asyncio.create_task(flights.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == "done"
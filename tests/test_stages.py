@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from app.core.metrics import StageTimer
+from app.core.stages import StageGraph
+
+
+def test_independent_stages_overlap_and_results_flow_along_edges():
+    async def scenario():
+        started = {}
+        graph = StageGraph(StageTimer())
+
+        async def stage(name, value):
+            started[name] = asyncio.get_running_loop().time()
+            await asyncio.sleep(0.05)
+            return value
+
+        graph.add("a", lambda: stage("a", 1))
+        graph.add("b", lambda: stage("b", 2))
+        graph.add("sum", lambda a, b: stage("sum", a + b), after=["a", "b"])
+        results = await graph.run()
+        return started, results
+
+    started, results = asyncio.run(scenario())
+
+    assert results == {"a": 1, "b": 2, "sum": 3}
+    assert abs(started["a"] - started["b"]) < 0.04
+    assert started["sum"] - started["a"] >= 0.04
+
+
+def test_first_failure_cancels_the_rest_and_is_raised():
+    async def scenario():
+        cancelled = []
+        graph = StageGraph(StageTimer())
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append("slow")
+                raise
+
+        async def fail():
+            raise ValueError("boom")
+
+        graph.add("slow", slow)
+        graph.add("fail", fail)
+        graph.add("after", lambda _: asyncio.sleep(0), after=["fail"])
+        with pytest.raises(ValueError, match="boom"):
+            await asyncio.wait_for(graph.run(), timeout=1)
+        return cancelled
+
+    assert asyncio.run(scenario()) == ["slow"]
+
+
+def test_spawned_work_can_wait_for_a_stage():
+    async def scenario():
+        graph = StageGraph(StageTimer())
+        spawned = []
+
+        async def spawn():
+            spawned.append(asyncio.create_task(graph.result("upload")))
+
+        graph.add("spawn", spawn)
+        graph.add("upload", lambda: asyncio.sleep(0.01, result="s3://key"))
+        await graph.run()
+        return await spawned[0]
+
+    assert asyncio.run(scenario()) == "s3://key"
+
+
+def test_stages_must_be_declared_after_their_inputs():
+    graph = StageGraph(StageTimer())
+    graph.add("a", lambda: asyncio.sleep(0))
+
+    with pytest.raises(ValueError):
+        graph.add("b", lambda c: asyncio.sleep(0), after=["c"])
+    with pytest.raises(ValueError):
+        graph.add("a", lambda: asyncio.sleep(0))
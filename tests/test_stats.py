@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.auth import get_current_user
+from app.core.cache import response_cache
+from app.stats import routes
+from main import app
+
+USER_ID = "11111111-1111-1111-1111-111111111111"
+
+
+@pytest.fixture
+def client(supabase, monkeypatch):
+    supabase.tables.update({
+        "user_products": [
+            {"user_id": USER_ID, "product_id": "p1", "created_at": "2026-01-01T00:00:00", "updated_at": "2026-01-01T00:00:00",
+             "product_descriptions": {"name": "Mug"}},
+            {"user_id": USER_ID, "product_id": "p2", "created_at": "2026-01-02T00:00:00", "updated_at": "2026-01-05T00:00:00",
+             "product_descriptions": {"name": "Lamp"}},
+        ],
+        "source_photos": [
+            {"id": "s1", "product_id": "p1", "created_at": "2026-01-03T00:00:00", "original_photo_url": "o", "edited_photo_url": "e"},
+        ],
+        "product_photos": [
+            {"id": f"g{i}", "product_id": "p2", "created_at": f"2026-01-1{i}T00:00:00", "image_url": f"u{i}"}
+            for i in range(3)
+        ],
+        "user_stats": [],
+    })
+
+    def reconcile(params):
+        supabase.tables["user_stats"].append({
+            "user_id": params["p_user_id"], "token_balance": None, "num_products": 2, "num_source_photos": 1,
+            "num_generated_images": 3, "last_activity": "2026-01-12T00:00:00"
+        })
+        return 1
+
+    supabase.functions["reconcile_user_usage"] = reconcile
+    monkeypatch.setattr(routes, "get_supabase_client", lambda: supabase)
+    # Responses cached by earlier tests would hide this one's data
+    asyncio.run(response_cache.invalidate_user(USER_ID))
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(id=USER_ID)
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def test_load_activities_is_newest_first_and_complete_without_limit(supabase, client):
+    activities = routes._load_activities(supabase, USER_ID)
+
+    assert [activity["type"] for activity in activities] == [
+        "image_generated", "image_generated", "image_generated", "product_updated", "source_photo_uploaded",
+        "product_created"
+    ]
+    assert activities[3]["date"] == "2026-01-05T00:00:00"
+
+
+def test_load_activities_limit(supabase, client):
+    activities = routes._load_activities(supabase, USER_ID, limit=2)
+
+    assert [activity["photo_id"] for activity in activities] == ["g2", "g1"]
+
+
+def test_user_stats_keeps_activities_and_backfills_users_without_counters(supabase, client):
+    response = client.get("/stats/user")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["num_products"] == 2
+    assert body["num_generated_images"] == 3
+    assert body["available_tokens"] == 0
+    assert len(body["activities"]) == 6
+    assert [name for name, _ in supabase.rpcs] == ["reconcile_user_usage"]
+
+
+def test_user_stats_without_activities(client):
+    body = client.get("/stats/user", params={"activities": "false"}).json()
+
+    assert "activities" not in body
+    assert body["num_source_photos"] == 1
+
+
+def test_user_stats_activities_are_bounded(client, monkeypatch):
+    monkeypatch.setattr(routes, "STATS_ACTIVITY_LIMIT", 2)
+
+    body = client.get("/stats/user").json()
+
+    assert [activity["photo_id"] for activity in body["activities"]] == ["g2", "g1"]
+    assert body["num_generated_images"] == 3
@@ -0,0 +1,116 @@
+import io
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.cache import TTLCache
+from app.image_processing.variants import VARIANT_FORMATS, negotiate_formats, sniff_content_type, variant_key
+from app.product import routes
+from main import app
+
+MASTER = "products/p1/generated_1_0.png"
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class FakeS3:
+    exceptions = SimpleNamespace(NoSuchKey=NoSuchKey)
+
+    def __init__(self, objects, failing=(), age: float = 0.0):
+        self.objects = objects
+        self.failing = set(failing)
+        self.last_modified = datetime.now(timezone.utc) - timedelta(seconds=age)
+        self.requested = []
+
+    def get_object(self, Bucket, Key):
+        self.requested.append(Key)
+        if Key in self.failing:
+            raise ConnectionError("S3 unavailable")
+        if Key not in self.objects:
+            raise NoSuchKey(Key)
+        content_type, body = self.objects[Key]
+        return {"ContentType": content_type, "Body": io.BytesIO(body), "LastModified": self.last_modified}
+
+
+@pytest.fixture
+def proxy(monkeypatch):
+    monkeypatch.setattr(routes, "_missing_variants", TTLCache(ttl_seconds=60, max_entries=100))
+    monkeypatch.setattr(routes, "BUCKET_NAME", "bucket")
+    monkeypatch.setattr(routes, "get_current_user", lambda request: SimpleNamespace(id="u1"))
+
+    def get(s3, accept):
+        monkeypatch.setattr(routes, "get_s3_client", lambda: s3)
+        return TestClient(app).get(
+            "/products/image-proxy",
+            params={"url": f"https://bucket.s3.amazonaws.com/{MASTER}"},
+            headers={"Accept": accept}
+        )
+
+    return get
+
+
+def test_negotiation_prefers_the_most_compact_accepted_format():
+    assert negotiate_formats("image/avif,image/webp,*/*;q=0.8") == VARIANT_FORMATS
+    assert negotiate_formats("image/webp;q=0, image/avif") == [fmt for fmt in VARIANT_FORMATS if fmt == "image/avif"]
+    assert negotiate_formats("text/html") == []
+    assert negotiate_formats(None) == []
+
+
+def test_variant_keys_and_sniffing():
+    assert variant_key(MASTER, "image/webp") == "products/p1/generated_1_0.webp"
+    assert sniff_content_type(b"\x89PNG\r\n\x1a\n....") == "image/png"
+    assert sniff_content_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert sniff_content_type(b"\x00\x00\x00\x1cftypavif") == "image/avif"
+
+
+def test_proxy_serves_variant_with_long_max_age(proxy):
+    s3 = FakeS3({MASTER: ("image/png", b"png"), variant_key(MASTER, "image/webp"): ("image/webp", b"webp")})
+
+    response = proxy(s3, "image/webp")
+
+    assert response.content == b"webp"
+    assert response.headers["cache-control"] == "public, max-age=31536000"
+
+
+def test_recent_master_is_cached_briefly_while_its_variant_may_be_uploading(proxy):
+    s3 = FakeS3({MASTER: ("image/png", b"png")})
+
+    response = proxy(s3, "image/webp")
+    assert response.content == b"png"
+    assert response.headers["cache-control"] == f"public, max-age={routes.VARIANT_FALLBACK_MAX_AGE}"
+
+    # Remembered as missing for now, but still not pinned for a year
+    response = proxy(s3, "image/webp")
+    assert response.headers["cache-control"] == f"public, max-age={routes.VARIANT_FALLBACK_MAX_AGE}"
+    assert s3.requested.count(variant_key(MASTER, "image/webp")) == 1
+
+
+def test_master_stored_before_variants_keeps_its_long_max_age(proxy):
+    webp = variant_key(MASTER, "image/webp")
+    s3 = FakeS3({MASTER: ("image/png", b"png")}, age=routes.VARIANT_PENDING_WINDOW + 60)
+
+    response = proxy(s3, "image/webp")
+
+    assert response.headers["cache-control"] == "public, max-age=31536000"
+    assert routes._missing_variants.get(webp) is True
+
+
+def test_proxy_does_not_remember_variants_on_transient_errors(proxy):
+    webp = variant_key(MASTER, "image/webp")
+    s3 = FakeS3({MASTER: ("image/png", b"png")}, failing=[webp])
+
+    assert proxy(s3, "image/webp").content == b"png"
+    proxy(s3, "image/webp")
+    assert s3.requested.count(webp) == 2
+
+
+def test_proxy_master_without_variant_request_keeps_long_max_age(proxy):
+    s3 = FakeS3({MASTER: ("image/png", b"png")})
+
+    response = proxy(s3, "image/png")
+
+    assert response.headers["cache-control"] == "public, max-age=31536000"